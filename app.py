@@ -1,11 +1,17 @@
 import streamlit as st
+import json
 import time
 from src.config import AppConfig
-from src.services.user_service import UserService
+from src.services.user_service import UserService, ensure_master_indexes
 from src.services.auth_handler import AuthHandler
-from src.services.mongo_service import MongoService
 from src.services.llm_service import GeminiService
-from src.utils.session import init_session_state, increment_message_count, check_usage_limit
+from src.services.conversation import ConversationEngine
+from src.services.datasets import acquire_datasets, combine_datasets, refresh_datasets
+from src.services.retrieval import Retriever, KeywordQueryStrategy, LLMQueryStrategy
+from src.services.aggregation import AggregationPlanner
+from src.utils.connection_cache import get_connection_cache
+from src.utils.metrics import get_metrics
+from src.utils.session import init_session_state, increment_message_count, check_usage_limit, trim_chat_history
 
 # --- CONFIG & INIT ---
 st.set_page_config(page_title="MongoChat Platform", page_icon="🍃")
@@ -19,20 +25,74 @@ if "user_email" not in st.session_state:
 if "username" not in st.session_state:
     st.session_state.username = None
 
+# --- SESSION RESUMPTION ---
+def resume_session():
+    """
+    Restores a session from its token (cookie, or URL param in URL mode) after
+    a browser refresh: no password check and no master DB read, just the JWT
+    signature. Also re-issues the token shortly before it expires.
+    """
+    if not AppConfig.SESSION_TOKEN_IN_URL:
+        st.query_params.pop(AppConfig.SESSION_QUERY_PARAM, None) # Old links: never keep a token in the URL
+    if not st.session_state.authenticated:
+        token = st.context.cookies.get(AppConfig.SESSION_COOKIE_NAME)
+        if AppConfig.SESSION_TOKEN_IN_URL:
+            token = st.query_params.get(AppConfig.SESSION_QUERY_PARAM) or token
+        claims = AuthHandler.decode_token(token)
+        if claims is None:
+            st.query_params.pop(AppConfig.SESSION_QUERY_PARAM, None)
+            return
+        st.session_state.authenticated = True
+        st.session_state.user_email = claims["sub"]
+        st.session_state.username = claims.get("name")
+        st.session_state.token = token
+    
+    claims = AuthHandler.decode_token(st.session_state.get("token"))
+    if claims is not None and AuthHandler.needs_refresh(claims):
+        st.session_state.token = AuthHandler.refresh_token(claims) # The old token is revoked
+        if AppConfig.SESSION_TOKEN_IN_URL:
+            st.query_params[AppConfig.SESSION_QUERY_PARAM] = st.session_state.token
+
+def sync_token_cookie():
+    """
+    Mirrors st.session_state.token into the session cookie (cleared after logout).
+    Streamlit can't set cookies itself, so an st.html script writes
+    document.cookie; only when the token changed, not on every rerun.
+    """
+    token = st.session_state.get("token") or ""
+    written = st.session_state.get("cookie_token")
+    if written is None:
+        written = st.context.cookies.get(AppConfig.SESSION_COOKIE_NAME) or "" # What the browser sent
+    if token == written:
+        return
+    max_age = AuthHandler.token_lifetime_minutes() * 60 if token else 0
+    cookie = json.dumps(f"{AppConfig.SESSION_COOKIE_NAME}={token}; Max-Age={max_age}; Path=/; SameSite=Strict")
+    st.html(
+        "<script>"
+        f"document.cookie = {cookie} + (location.protocol === 'https:' ? '; Secure' : '');"
+        "</script>",
+        unsafe_allow_javascript=True, # Not iframed: runs in the app page itself
+    )
+    st.session_state.cookie_token = token
+
 # --- AUTH VIEW ---
 def login_view():
     st.title("🔐 MongoChat Login")
     
     tab1, tab2 = st.tabs(["Login", "Sign Up"])
     
-    user_svc = UserService()
+    user_svc = UserService(cache=st.session_state.user_cache)
 
     with tab1: # Login Tab
         email = st.text_input("Email")
         password = st.text_input("Password", type="password")
         
         if st.button("Login"):
-            user = user_svc.verify_user(email, password)
+            try:
+                user = user_svc.verify_user(email, password, ip_address=st.context.ip_address)
+            except (ValueError, RuntimeError) as e:
+                st.error(str(e))
+                st.stop()
             if user:
                 # Create Token
                 token = AuthHandler.create_access_token({"sub": email, "name": user["username"]})
@@ -42,6 +102,9 @@ def login_view():
                 st.session_state.user_email = email
                 st.session_state.username = user["username"]
                 st.session_state.token = token
+                if AppConfig.SESSION_TOKEN_IN_URL:
+                    st.query_params[AppConfig.SESSION_QUERY_PARAM] = token
+                # Otherwise sync_token_cookie() stores it in the cookie on the next run
                 st.success(f"Welcome back, {user['username']}!")
                 st.rerun()
             else:
@@ -61,20 +124,77 @@ def login_view():
             except Exception as e:
                 st.error(f"Error: {e}")
 
+# --- ADMIN: METRICS ---
+def metrics_view():
+    """Latency histograms, Mongo round-trips and cache hit rates (admins only)."""
+    metrics = get_metrics()
+    with st.expander("📈 Metrics"):
+        summary = metrics.to_dict()
+        for row in summary["histograms"].get("stage_seconds", []):
+            st.caption(f"{row['labels']['stage']}: n={row['count']}, p50 {row['p50'] * 1000:.0f} ms, p95 {row['p95'] * 1000:.0f} ms, p99 {row['p99'] * 1000:.0f} ms")
+        st.json(summary, expanded=False)
+        st.download_button("Prometheus export", metrics.to_prometheus(), file_name="metrics.prom")
+        st.download_button("JSON export", metrics.to_json(), file_name="metrics.json")
+
+# --- DATA SNAPSHOT ---
+def release_dataset():
+    """Drops the session's references to its shared snapshots."""
+    for handle in (st.session_state.get("mongo_handles") or {}).values():
+        handle.release()
+    st.session_state.mongo_handles = {}
+
+def session_mongo_service():
+    """The session's MongoService, reconnected first if its pooled client was closed."""
+    mongo_svc = st.session_state.mongo_service
+    if mongo_svc is None:
+        return None
+    try:
+        mongo_svc.ensure_healthy()  # No round-trip while recently healthy
+    except Exception as e:
+        st.warning(f"⚠️ Lost the database connection, answering from the loaded snapshot: {e}")
+        return None
+    return mongo_svc
+
+def refresh_mongo_snapshot():
+    """Patches new/changed/deleted documents into the shared snapshots (every session on them sees them)."""
+    mongo_svc = session_mongo_service()
+    if mongo_svc is None or not st.session_state.mongo_handles:
+        return 0
+    return refresh_datasets(mongo_svc, st.session_state.mongo_handles)
+
 # --- APP VIEW (Chat) ---
 def main_app_view():
-    user_svc = UserService()
+    # Reads of the user's document are served from the session cache when fresh
+    user_svc = UserService(cache=st.session_state.user_cache)
+    ensure_master_indexes()  # First call per process only
+    
+    # Chat input is pinned to the bottom of the page wherever it is called,
+    # so we read it first: a new message lets us check + count usage in one go.
+    prompt = st.chat_input("Ask about your data...") if st.session_state.db_connected else None
     
     # --- FETCH USAGE STATS ---
-    # We fetch this fresh every rerun to ensure accuracy
-    usage_count, usage_limit, hours_left = user_svc.get_usage_stats(st.session_state.user_email)
+    usage_allowed = True
+    if prompt:
+        # One atomic round-trip: reset window if needed, check limit, count message
+        usage_allowed, usage_count, usage_limit, hours_left = user_svc.consume_usage(st.session_state.user_email)
+    elif "usage_snapshot" in st.session_state:
+        # Rerun right after a message: reuse the numbers consume_usage() returned
+        usage_count, usage_limit, hours_left = st.session_state.pop("usage_snapshot")
+    else:
+        usage_count, usage_limit, hours_left = user_svc.get_usage_stats(st.session_state.user_email)
     
     with st.sidebar:
         # ... (Keep User Profile & Logout) ...
         st.write(f"👤 **{st.session_state.username}**")
 
         # ✅ RESTORE LOGOUT BUTTON HERE
+        if (st.session_state.user_email or "").lower() in AppConfig.ADMIN_EMAILS:
+            metrics_view()
+
         if st.button("Log out", type="secondary"):
+            AuthHandler.revoke_token(st.session_state.get("token"))
+            st.query_params.pop(AppConfig.SESSION_QUERY_PARAM, None)
+            release_dataset()
             st.session_state.clear() # Wipes session (auth, token, db connection)
             st.rerun() # Refreshes to show Login View
         
@@ -94,17 +214,25 @@ def main_app_view():
         st.divider()
         st.header("🔌 Database Connection")
         
-        user_svc = UserService()
-        
         # 1. IF CONNECTED: Show Disconnect Option
         if st.session_state.db_connected:
             st.success("✅ Linked to Database")
             st.caption(f"Using saved connection for: {st.session_state.user_email}")
+            _, stats, _ = combine_datasets(st.session_state.mongo_handles)
+            if stats:
+                st.caption(f"Context: {stats['docs']} docs, {stats['fields']} fields, ~{stats['approx_tokens']:,} tokens")
+            if len(st.session_state.mongo_handles) > 1:
+                st.caption("Collections: " + ", ".join(st.session_state.mongo_handles))
+            
+            if st.button("🔄 Refresh Data"):
+                changes = refresh_mongo_snapshot()
+                st.toast(f"{max(changes, 0)} change(s) applied" if changes != -1 else "Collection reloaded")
             
             if st.button("❌ Disconnect / Switch Database"):
                 # Clear session state for DB
                 st.session_state.db_connected = False
-                st.session_state.mongo_data = None
+                release_dataset() # The snapshot stays shared while other sessions use it
+                st.session_state.mongo_service = None # Connection stays pooled for a quick reconnect
                 # Optional: You could also delete the saved config from DB if you wanted
                 # user_svc.delete_user_config(st.session_state.user_email) 
                 st.rerun()
@@ -123,7 +251,7 @@ def main_app_view():
             st.caption("Enter your MongoDB Atlas details:")
             mongo_uri = st.text_input("Connection String", value=def_uri, type="password")
             db_name = st.text_input("Database Name", value=def_db)
-            col_name = st.text_input("Collection Name", value=def_col)
+            col_name = st.text_input("Collection Name(s)", value=def_col, help="Comma-separated, or * for every collection in the database")
             
             if st.button("Connect & Save"):
                 if not (mongo_uri and db_name and col_name):
@@ -131,16 +259,21 @@ def main_app_view():
                 else:
                     try:
                         with st.spinner("Connecting..."):
-                            # A. Test Connection
-                            mongo_svc = MongoService()
-                            mongo_svc.connect(mongo_uri, db_name, col_name)
-                            data = mongo_svc.fetch_documents(limit=AppConfig.DOC_FETCH_LIMIT)
+                            # A. Test Connection (reuses a cached connection if we have one)
+                            mongo_svc = get_connection_cache().get_or_connect(
+                                st.session_state.user_email, mongo_uri, db_name, col_name
+                            )
+                            # Collections are fetched and profiled in parallel; sessions on
+                            # the same source share one snapshot per collection (fetched once)
+                            handles = acquire_datasets(mongo_svc)
                             
                             # B. Save Config to Master DB (So they don't type it next time)
                             user_svc.save_user_config(st.session_state.user_email, mongo_uri, db_name, col_name)
                             
                             # C. Update Session
-                            st.session_state.mongo_data = data
+                            release_dataset()
+                            st.session_state.mongo_handles = handles
+                            st.session_state.mongo_service = mongo_svc
                             st.session_state.db_connected = True
                             st.rerun()
                             
@@ -155,13 +288,15 @@ def main_app_view():
         return
 
     # ... (Insert your existing Chat UI Logic here) ...
+    if st.session_state.archived_messages:
+        st.caption(f"{st.session_state.archived_messages} earlier message(s) archived")
     for msg in st.session_state.chat_history:
         with st.chat_message(msg["role"]):
             st.markdown(msg["content"])
 
-    if prompt := st.chat_input("Ask about your data..."):
+    if prompt:
         # --- 1. BLOCK IF LIMIT REACHED ---
-        if usage_count >= usage_limit:
+        if not usage_allowed:
             st.error(f"🚫 Daily limit of {usage_limit} messages reached. Please wait {int(hours_left)} hours.")
             return # Stop execution here
 
@@ -170,28 +305,79 @@ def main_app_view():
             st.markdown(prompt)
 
         with st.chat_message("assistant"):
-            with st.spinner("Thinking..."):
-                try:
-                    # (Keep your existing LLM logic)
-                    llm_svc = GeminiService(api_key=AppConfig.GEMINI_API_KEY)
-                    response_text = llm_svc.generate_response(
-                        context_data=st.session_state.mongo_data,
-                        user_question=prompt
-                    )
-                    
-                    st.markdown(response_text)
-                    st.session_state.chat_history.append({"role": "assistant", "content": response_text})
-                    
-                    # --- 2. INCREMENT DB COUNTER ---
-                    # Only increment if successful
-                    user_svc.increment_usage(st.session_state.user_email)
-                    
-                    st.rerun() # Refresh to update the sidebar bar immediately
-                except Exception as e:
-                    st.error(str(e))
+            try:
+                # Shows queue position/ETA if the AI is busy
+                queue_status = st.empty()
+                
+                llm_svc = GeminiService(api_key=AppConfig.GEMINI_API_KEY)
+                
+                if AppConfig.AUTO_REFRESH_CONTEXT:
+                    refresh_mongo_snapshot()
+                
+                dataset, _, profile_summary = combine_datasets(st.session_state.mongo_handles)
+                # Dataset + profile form a prefix reused across turns; each turn only
+                # adds the matching documents and a bounded window of the chat so far
+                conversation = ConversationEngine(dataset, profile_summary)
+                context_data, context_label = dataset, None
+                mongo_svc = session_mongo_service()
+                complete = lambda p: llm_svc.complete(p, user_id=st.session_state.user_email)
+                if mongo_svc is not None and AggregationPlanner.wants(prompt):
+                    # Counts/averages/breakdowns: MongoDB computes them over the whole
+                    # collection and only the small result goes into the prompt.
+                    # Cached per (dataset, question): a repeat plans nothing and the
+                    # answer cache (keyed by the same result) serves it without quota
+                    planner = AggregationPlanner(mongo_svc, complete)
+                    result = planner.run(prompt, profile_summary, context_hash=conversation.prefix_hash)
+                    if result is not None:
+                        context_data, context_label = result, AggregationPlanner.CONTEXT_LABEL
+                if mongo_svc is not None and context_label is None:
+                    # Read only the documents relevant to this question (snapshot as fallback)
+                    if AppConfig.RETRIEVAL_STRATEGY == "llm":
+                        strategy = LLMQueryStrategy(complete)
+                    else:
+                        strategy = KeywordQueryStrategy()
+                    retriever = Retriever(mongo_svc, strategy)
+                    context_data, _ = retriever.retrieve(prompt, fallback=dataset)
+                
+                stream = llm_svc.stream_response(
+                    context_data=context_data,
+                    user_question=prompt,
+                    user_id=st.session_state.user_email,
+                    on_wait=lambda pos, eta: queue_status.caption(f"⏳ In queue: #{pos}, about {int(eta) + 1}s"),
+                    conversation=conversation,
+                    history=st.session_state.chat_history[:-1], # Without the question just added
+                    context_label=context_label
+                )
+                
+                # Render tokens as they arrive instead of waiting for the full answer
+                response_text = st.write_stream(stream)
+                queue_status.empty()
+                st.session_state.chat_history.append({"role": "assistant", "content": response_text})
+                trim_chat_history(lambda msgs: user_svc.archive_chat_messages(st.session_state.user_email, msgs))
+                
+                # --- 2. DB COUNTER ---
+                if llm_svc.last_stream_completed:
+                    # Already counted by consume_usage(); hand the result to the next rerun
+                    st.session_state.usage_snapshot = (usage_count, usage_limit, hours_left)
+                else:
+                    # Limit message or API error: don't charge the user for it
+                    user_svc.refund_usage(st.session_state.user_email)
+                
+                st.rerun() # Refresh to update the sidebar bar immediately
+            except Exception as e:
+                # Only successful messages count against the quota
+                user_svc.refund_usage(st.session_state.user_email)
+                st.error(str(e))
 
 # --- ROUTER ---
-if not st.session_state.authenticated:
-    login_view()
-else:
-    main_app_view()
\ No newline at end of file
+# Times the whole rerun and counts its Mongo round-trips (st.rerun/st.stop raise, hence finally)
+get_metrics().begin_rerun()
+try:
+    resume_session()
+    sync_token_cookie() # A browser refresh resumes from the cookie
+    if not st.session_state.authenticated:
+        login_view()
+    else:
+        main_app_view()
+finally:
+    get_metrics().end_rerun()
\ No newline at end of file
@@ -0,0 +1,199 @@
+"""
+Simulates N concurrent users doing sign up -> login -> connect -> K chat turns
+against the real services, with a fake Gemini model and either a local mongod
+(--mongo-uri) or the in-memory stand-in.
+
+    python -m benchmarks.load_test --users 20 --turns 5
+    python -m benchmarks.load_test --mongo-uri mongodb://localhost:27017 --json run.json
+    python -m benchmarks.load_test --baseline run.json
+
+Reports throughput, p50/p95/p99 per stage and MongoDB round-trips per turn.
+"""
+import argparse
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from benchmarks.report import Recorder, compare, print_table, save, summarize
+from benchmarks.stand_ins import FakeGeminiModel, install_in_memory_mongo, make_documents, prepare_env, seed_collection
+
+QUESTIONS = [
+    "What are the top 5 most expensive products?",
+    "How many products are in the electronics category?",
+    "Which products have the lowest stock?",
+    "What is the average rating of books?",
+    "List the newest products",
+    "Show me some garden products on sale",
+    "Which category has the cheapest items?",
+    "What are the top 3 rated toys?",
+]
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=10, help="Concurrent simulated users")
+    parser.add_argument("--turns", type=int, default=5, help="Chat turns per user")
+    parser.add_argument("--think", type=float, default=0.0, help="Seconds a user waits between turns")
+    parser.add_argument("--docs", type=int, default=2000, help="Documents in the chatted-with collection")
+    parser.add_argument("--mongo-uri", help="Local mongod (default: in-memory stand-in)")
+    parser.add_argument("--mongo-rtt-ms", type=float, default=0.0, help="Simulated round-trip time for the stand-in")
+    parser.add_argument("--ttft", type=float, default=0.3, help="Fake model: seconds to first token")
+    parser.add_argument("--tps", type=float, default=200, help="Fake model: tokens per second")
+    parser.add_argument("--answer-tokens", type=int, default=150)
+    parser.add_argument("--rpm", type=int, default=100_000, help="MAX_RPM for the run (the free tier's 5 would dominate)")
+    parser.add_argument("--bcrypt-rounds", type=int, default=12)
+    parser.add_argument("--no-response-cache", action="store_true")
+    parser.add_argument("--json", help="Write the results to this file")
+    parser.add_argument("--baseline", help="Compare against results saved with --json")
+    return parser.parse_args(argv)
+
+def run_user(i, args, rec, model, admission, data_uri, db_name, col_name):
+    # Imported here so the module loads fast for --help; settings resolve lazily either way
+    from src.config import AppConfig
+    from src.services.conversation import ConversationEngine
+    from src.services.datasets import acquire_datasets, combine_datasets
+    from src.services.llm_service import GeminiService
+    from src.services.retrieval import KeywordQueryStrategy, Retriever
+    from src.services.user_service import UserService
+    from src.utils.connection_cache import get_connection_cache
+    from src.utils.metrics import get_metrics
+    from src.utils.user_cache import UserCache
+
+    metrics = get_metrics()
+    email = f"user{i}@bench.local"
+    password = f"password-{i}"
+    user_svc = UserService(cache=UserCache())
+
+    with rec.stage("signup"):
+        user_svc.create_user(email, f"user{i}", password)
+    with rec.stage("login"):
+        if not user_svc.verify_user(email, password, ip_address=f"10.0.{i // 250}.{i % 250}"):
+            raise RuntimeError(f"Login failed for {email}")
+
+    with rec.stage("connect"):
+        mongo_svc = get_connection_cache().get_or_connect(email, data_uri, db_name, col_name)
+        handles = acquire_datasets(mongo_svc)
+        data, _, profile_summary = combine_datasets(handles)
+        user_svc.save_user_config(email, data_uri, db_name, col_name)
+
+    history = []
+    for k in range(args.turns):
+        question = QUESTIONS[(i + k) % len(QUESTIONS)]
+        metrics.begin_rerun()
+        started = time.perf_counter()
+
+        with rec.stage("turn.usage"):
+            allowed = user_svc.consume_usage(email)[0]
+        if not allowed:
+            rec.count("turns_blocked")
+            metrics.end_rerun()
+            continue
+
+        with rec.stage("turn.retrieve"):
+            context, _ = Retriever(mongo_svc, KeywordQueryStrategy()).retrieve(question, fallback=data)
+
+        llm = GeminiService(api_key=AppConfig.GEMINI_API_KEY, model=model, admission=admission)
+        conversation = ConversationEngine(data, profile_summary)
+        llm_started = time.perf_counter()
+        parts = []
+        for chunk in llm.stream_response(context, question, user_id=email,
+                                         conversation=conversation, history=history):
+            if not parts:
+                rec.add("turn.first_token", time.perf_counter() - llm_started)
+            parts.append(chunk)
+        rec.add("turn.llm", time.perf_counter() - llm_started)
+
+        if llm.last_stream_completed:
+            rec.count("turns_completed")
+            rec.count("cache_hits" if llm.last_cache_hit else "model_calls")
+        else:
+            user_svc.refund_usage(email)
+            rec.count("turns_failed")
+        history += [{"role": "user", "content": question}, {"role": "assistant", "content": "".join(parts)}]
+
+        rec.add("turn.total", time.perf_counter() - started)
+        rec.add("mongo_ops_per_turn", metrics.mongo_listener.current().value)
+        metrics.end_rerun()
+        if args.think:
+            time.sleep(args.think)
+    for handle in handles.values():
+        handle.release()
+
+def main(argv=None):
+    args = parse_args(argv)
+    prepare_env(args.mongo_uri, args.bcrypt_rounds)
+
+    from src.config import AppConfig
+    from src.utils.admission import AdmissionQueue
+    from src.utils.metrics import get_metrics
+    from src.utils.rate_limiter import InMemoryRateLimiter
+
+    # Limits sized for the run: we measure the pipeline, not the free tier's quotas
+    AppConfig.MAX_RPM = args.rpm
+    AppConfig.MAX_RPD = args.rpm * 24 * 60
+    AppConfig.MAX_FREE_MESSAGES = args.turns + 1
+    AppConfig.RESPONSE_CACHE_ENABLED = not args.no_response_cache
+
+    server = None
+    if args.mongo_uri:
+        data_uri = args.mongo_uri
+    else:
+        server = install_in_memory_mongo(args.mongo_rtt_ms / 1000)
+        data_uri = "mongodb://stand-in-tenant:27017/"
+
+    db_name, col_name = "bench_data", "products"
+    seed_collection(data_uri, db_name, col_name, make_documents(args.docs))
+    # Fresh accounts for every run
+    from src.services.user_service import UserService
+    UserService().users_col.delete_many({"email": {"$regex": "@bench\\.local$"}})
+
+    model = FakeGeminiModel(ttft=args.ttft, tokens_per_second=args.tps, answer_tokens=args.answer_tokens)
+    admission = AdmissionQueue(InMemoryRateLimiter(), max_queue=args.users, max_per_user=1)
+    rec = Recorder()
+    errors = []
+    lock = threading.Lock()
+
+    def user(i):
+        try:
+            run_user(i, args, rec, model, admission, data_uri, db_name, col_name)
+        except Exception as e:
+            with lock:
+                errors.append(f"user {i}: {e}")
+
+    print(f"{args.users} users x {args.turns} turns, {args.docs} docs, "
+          f"{'mongod at ' + args.mongo_uri if args.mongo_uri else 'in-memory Mongo'}, "
+          f"fake model ttft={args.ttft}s tps={args.tps}")
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.users) as pool:
+        list(pool.map(user, range(args.users)))
+    elapsed = time.perf_counter() - started
+
+    summary = rec.summary()
+    ops = summary.pop("mongo_ops_per_turn", summarize([]))
+    completed = rec.counters.get("turns_completed", 0)
+    result = {
+        "args": vars(args),
+        "elapsed_seconds": elapsed,
+        "turns_per_second": completed / elapsed if elapsed else 0.0,
+        "mongo_ops_per_turn": ops["mean"],
+        "mongo_ops_per_turn_p95": ops["p95"],
+        "counters": dict(rec.counters),
+        "stages": summary,
+        "metrics": get_metrics().to_dict(),
+    }
+
+    print_table(summary, title="Per-stage latency")
+    print(f"\nThroughput: {result['turns_per_second']:.2f} turns/s over {elapsed:.1f}s  {dict(rec.counters)}")
+    print(f"Mongo round-trips per turn: mean {ops['mean']:.1f}, p95 {ops['p95']:.0f}"
+          + (f" (stand-in total {server.ops})" if server else ""))
+    for name in ("llm_prompt_bytes", "llm_prompt_tokens"):
+        for row in result["metrics"]["histograms"].get(name, []):
+            print(f"{name}: mean {row['mean']:.0f}, p95 {row['p95']:.0f}")
+    if errors:
+        print(f"\n{len(errors)} user(s) failed, first: {errors[0]}")
+
+    if args.json:
+        save(args.json, result)
+    if args.baseline:
+        compare(args.baseline, result)
+
+if __name__ == "__main__":
+    main()
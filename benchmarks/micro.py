@@ -0,0 +1,498 @@
+"""
+Focused benchmarks for single components.
+
+    python -m benchmarks.micro serializer            # BsonJsonEncoder vs bson.json_util (time, peak memory)
+    python -m benchmarks.micro context               # prompt JSON size vs the old indent=2 dump
+    python -m benchmarks.micro usage                 # round-trips per message: read-then-write vs consume_usage
+    python -m benchmarks.micro limiter --threads 100 # check_limits latency under contention
+    python -m benchmarks.micro bcrypt --logins 200   # login throughput and tail latency
+    python -m benchmarks.micro attach --collections 4 --mongo-rtt-ms 20  # parallel vs one-by-one
+    python -m benchmarks.micro sessions --sessions 100 # RSS per 100 sessions, own vs shared snapshots
+    python -m benchmarks.micro aggregate --docs 20000  # prompt bytes: sample docs vs pipeline result
+    python -m benchmarks.micro stream-memory --mongo-uri mongodb://localhost:27017
+    python -m benchmarks.micro mongo-limiter --mongo-uri mongodb://localhost:27017 --processes 4
+
+The last two need a real mongod: the in-memory stand-in decodes every
+document up front and has no cross-process state.
+"""
+import argparse
+import gc
+import json
+import multiprocessing
+import os
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from benchmarks.report import Recorder, print_table
+from benchmarks.stand_ins import install_in_memory_mongo, make_documents, make_mixed_documents, prepare_env, seed_collection
+
+def _best_of(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+# --- Serialization ---
+def _peak_memory(fn) -> int:
+    """Peak bytes allocated while fn runs (its result included), per tracemalloc."""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def bench_serializer(args):
+    from bson import json_util
+    from src.utils.bson_json import BsonJsonEncoder
+
+    docs = make_mixed_documents(args.docs)
+    relaxed = BsonJsonEncoder(mode="relaxed", max_string_chars=None, max_array_items=None)
+    prompt = BsonJsonEncoder()
+    options = json_util.JSONOptions(json_mode=json_util.JSONMode.RELAXED)
+
+    # The relaxed encoder stands in for json_util, so its output must parse to the same values
+    mismatched = sum(json.loads(relaxed.dumps(d)) != json.loads(json_util.dumps(d, json_options=options)) for d in docs)
+
+    runs = {
+        "json_util.dumps": lambda: [json_util.dumps(d, json_options=options) for d in docs],
+        "encoder relaxed": lambda: [relaxed.dumps(d) for d in docs],
+        "encoder prompt": lambda: [prompt.dumps(d) for d in docs],
+    }
+    print(f"{len(docs)} mixed-type documents, best of {args.repeat}; relaxed output differs from json_util on {mismatched}")
+    baseline = None
+    for name, fn in runs.items():
+        seconds = _best_of(fn, args.repeat)
+        baseline = baseline or seconds
+        peak = _peak_memory(fn)  # Separate run: tracemalloc slows allocation down
+        print(f"  {name:<18}{seconds * 1000:>9.1f} ms  {seconds / len(docs) * 1e6:>7.1f} us/doc  "
+              f"x{baseline / seconds:.2f}  peak {peak / 1e6:>6.1f} MB")
+
+def bench_context(args):
+    from src.services.context_builder import ContextBuilder
+
+    docs = make_documents(args.docs, description_chars=args.description_chars)
+    old = json.dumps(docs, indent=2, default=str)
+    new, stats = ContextBuilder().build(docs)
+    # The builder stops at CONTEXT_MAX_BYTES, so compare per document as well
+    for name, text, count in (("json.dumps indent=2", old, len(docs)), ("ContextBuilder", new, stats["docs"])):
+        size = len(text.encode("utf-8"))
+        print(f"  {name:<22}{size:>10} bytes  ~{size // 4:>8} tokens  {size / max(count, 1):>8.0f} bytes/doc")
+    print(f"  builder kept {stats['docs']}/{stats['docs_seen']} docs, dropped {stats['fields_dropped']} fields")
+
+# --- Usage accounting ---
+def _legacy_usage(users_col, email, limit):
+    """The chat path before consume_usage(): read, maybe reset, then $inc (2-3 round-trips)."""
+    from datetime import datetime, timedelta, timezone
+
+    user = users_col.find_one({"email": email})
+    now = datetime.now(timezone.utc)
+    last_reset = user.get("last_reset_time", now)
+    if last_reset.tzinfo is None:
+        last_reset = last_reset.replace(tzinfo=timezone.utc)
+    count = user.get("message_count", 0)
+    if now - last_reset > timedelta(hours=24):
+        users_col.update_one({"email": email}, {"$set": {"message_count": 0, "last_reset_time": now}})
+        count = 0
+    if count >= limit:
+        return False
+    users_col.update_one({"email": email}, {"$inc": {"message_count": 1}})
+    return True
+
+def bench_usage(args):
+    """Round-trips, latency and over-admission per message: legacy read-then-write vs consume_usage()."""
+    from datetime import datetime, timedelta, timezone
+    from src.config import AppConfig
+    from src.services.user_service import UserService
+
+    server = install_in_memory_mongo(args.mongo_rtt_ms / 1000)
+    user_svc = UserService()
+    users_col = user_svc.users_col
+    limit = AppConfig.MAX_FREE_MESSAGES = args.messages + 1
+    runs = {
+        "legacy": lambda email: _legacy_usage(users_col, email, limit),
+        "consume_usage": lambda email: user_svc.consume_usage(email)[0],
+    }
+    print(f"{args.messages} messages per window, simulated RTT {args.mongo_rtt_ms} ms")
+    for name, send in runs.items():
+        rec = Recorder()
+        for expired in (False, True):
+            email = f"{name}-{expired}@bench.local"
+            last_reset = datetime.now(timezone.utc) - timedelta(hours=25 if expired else 1)
+            users_col.insert_one({"email": email, "message_count": 0, "last_reset_time": last_reset})
+            ops = server.ops
+            with rec.stage("message, window expired" if expired else "message in window"):
+                send(email)
+            rec.count("round-trips " + ("expired" if expired else "in window"), server.ops - ops)
+            for _ in range(args.messages - 1):
+                with rec.stage("message in window"):
+                    send(email)
+
+        # The race the atomic update closes: one message left, many sessions at once
+        email = f"{name}-race@bench.local"
+        users_col.insert_one({"email": email, "message_count": limit - 1, "last_reset_time": datetime.now(timezone.utc)})
+        with ThreadPoolExecutor(max_workers=args.sessions) as pool:
+            admitted = sum(pool.map(lambda _: bool(send(email)), range(args.sessions)))
+        print_table(rec.summary(), title=name)
+        print(f"  {rec.counters}; {args.sessions} concurrent sessions with 1 message left: {admitted} admitted")
+
+# --- Rate limiting ---
+class LegacyRateLimiter:
+    """The limiter before the rework: one lock held across a system_stats read per check."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.rpm_requests = []
+
+    def check_limits(self):
+        from src.config import AppConfig
+        from src.services.user_service import UserService
+
+        with self.lock:
+            now = time.time()
+            self.rpm_requests = [t for t in self.rpm_requests if now - t < 60]
+            if len(self.rpm_requests) >= AppConfig.MAX_RPM:
+                return "RPM_LIMIT"
+            try:
+                if UserService().get_global_daily_usage() >= AppConfig.MAX_RPD:
+                    return "DAILY_LIMIT"
+            except Exception:
+                return "DAILY_LIMIT"
+            return "OK"
+
+    def record_request(self):
+        from src.services.user_service import UserService
+
+        with self.lock:
+            self.rpm_requests.append(time.time())
+            UserService().increment_global_usage()
+
+def bench_limiter(args):
+    from src.config import AppConfig
+    from src.services.user_service import UserService
+    from src.utils.rate_limiter import DailyQuotaLease, InMemoryRateLimiter
+
+    install_in_memory_mongo(args.mongo_rtt_ms / 1000)
+    total = args.threads * args.calls
+    AppConfig.MAX_RPM = total + 1
+    AppConfig.MAX_RPD = total + 1
+    limiters = {
+        "legacy (lock across DB)": LegacyRateLimiter(),
+        "deque + leased RPD": InMemoryRateLimiter(DailyQuotaLease(lease_size=args.lease_size)),
+    }
+    for name, limiter in limiters.items():
+        UserService().db["system_stats"].delete_many({})  # Each run starts with the full daily budget
+        rec = Recorder()
+        start = threading.Barrier(args.threads)
+
+        def worker(_):
+            start.wait()
+            for _ in range(args.calls):
+                with rec.stage("check_limits"):
+                    verdict = limiter.check_limits()
+                rec.count(verdict)
+                if verdict == "OK":
+                    limiter.record_request()
+
+        with ThreadPoolExecutor(max_workers=args.threads) as pool:
+            list(pool.map(worker, range(args.threads)))
+        if hasattr(limiter, "daily_quota"):
+            limiter.daily_quota.shutdown()
+        print_table(rec.summary(), unit="us", scale=1e6,
+                    title=f"{name}: {args.threads} threads x {args.calls} calls, "
+                          f"simulated RTT {args.mongo_rtt_ms} ms, lease size {args.lease_size}")
+        print(f"  {rec.counters}")
+
+def _limiter_process(uri, max_rpm, calls, start_at, results):
+    prepare_env(uri)
+    from src.config import AppConfig
+    from src.utils.rate_limiter import MongoRateLimiter
+
+    AppConfig.MAX_RPM = max_rpm
+    AppConfig.MAX_RPD = max_rpm * 1000
+    limiter = MongoRateLimiter()
+    time.sleep(max(0.0, start_at - time.time()))
+    admitted = 0
+    for _ in range(calls):
+        if limiter.check_limits() == "OK":
+            limiter.record_request()
+            admitted += 1
+    limiter.daily_quota.shutdown()
+    results.put(admitted)
+
+def bench_mongo_limiter(args):
+    """Several processes share MAX_RPM through the master DB; admissions must not exceed it."""
+    from src.services.user_service import UserService
+
+    # Wait for a fresh minute so every process reserves in the same bucket
+    if 60 - time.time() % 60 < 10:
+        time.sleep(60 - time.time() % 60)
+    bucket = int(time.time() // 60)
+    UserService().db["rate_limit_buckets"].delete_one({"_id": f"rpm:{bucket}"})
+
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    start_at = time.time() + 5  # Room for the children to import and connect
+    procs = [ctx.Process(target=_limiter_process, args=(args.mongo_uri, args.rpm, args.calls, start_at, results))
+             for _ in range(args.processes)]
+    for p in procs:
+        p.start()
+    admitted = [results.get(timeout=120) for _ in procs]
+    for p in procs:
+        p.join()
+    print(f"  {args.processes} processes x {args.calls} calls, MAX_RPM {args.rpm}")
+    print(f"  admitted per process {admitted}, total {sum(admitted)} "
+          f"({'within' if sum(admitted) <= args.rpm else 'OVER'} the cap)")
+
+# --- Password hashing ---
+def bench_bcrypt(args):
+    from src.utils.password_hasher import PasswordHasher
+
+    hasher = PasswordHasher(rounds=args.rounds, max_workers=args.workers, max_pending=args.pending)
+    hashed = hasher.hash("correct horse")
+    rec = Recorder()
+
+    def login(_):
+        started = time.perf_counter()
+        try:
+            hasher.verify("correct horse", hashed)
+            rec.count("ok")
+        except RuntimeError:
+            rec.count("busy")
+        rec.add("verify", time.perf_counter() - started)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(login, range(args.logins)))
+    elapsed = time.perf_counter() - started
+    hasher.shutdown()
+    print_table(rec.summary(), title=f"{args.logins} logins, {args.concurrency} at once, "
+                                     f"cost {args.rounds}, {args.workers} workers")
+    print(f"  {rec.counters.get('ok', 0) / elapsed:.1f} logins/s  {rec.counters}")
+
+# --- Cursor streaming ---
+def bench_stream_memory(args):
+    from src.services.mongo_service import MongoService
+
+    seed_collection(args.mongo_uri, "bench_data", "stream", make_documents(args.docs, args.description_chars))
+    svc = MongoService()
+    svc.connect(args.mongo_uri, "bench_data", "stream")
+
+    def materialized():
+        return sum(1 for _ in list(svc.collection.find({})))
+
+    def streamed():
+        return sum(1 for _ in svc.stream_documents(max_bytes=0))
+
+    for name, fn in (("list(find())", materialized), ("stream_documents()", streamed)):
+        tracemalloc.start()
+        count = fn()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f"  {name:<20}{count:>8} docs  peak {peak / 1e6:>8.1f} MB")
+
+# --- Multi-collection attach ---
+def bench_attach(args):
+    """Connect time for N collections: fetched + profiled one by one vs on the shared pool."""
+    from src.services.datasets import for_each_collection, load_dataset
+    from src.services.mongo_service import MongoService
+    from src.utils.profile_cache import get_profile_cache
+
+    uri = args.mongo_uri or "mongodb://stand-in-tenant:27017/"
+    if not args.mongo_uri:
+        install_in_memory_mongo(args.mongo_rtt_ms / 1000)
+    names = [f"col{i}" for i in range(args.collections)]
+    for name in names:
+        seed_collection(uri, "bench_attach", name, make_documents(args.docs, seed=hash(name) % 100))
+
+    svc = MongoService()
+    svc.connect(uri, "bench_attach", "*")
+    runs = {
+        "one by one": lambda: [load_dataset(child) for child in svc.attached.values()],
+        "parallel": lambda: for_each_collection(svc, load_dataset),
+    }
+    print(f"{len(svc.attached)} collections x {args.docs} docs, simulated RTT {args.mongo_rtt_ms} ms, best of {args.repeat}")
+    for name, fn in runs.items():
+        best = float("inf")
+        for _ in range(args.repeat):
+            get_profile_cache().entries.clear()  # Measure cold connects
+            started = time.perf_counter()
+            fn()
+            best = min(best, time.perf_counter() - started)
+        print(f"  {name:<12}{best * 1000:>9.1f} ms")
+
+# --- Server-side aggregation ---
+def bench_aggregate(args):
+    """Prompt bytes and answer coverage for "products and average price per category": sample docs vs a pipeline."""
+    from src.config import AppConfig
+    from src.services.aggregation import AggregationPlanner
+    from src.services.mongo_service import MongoService
+
+    uri = args.mongo_uri or "mongodb://stand-in-tenant:27017/"
+    if not args.mongo_uri:
+        install_in_memory_mongo()
+    seed_collection(uri, "bench_data", "products", make_documents(args.docs))
+    svc = MongoService()
+    svc.connect(uri, "bench_data", "products")
+
+    started = time.perf_counter()
+    sample, stats = svc.fetch_context(limit=AppConfig.DOC_FETCH_LIMIT)
+    sample_seconds = time.perf_counter() - started
+
+    # What the model is expected to reply for the question
+    pipeline = [{"$group": {"_id": "$category", "n": {"$sum": 1}, "avg_price": {"$avg": "$price"}}},
+                {"$sort": {"n": -1}}]
+    planner = AggregationPlanner(svc, lambda prompt: json.dumps({"collection": "products", "pipeline": pipeline}))
+    started = time.perf_counter()
+    result = planner.run("How many products are there per category, and what is their average price?")
+    pipeline_seconds = time.perf_counter() - started
+
+    print(f"{args.docs} documents, question: products and average price per category")
+    for name, text, covered, seconds in (("sample docs", sample, stats["docs"], sample_seconds),
+                                         ("pipeline", result, args.docs, pipeline_seconds)):
+        # mongomock scans and copies the collection for every aggregate: only time a real server
+        timing = f"  {seconds * 1000:>7.1f} ms" if args.mongo_uri else ""
+        print(f"  {name:<14}{len(text.encode()):>9} prompt bytes  covers {covered:>6} docs{timing}")
+
+# --- Session memory ---
+def _rss_bytes() -> int:
+    """Current resident set size (Linux)."""
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+def _sessions_process(mode, args, results):
+    prepare_env(args.mongo_uri)
+    from src.config import AppConfig
+    from src.services.mongo_service import MongoService
+    from src.utils.snapshot_store import get_snapshot_store, snapshot_key
+
+    uri = args.mongo_uri or "mongodb://stand-in-tenant:27017/"
+    if not args.mongo_uri:
+        install_in_memory_mongo()
+    seed_collection(uri, "bench_data", "sessions", make_documents(AppConfig.DOC_FETCH_LIMIT, args.description_chars))
+    svc = MongoService()
+    svc.connect(uri, "bench_data", "sessions")
+    answer = "word " * (args.answer_chars // 5)
+
+    def load():
+        snapshot = svc.fetch_snapshot(limit=AppConfig.DOC_FETCH_LIMIT)
+        data, stats = svc.render_snapshot(snapshot)
+        return snapshot, data, stats, None
+
+    # Warm-up, so imports and pools are not counted against the first session
+    load()
+    gc.collect()
+    before = _rss_bytes()
+
+    sessions = []
+    key = snapshot_key(uri, "bench_data", "sessions", {"limit": AppConfig.DOC_FETCH_LIMIT})
+    for _ in range(args.sessions):
+        history = []
+        for t in range(args.turns):
+            history += [{"role": "user", "content": f"question {t} about the data?"},
+                        {"role": "assistant", "content": answer + str(t)}]
+        if mode == "own copy":
+            snapshot, data, stats, _ = load()
+            sessions.append({"snapshot": snapshot, "data": data, "stats": stats, "chat_history": history})
+        else:
+            # What trim_chat_history() leaves in the session; the rest is archived
+            history = history[-AppConfig.CHAT_HISTORY_MAX_MESSAGES:]
+            sessions.append({"handle": get_snapshot_store().acquire(key, load), "chat_history": history})
+
+    gc.collect()
+    results.put((mode, _rss_bytes() - before))
+
+def bench_sessions(args):
+    """RSS growth for N sessions: each with its own snapshot + full history, vs shared handles + capped history."""
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    print(f"{args.sessions} sessions, {args.turns} turns each, {args.description_chars}-char descriptions")
+    for mode in ("own copy", "shared store"):
+        # A fresh process per mode: RSS rarely shrinks once memory was touched
+        p = ctx.Process(target=_sessions_process, args=(mode, args, results))
+        p.start()
+        name, grown = results.get(timeout=300)
+        p.join()
+        print(f"  {name:<14}{grown / 1e6:>9.1f} MB RSS  {grown / args.sessions / 1e3:>8.0f} KB/session")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="bench", required=True)
+
+    p = sub.add_parser("serializer")
+    p.add_argument("--docs", type=int, default=10_000)
+    p.add_argument("--repeat", type=int, default=5)
+    p.set_defaults(fn=bench_serializer)
+
+    p = sub.add_parser("context")
+    p.add_argument("--docs", type=int, default=50)
+    p.add_argument("--description-chars", type=int, default=1200)
+    p.set_defaults(fn=bench_context)
+
+    p = sub.add_parser("usage")
+    p.add_argument("--messages", type=int, default=20)
+    p.add_argument("--sessions", type=int, default=10)
+    p.add_argument("--mongo-rtt-ms", type=float, default=1.0, help="Simulated round-trip time for the stand-in")
+    p.set_defaults(fn=bench_usage)
+
+    p = sub.add_parser("limiter")
+    p.add_argument("--threads", type=int, default=100)
+    p.add_argument("--calls", type=int, default=50)
+    p.add_argument("--lease-size", type=int, default=20)
+    p.add_argument("--mongo-rtt-ms", type=float, default=1.0, help="Simulated round-trip time for the stand-in")
+    p.set_defaults(fn=bench_limiter)
+
+    p = sub.add_parser("mongo-limiter")
+    p.add_argument("--mongo-uri", required=True)
+    p.add_argument("--processes", type=int, default=4)
+    p.add_argument("--calls", type=int, default=50)
+    p.add_argument("--rpm", type=int, default=60)
+    p.set_defaults(fn=bench_mongo_limiter)
+
+    p = sub.add_parser("bcrypt")
+    p.add_argument("--logins", type=int, default=100)
+    p.add_argument("--concurrency", type=int, default=20)
+    p.add_argument("--rounds", type=int, default=12)
+    p.add_argument("--workers", type=int, default=2)
+    p.add_argument("--pending", type=int, default=16)
+    p.set_defaults(fn=bench_bcrypt)
+
+    p = sub.add_parser("attach")
+    p.add_argument("--mongo-uri", help="Local mongod (default: in-memory stand-in)")
+    p.add_argument("--mongo-rtt-ms", type=float, default=20.0, help="Simulated round-trip time for the stand-in")
+    p.add_argument("--collections", type=int, default=4)
+    p.add_argument("--docs", type=int, default=500)
+    p.add_argument("--repeat", type=int, default=3)
+    p.set_defaults(fn=bench_attach)
+
+    p = sub.add_parser("aggregate")
+    p.add_argument("--mongo-uri", help="Local mongod (default: in-memory stand-in)")
+    p.add_argument("--docs", type=int, default=20_000)
+    p.set_defaults(fn=bench_aggregate)
+
+    p = sub.add_parser("sessions")
+    p.add_argument("--mongo-uri", help="Local mongod (default: in-memory stand-in)")
+    p.add_argument("--sessions", type=int, default=100)
+    p.add_argument("--turns", type=int, default=60)
+    p.add_argument("--answer-chars", type=int, default=1500)
+    p.add_argument("--description-chars", type=int, default=600)
+    p.set_defaults(fn=bench_sessions)
+
+    p = sub.add_parser("stream-memory")
+    p.add_argument("--mongo-uri", required=True)
+    p.add_argument("--docs", type=int, default=50_000)
+    p.add_argument("--description-chars", type=int, default=1000)
+    p.set_defaults(fn=bench_stream_memory)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    prepare_env(getattr(args, "mongo_uri", None))
+    args.fn(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""Sample collection, percentiles and baseline comparison for the benchmark scripts."""
+import json
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+def percentile(sorted_values, q: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(q * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+def summarize(values) -> dict:
+    values = sorted(values)
+    return {
+        "n": len(values),
+        "mean": sum(values) / len(values) if values else 0.0,
+        "p50": percentile(values, 0.50),
+        "p95": percentile(values, 0.95),
+        "p99": percentile(values, 0.99),
+        "max": values[-1] if values else 0.0,
+    }
+
+class Recorder:
+    """Thread-safe raw samples per stage (seconds) plus plain counters."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {}
+        self.counters = {}
+
+    def add(self, stage: str, value: float):
+        with self.lock:
+            self.samples.setdefault(stage, []).append(value)
+
+    def count(self, name: str, amount: int = 1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    @contextmanager
+    def stage(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - started)
+
+    def summary(self) -> dict:
+        with self.lock:
+            return {stage: summarize(values) for stage, values in self.samples.items()}
+
+def print_table(summary: dict, unit: str = "ms", scale: float = 1000.0, title: str = None):
+    if title:
+        print(f"\n{title}")
+    print(f"{'stage':<24}{'n':>7}{'mean':>10}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}  ({unit})")
+    for stage in sorted(summary):
+        s = summary[stage]
+        print(f"{stage:<24}{s['n']:>7}" + "".join(f"{s[k] * scale:>10.1f}" for k in ("mean", "p50", "p95", "p99", "max")))
+
+def save(path: str, result: dict):
+    with open(path, "w") as f:
+        json.dump(result, f, indent=2, default=str)
+
+def compare(path: str, result: dict, keys=("p50", "p95")):
+    """Prints the change of every stage percentile against a saved run."""
+    with open(path) as f:
+        baseline = json.load(f)
+    print(f"\nAgainst baseline {path}:")
+    for stage in sorted(result.get("stages", {})):
+        old = baseline.get("stages", {}).get(stage)
+        if not old:
+            continue
+        deltas = []
+        for k in keys:
+            before, after = old[k], result["stages"][stage][k]
+            change = (after - before) / before * 100 if before else 0.0
+            deltas.append(f"{k} {before * 1000:.1f} -> {after * 1000:.1f} ms ({change:+.0f}%)")
+        print(f"  {stage:<22}" + "   ".join(deltas))
+    if "import_seconds" in baseline and "import_seconds" in result:
+        before, after = baseline["import_seconds"]["p50"], result["import_seconds"]["p50"]
+        print(f"  {'imports p50':<22}{before * 1000:.0f} -> {after * 1000:.0f} ms ({(after - before) / before * 100:+.0f}%)")
+    for key in ("turns_per_second", "mongo_ops_per_turn"):
+        if key in baseline and key in result:
+            print(f"  {key:<22}{baseline[key]:.2f} -> {result[key]:.2f}")
@@ -0,0 +1,271 @@
+"""
+Local stand-ins for the two external services, so the real UserService,
+MongoService, rate limiter and GeminiService can be driven offline.
+
+prepare_env() must run before the first AppConfig setting is read (in
+practice, before the first service is built): settings resolve lazily on
+first access and are then cached, so importing src/ early is fine.
+"""
+import json
+import logging
+import os
+import random
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+def prepare_env(mongo_uri=None, bcrypt_rounds=None):
+    """Fills in the settings AppConfig needs, without overriding real ones."""
+    from cryptography.fernet import Fernet
+
+    os.environ.setdefault("MASTER_MONGO_URI", mongo_uri or "mongodb://stand-in:27017/")
+    os.environ.setdefault("JWT_SECRET", "benchmark-secret-" + "x" * 32)
+    os.environ.setdefault("ENCRYPTION_KEY", Fernet.generate_key().decode())
+    os.environ.setdefault("GEMINI_API_KEY", "benchmark-fake-key")
+    if bcrypt_rounds:
+        os.environ["BCRYPT_ROUNDS"] = str(bcrypt_rounds)
+    # st.cache_resource works outside `streamlit run`, but warns on every call
+    # (streamlit resets its loggers' levels on import, so filter instead)
+    logging.getLogger("streamlit.runtime.scriptrunner_utils.script_run_context").addFilter(
+        lambda record: "missing ScriptRunContext" not in record.getMessage())
+
+# --- Gemini ---
+class FakeUsage:
+    def __init__(self, prompt_tokens: int, response_tokens: int):
+        self.prompt_token_count = prompt_tokens
+        self.cached_content_token_count = 0
+        self.candidates_token_count = response_tokens
+
+class FakeChunk:
+    def __init__(self, text: str, usage: FakeUsage = None):
+        self.text = text
+        self.usage_metadata = usage
+
+class FakeGeminiModel:
+    """
+    Stand-in for GenerativeModel: waits ttft seconds, then produces
+    answer_tokens at tokens_per_second, streamed in chunks of chunk_tokens.
+    jitter scales every delay by a random factor in [1 - jitter, 1 + jitter].
+    """
+
+    def __init__(self, ttft: float = 0.3, tokens_per_second: float = 200, answer_tokens: int = 150,
+                 chunk_tokens: int = 20, jitter: float = 0.1, seed: int = None):
+        self.ttft = ttft
+        self.tokens_per_second = tokens_per_second
+        self.answer_tokens = answer_tokens
+        self.chunk_tokens = chunk_tokens
+        self.jitter = jitter
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = 0
+
+    def _delay(self, seconds: float):
+        with self.lock:
+            factor = 1 + self.random.uniform(-self.jitter, self.jitter)
+        time.sleep(max(0.0, seconds * factor))
+
+    @staticmethod
+    def _prompt_tokens(contents) -> int:
+        if isinstance(contents, str):
+            return len(contents) // 4
+        return sum(len(p) for c in contents for p in c["parts"] if isinstance(p, str)) // 4
+
+    def generate_content(self, contents, stream: bool = False):
+        with self.lock:
+            self.calls += 1
+        usage = FakeUsage(self._prompt_tokens(contents), self.answer_tokens)
+        if not stream:
+            self._delay(self.ttft + self.answer_tokens / self.tokens_per_second)
+            return FakeChunk("word " * self.answer_tokens, usage)
+        return self._stream(usage)
+
+    def _stream(self, usage: FakeUsage):
+        self._delay(self.ttft)
+        sent = 0
+        while sent < self.answer_tokens:
+            n = min(self.chunk_tokens, self.answer_tokens - sent)
+            if sent:
+                self._delay(n / self.tokens_per_second)
+            sent += n
+            yield FakeChunk("word " * n, usage if sent >= self.answer_tokens else None)
+
+# --- MongoDB ---
+# Collection methods that cost a round-trip on a real server
+COLLECTION_OPS = {
+    "find", "find_one", "aggregate", "insert_one", "insert_many", "update_one", "update_many",
+    "replace_one", "delete_one", "delete_many", "find_one_and_update", "count_documents",
+    "estimated_document_count", "create_index", "distinct",
+}
+
+class InMemoryMongo:
+    """
+    mongomock-backed client exposing the slice of the pymongo API the services use.
+    Every operation counts as one round-trip for the per-rerun counter (the real
+    CommandListener does that against a real server) and can be slowed by rtt.
+
+    Unsupported by mongomock, so adapted here:
+      - RawBSONDocument codec options: documents come back decoded
+      - $type expressions: the server-side trimming stage is skipped
+        (the client-side encoder still trims), and $facet profiling fails
+        the same way it does on a server without permissions
+      - change streams: refused, so snapshots fall back to polling
+    """
+
+    def __init__(self, rtt: float = 0.0):
+        try:
+            import mongomock
+        except ImportError:
+            raise RuntimeError("The in-memory stand-in needs mongomock (pip install mongomock), or pass --mongo-uri.")
+        self.backend = mongomock.MongoClient()
+        self.rtt = rtt
+        self.lock = threading.Lock()
+        self.ops = 0
+
+    def __call__(self, uri, **options):
+        """Used as MongoClientRegistry.client_factory: every URI shares this server."""
+        return self
+
+    def count_op(self):
+        from src.utils.metrics import get_metrics
+
+        with self.lock:
+            self.ops += 1
+        ops = get_metrics().mongo_listener.current()
+        if ops is not None:
+            ops.add()
+        if self.rtt:
+            time.sleep(self.rtt)
+
+    def __getitem__(self, name):
+        return _Database(self.backend[name], self)
+
+    @property
+    def admin(self):
+        return _Admin(self)
+
+    def close(self):
+        pass
+
+class _Admin:
+    def __init__(self, server: InMemoryMongo):
+        self.server = server
+
+    def command(self, name, *args, **kwargs):
+        self.server.count_op()
+        return {"ok": 1.0}
+
+class _Database:
+    def __init__(self, db, server: InMemoryMongo):
+        self._db = db
+        self._server = server
+
+    def __getitem__(self, name):
+        return _Collection(self._db[name], self._server)
+
+    def __getattr__(self, name):
+        attr = getattr(self._db, name)
+        if name in ("list_collection_names", "command"):
+            self._server.count_op()
+        return attr
+
+class _Collection:
+    def __init__(self, col, server: InMemoryMongo):
+        self._col = col
+        self._server = server
+
+    def with_options(self, **kwargs):
+        return self
+
+    def watch(self, *args, **kwargs):
+        from pymongo.errors import OperationFailure
+        raise OperationFailure("The in-memory stand-in has no change streams")
+
+    def aggregate(self, pipeline, **kwargs):
+        from pymongo.errors import OperationFailure
+
+        self._server.count_op()
+        if any("$facet" in stage for stage in pipeline):
+            raise OperationFailure("The in-memory stand-in cannot run the $facet profile")
+        pipeline = [stage for stage in pipeline if '"$type"' not in json.dumps(stage, default=str)]
+        return self._col.aggregate(pipeline)
+
+    def __getattr__(self, name):
+        attr = getattr(self._col, name)
+        if name not in COLLECTION_OPS:
+            return attr
+
+        def counted(*args, **kwargs):
+            self._server.count_op()
+            return attr(*args, **kwargs)
+        return counted
+
+def install_in_memory_mongo(rtt: float = 0.0) -> InMemoryMongo:
+    """Makes every pooled client (master and tenant) the in-memory stand-in."""
+    from src.utils.mongo_pool import get_client_registry
+
+    server = InMemoryMongo(rtt)
+    get_client_registry().client_factory = server
+    return server
+
+# --- Sample data ---
+CATEGORIES = ["electronics", "books", "garden", "toys", "kitchen", "sports", "beauty", "office"]
+
+def make_documents(count: int, description_chars: int = 300, seed: int = 7):
+    """Product-like documents with strings, numbers, dates and arrays."""
+    rng = random.Random(seed)
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    docs = []
+    for i in range(count):
+        docs.append({
+            "name": f"product {i}",
+            "category": rng.choice(CATEGORIES),
+            "price": round(rng.uniform(1, 500), 2),
+            "rating": round(rng.uniform(1, 5), 1),
+            "stock": rng.randint(0, 1000),
+            "tags": rng.sample(["new", "sale", "eco", "bundle", "premium", "clearance"], 3),
+            "description": ("lorem ipsum dolor sit amet " * (description_chars // 27 + 1))[:description_chars],
+            "createdAt": start + timedelta(minutes=i * 37),
+            "updatedAt": start + timedelta(minutes=i * 37 + 5),
+        })
+    return docs
+
+def make_mixed_documents(count: int, seed: int = 7):
+    """
+    Documents carrying the BSON types the encoder dispatches on: ObjectId,
+    Decimal128, Int64, Binary (generic and UUID), dates, nested documents and arrays.
+    """
+    import uuid
+    from bson import Binary, Decimal128, Int64, ObjectId
+    from bson.binary import UuidRepresentation
+
+    rng = random.Random(seed)
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    docs = []
+    for i in range(count):
+        docs.append({
+            "_id": ObjectId(),
+            "sku": f"SKU-{i:06d}",
+            "price": Decimal128(f"{rng.uniform(1, 500):.2f}"),
+            "views": Int64(rng.randint(0, 10**12)),
+            "rating": round(rng.uniform(1, 5), 1),
+            "in_stock": rng.random() < 0.8,
+            "device_id": Binary.from_uuid(uuid.UUID(int=rng.getrandbits(128)), UuidRepresentation.STANDARD),
+            "thumbnail": Binary(rng.randbytes(64)),
+            "createdAt": start + timedelta(minutes=i * 37),
+            "seller": {"_id": ObjectId(), "name": f"seller {i % 97}", "joined": start - timedelta(days=i % 365)},
+            "related": [ObjectId() for _ in range(3)],
+            "tags": rng.sample(["new", "sale", "eco", "bundle", "premium", "clearance"], 3),
+            "discontinued": None,
+        })
+    return docs
+
+def seed_collection(uri: str, db_name: str, collection_name: str, docs):
+    """Replaces the collection's contents through the pooled client."""
+    from src.utils.mongo_pool import get_client_registry
+
+    client = get_client_registry().get_client(uri, serverSelectionTimeoutMS=5000)
+    col = client[db_name][collection_name]
+    col.delete_many({})
+    for i in range(0, len(docs), 1000):
+        col.insert_many([dict(d) for d in docs[i:i + 1000]])
+    return col
@@ -0,0 +1,104 @@
+"""
+Cold-start and rerun cost of app.py.
+
+    python -m benchmarks.startup imports       # python -X importtime over app.py's imports
+    python -m benchmarks.startup reruns        # app.py under streamlit's AppTest, login + chat views
+    python -m benchmarks.startup reruns --json after.json --baseline before.json
+
+Reruns use the in-memory Mongo stand-in, so nothing external is contacted.
+"""
+import argparse
+import ast
+import os
+import subprocess
+import sys
+import time
+from benchmarks.report import Recorder, compare, print_table, save, summarize
+from benchmarks.stand_ins import install_in_memory_mongo, prepare_env
+
+APP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app.py")
+
+def app_imports() -> str:
+    """The import statements at the top of app.py, as source."""
+    with open(APP) as f:
+        tree = ast.parse(f.read())
+    return "\n".join(ast.unparse(node) for node in tree.body if isinstance(node, (ast.Import, ast.ImportFrom)))
+
+def bench_imports(args):
+    """Runs app.py's imports in fresh interpreters and parses -X importtime output (microseconds)."""
+    source = "from benchmarks.stand_ins import prepare_env\nprepare_env()\n" + app_imports()
+    totals, modules = [], {}
+    for _ in range(args.repeat):
+        started = time.perf_counter()
+        proc = subprocess.run([sys.executable, "-X", "importtime", "-c", source],
+                              capture_output=True, text=True, cwd=os.path.dirname(APP))
+        totals.append(time.perf_counter() - started)
+        if proc.returncode != 0:
+            raise RuntimeError(proc.stderr.strip().splitlines()[-1])
+        for line in proc.stderr.splitlines():
+            if not line.startswith("import time:") or "|" not in line:
+                continue
+            _, cumulative, name = line.split("|")
+            if not cumulative.strip().isdigit():
+                continue  # Header line
+            # Only top-level imports and our own modules: their cumulative time is what we pay for
+            name = name.rstrip()
+            depth = len(name) - len(name.lstrip(" ")) - 1
+            if depth == 0 or name.strip().startswith("src."):
+                modules.setdefault(name.strip(), []).append(int(cumulative) / 1e6)
+
+    print(f"Interpreter start + app.py imports: p50 {summarize(totals)['p50'] * 1000:.0f} ms over {args.repeat} runs")
+    slowest = sorted(((min(v), k) for k, v in modules.items()), reverse=True)[:args.top]
+    for seconds, name in slowest:
+        print(f"  {name:<40}{seconds * 1000:>9.1f} ms")
+    return {"import_seconds": summarize(totals), "modules": {k: min(v) for k, v in modules.items()}}
+
+def bench_reruns(args):
+    """Times app.py reruns under AppTest: the login view, then a connected chat view."""
+    from streamlit.testing.v1 import AppTest
+    from src.services.user_service import UserService
+
+    install_in_memory_mongo()
+    UserService().create_user("startup@bench.local", "startup", "password-1")
+    rec = Recorder()
+
+    at = AppTest.from_file(APP, default_timeout=60)
+    with rec.stage("login.first_run"):
+        at.run()
+    for _ in range(args.reruns):
+        with rec.stage("login.rerun"):
+            at.run()
+
+    at.session_state["authenticated"] = True
+    at.session_state["user_email"] = "startup@bench.local"
+    at.session_state["username"] = "startup"
+    at.run()
+    for _ in range(args.reruns):
+        with rec.stage("chat_view.rerun"):
+            at.run()
+    if at.exception:
+        print(f"App raised: {at.exception[0].message}")
+
+    summary = rec.summary()
+    print_table(summary, title=f"app.py reruns (AppTest, {args.reruns} each)")
+    return {"stages": summary}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("bench", choices=["imports", "reruns"])
+    parser.add_argument("--repeat", type=int, default=5, help="Fresh interpreters for the import benchmark")
+    parser.add_argument("--top", type=int, default=12, help="Slowest modules listed")
+    parser.add_argument("--reruns", type=int, default=20)
+    parser.add_argument("--json", help="Write the results to this file")
+    parser.add_argument("--baseline", help="Compare against results saved with --json")
+    args = parser.parse_args(argv)
+    prepare_env()
+
+    result = bench_imports(args) if args.bench == "imports" else bench_reruns(args)
+    if args.json:
+        save(args.json, result)
+    if args.baseline:
+        compare(args.baseline, result)
+
+if __name__ == "__main__":
+    main()
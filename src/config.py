@@ -1,34 +1,207 @@
 import os
-import streamlit as st
-from dotenv import load_dotenv
+import threading
 
-load_dotenv()
+_env_lock = threading.Lock()
+_env_loaded = False
+
+def _getenv(name: str):
+    """os.getenv, with .env loaded on the first call instead of at import."""
+    global _env_loaded
+    if not _env_loaded:
+        with _env_lock:
+            if not _env_loaded:
+                from dotenv import load_dotenv
+                load_dotenv()
+                _env_loaded = True
+    return os.getenv(name)
+
+class Setting:
+    """
+    Class attribute resolved on first access, then cached: the environment
+    (.env included), then st.secrets if secret=True, then the default.
+    Importing the config therefore reads no files and needs no streamlit.
+    Assigning to the class attribute (AppConfig.X = ...) still overrides it.
+    """
+
+    def __init__(self, env: str = None, default=None, cast=None, secret: bool = False):
+        self.env = env
+        self.default = default
+        self.cast = cast
+        self.secret = secret
+        self.lock = threading.Lock()
+        self.resolved = False
+        self.value = None
+
+    def __set_name__(self, owner, name):
+        self.env = self.env or name
+
+    def _resolve(self):
+        raw = _getenv(self.env)
+        if not raw and self.secret:
+            import streamlit as st
+            try:
+                raw = st.secrets.get(self.env)
+            except Exception:
+                raw = None  # No secrets.toml: fall back to the default
+        if not raw:
+            return self.default
+        return self.cast(raw) if self.cast else raw
+
+    def __get__(self, obj, owner=None):
+        if not self.resolved:
+            with self.lock:
+                if not self.resolved:
+                    self.value = self._resolve()
+                    self.resolved = True
+        return self.value
+
+def _email_list(raw: str) -> tuple:
+    return tuple(e.strip().lower() for e in raw.split(",") if e.strip())
 
 class AppConfig:
     # --- SECRETS (Force String Type) ---
-    # We use 'or ""' to ensure it's never None, solving the Pylance error
-    MASTER_MONGO_URI: str = os.getenv("MASTER_MONGO_URI") or st.secrets.get("MASTER_MONGO_URI") or ""
+    # The default ("") ensures it's never None, solving the Pylance error
+    MASTER_MONGO_URI: str = Setting(default="", secret=True)
     
-    JWT_SECRET_KEY: str = os.getenv("JWT_SECRET") or st.secrets.get("JWT_SECRET") or "unsafe_default"
+    JWT_SECRET_KEY: str = Setting("JWT_SECRET", default="unsafe_default", secret=True)
     
     # Fernet requires bytes or string. We ensure it's a string here.
-    ENCRYPTION_KEY: str = os.getenv("ENCRYPTION_KEY") or st.secrets.get("ENCRYPTION_KEY") or ""
+    ENCRYPTION_KEY: str = Setting(default="", secret=True)
     
-    GEMINI_API_KEY: str = os.getenv("GEMINI_API_KEY") or st.secrets.get("GEMINI_API_KEY") or ""
+    GEMINI_API_KEY: str = Setting(default="", secret=True)
     
     # --- CONSTANTS ---
     # These must be declared as static class variables
     MAX_FREE_MESSAGES: int = 3
     MAX_OUTPUT_TOKENS: int = 1000
     DOC_FETCH_LIMIT: int = 50
+    CONTEXT_MAX_BYTES: int = 32_000        # Budget for the JSON data pasted into the prompt
+    CONTEXT_MAX_STRING_CHARS: int = 500    # Longer string values are cut
+    CONTEXT_MAX_ARRAY_ITEMS: int = 20      # Longer arrays are cut
+
+    # --- CURSOR STREAMING ---
+    STREAM_BATCH_SIZE: int = 100           # Documents per getMore round-trip
+    STREAM_MAX_BYTES: int = 8_000_000      # Raw BSON read per fetch before the cursor is closed
+    STREAM_MAX_TIME_MS: int = 10_000       # Server-side time limit for streamed reads
+
+    # --- PER-QUESTION RETRIEVAL ---
+    # "keyword" (local heuristics) or "llm" (model writes the filter; costs an extra request)
+    RETRIEVAL_STRATEGY: str = Setting(default="keyword")
+    RETRIEVAL_TOP_K: int = 20              # Max documents fetched for one question
+    RETRIEVAL_MAX_TIME_MS: int = 2000      # Server-side time limit for the targeted query
+
+    # --- SERVER-SIDE AGGREGATION (model writes a pipeline, MongoDB computes the answer) ---
+    # "auto" (counts, averages, breakdowns), "always" or "off". Off by default: every new
+    # question it matches costs a second Gemini request (RPM/RPD) for one charged message
+    AGGREGATION_MODE: str = Setting(default="off")
+    AGGREGATION_MAX_STAGES: int = 12           # Stages in one pipeline, sub-pipelines included
+    AGGREGATION_MAX_DEPTH: int = 24            # Nesting of the stage specs
+    AGGREGATION_MAX_TIME_MS: int = 5000        # Server-side time limit for the pipeline
+    AGGREGATION_MAX_RESULTS: int = 50          # Result documents read back (a $limit is appended)
+    AGGREGATION_MAX_RESULT_BYTES: int = 32_000 # Raw BSON read back before the cursor is closed
+    AGGREGATION_CACHE_TTL_SECONDS: int = 600   # Results reused for the same question on the same dataset
+    AGGREGATION_CACHE_MAX_ENTRIES: int = 500
+
+    # --- COLLECTION PROFILE (schema/statistics summary) ---
+    PROFILE_SAMPLE_SIZE: int = 1000        # Docs drawn by $sample to compute field stats
+    PROFILE_TOP_VALUES: int = 5            # Top values listed for low-cardinality strings
+    PROFILE_LOW_CARDINALITY: int = 20      # Strings with at most this many distinct values
+    PROFILE_MAX_VALUE_CHARS: int = 100     # Longer strings (free text) are never grouped as values
+    PROFILE_MAX_TIME_MS: int = 5000        # Server-side time limit for the profile aggregation
+    PROFILE_CACHE_TTL_SECONDS: int = 600
+    PROFILE_CACHE_MAX_ENTRIES: int = 200
+
+    # --- INCREMENTAL CONTEXT REFRESH ---
+    REFRESH_UPDATED_FIELDS: tuple = ("updatedAt", "updated_at", "lastModified", "modifiedAt")
+    REFRESH_MAX_AWAIT_MS: int = 100        # How long a refresh waits on the change stream
+    AUTO_REFRESH_CONTEXT: bool = False     # Refresh the snapshot before every question
+
+    # --- RESPONSE CACHE (answers reused for repeated questions on the same data) ---
+    RESPONSE_CACHE_ENABLED: bool = True
+    RESPONSE_CACHE_MAX_ENTRIES: int = 500      # In-memory LRU size per process
+    RESPONSE_CACHE_TTL_SECONDS: int = 86_400
+    # Near-duplicate tier: word-set Jaccard, and only filler words may differ (None = exact only)
+    RESPONSE_CACHE_SIMILARITY: float = None
     MODEL_NAME: str = "gemini-2.5-flash"
 
+    # --- CONVERSATION (multi-turn prompts) ---
+    HISTORY_MAX_MESSAGES: int = 6              # Recent messages sent verbatim with each turn
+    HISTORY_MAX_MESSAGE_CHARS: int = 1000      # Longer messages are cut in the window
+    HISTORY_SUMMARY_CHARS: int = 600           # Digest of older questions beyond the window
+    PROMPT_CACHE_PROVIDER: bool = True         # Try Gemini context caching for the dataset prefix
+    PROMPT_CACHE_MIN_TOKENS: int = 1024        # Smaller prefixes are refused by the API
+    PROMPT_CACHE_TTL_SECONDS: int = 1800
+    PROMPT_CACHE_MAX_ENTRIES: int = 50
+
+    # --- MULTIPLE COLLECTIONS ---
+    MULTI_COLLECTION_MAX: int = 8              # Collections one connection attaches ("*" takes the first 8)
+    MULTI_COLLECTION_WORKERS: int = 8          # Collections fetched/profiled at once (process-wide pool)
+    MULTI_COLLECTION_MIN_BYTES: int = 4_000    # Floor of each collection's share of CONTEXT_MAX_BYTES
+
+    # --- SHARED DATASET SNAPSHOTS ---
+    SNAPSHOT_STORE_MAX_BYTES: int = 64_000_000      # Unreferenced snapshots are evicted past this
+    SNAPSHOT_STORE_MAX_AGE_SECONDS: int = 900       # Unreferenced snapshots older than this are refetched
+
+    # --- CHAT HISTORY ---
+    CHAT_HISTORY_MAX_MESSAGES: int = 40     # Messages kept in the session; older ones are archived
+    CHAT_HISTORY_SPILL_BATCH: int = 10      # Archive this many at once (one insert per batch)
+    CHAT_ARCHIVE_TTL_DAYS: int = 30         # Archived messages expire from the master DB
+
     # --- RATE LIMITS (Gemini Free Tier) ---
     MAX_RPM: int = 5      # Requests Per Minute
     MAX_RPD: int = 20     # Requests Per Day
+    RPD_LEASE_SIZE: int = 2             # Daily slots a process reserves from system_stats at a time
+    RPD_SYNC_INTERVAL_SECONDS: int = 5  # How often the limiter flushes usage to system_stats
+    # "memory" (single process) or "mongo" (shared by all replicas via the master DB)
+    RATE_LIMIT_BACKEND: str = Setting(default="memory")
+
+    # --- LLM ADMISSION QUEUE ---
+    ADMISSION_MAX_QUEUE: int = 20           # Requests waiting for RPM capacity before we reject
+    ADMISSION_MAX_PER_USER: int = 1         # Waiting requests a single user may hold
+    ADMISSION_MAX_WAIT_SECONDS: int = 60    # Give up if capacity doesn't free up by then
+
+    # --- PASSWORD HASHING & LOGIN THROTTLING ---
+    BCRYPT_ROUNDS: int = Setting(default=12, cast=int)  # Older hashes are upgraded on login
+    PASSWORD_HASH_WORKERS: int = 2          # bcrypt jobs running at once (CPU cores used)
+    PASSWORD_HASH_MAX_PENDING: int = 16     # Jobs allowed to wait for a worker
+    PASSWORD_HASH_WAIT_SECONDS: int = 5     # Give up waiting for a free slot after this
+    LOGIN_MAX_FAILURES_PER_EMAIL: int = 5
+    LOGIN_MAX_FAILURES_PER_IP: int = 20
+    LOGIN_FAILURE_WINDOW_SECONDS: int = 900
+    LOGIN_THROTTLE_MAX_KEYS: int = 10_000   # Tracked emails/IPs kept in memory
+
+    # --- SESSION USER CACHE ---
+    USER_CACHE_TTL_SECONDS: int = 60        # Re-read the user's doc at most this often
+
+    # --- MONGO CONNECTION POOLING ---
+    MONGO_MAX_POOL_SIZE: int = 50
+    MONGO_MIN_POOL_SIZE: int = 0
+    MONGO_MAX_IDLE_TIME_MS: int = 300_000           # Close pooled sockets idle for 5 min
+    MONGO_CLIENT_IDLE_TTL_SECONDS: int = 1800       # Close whole clients unused for 30 min
+
+    # --- USER DATABASE CONNECTION CACHE ---
+    MONGO_CONN_CACHE_MAX_ENTRIES: int = 100         # Hard cap on cached tenant connections
+    MONGO_CONN_CACHE_IDLE_TTL_SECONDS: int = 900    # Drop tenant connections unused for 15 min
+    MONGO_HEALTH_CHECK_INTERVAL_SECONDS: int = 30   # Skip 'ping' if healthy this recently
     
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 60
+
+    # --- SESSION RESUMPTION (JWT) ---
+    SESSION_COOKIE_NAME: str = "mongochat_token"    # Token survives a browser refresh in this cookie
+    # Fallback for hosts that drop cookies: the token rides in the URL instead. It then
+    # leaks into browser history, Referer headers, proxy logs and shared links, so it
+    # expires much sooner (and is revoked on every refresh and on logout either way)
+    SESSION_TOKEN_IN_URL: bool = False
+    SESSION_QUERY_PARAM: str = "session"
+    SESSION_URL_TOKEN_EXPIRE_MINUTES: int = 15
+    TOKEN_REFRESH_MARGIN_MINUTES: int = 10          # Re-issue tokens this close to expiry
+    TOKEN_CLAIMS_CACHE_MAX_ENTRIES: int = 1000
+    TOKEN_DENYLIST_REFRESH_SECONDS: int = 30        # How often revoked token ids are re-read
+    
+    # --- ADMIN ---
+    # Comma-separated emails allowed to see the metrics view
+    ADMIN_EMAILS: tuple = Setting(default=(), cast=_email_list)
     
     PAGE_TITLE: str = "MongoChat Platform"
     PAGE_ICON: str = "🍃"
@@ -0,0 +1,137 @@
+import json
+import re
+from typing import Any, Dict, List, Optional, Tuple
+from bson import json_util
+import streamlit as st
+from src.config import AppConfig
+from src.services.mongo_service import MongoService
+from src.services.response_cache import ResponseCache
+from src.utils.bson_json import BsonJsonEncoder
+from src.utils.metrics import get_metrics, timed
+from src.utils.pipeline_validator import PipelineValidator
+
+class AggregationPlanner:
+    """
+    Server-side execution mode for numeric and analytical questions: the model
+    writes a read-only aggregation pipeline, MongoDB runs it over the whole
+    collection, and only the (small) result goes into the answer prompt.
+    Anything that doesn't parse, validate or run returns None, and the caller
+    answers from retrieved documents instead. Results (and declined plans) are
+    cached per dataset and question, so a repeated question costs no request.
+    """
+
+    # Counts, sums, averages and breakdowns need every document, not a sample.
+    # Phrases rather than single words: "per", "total" or "count" alone also
+    # appear in field names and ordinary lookups, and each match costs a request.
+    ANALYTICAL_PATTERN = re.compile(
+        r"\b(how many|number of|count of|counts? (?:by|per)|average|avg|median|sum of|"
+        r"total (?:number|amount|value|revenue|sales|count|quantity)|percentage|proportion|"
+        r"distribution|breakdown|group(?:ed)? by|most common|least common|frequency)\b",
+        re.IGNORECASE,
+    )
+    CONTEXT_LABEL = (
+        "Result of an aggregation pipeline MongoDB ran over the whole collection "
+        "(exact figures; prefer them over the sample documents)"
+    )
+
+    def __init__(self, mongo_svc: MongoService, complete, cache: Optional[ResponseCache] = None):
+        self.mongo_svc = mongo_svc
+        self.complete = complete  # complete(prompt) -> str | None
+        self.cache = cache if cache is not None else get_aggregation_cache()
+
+    @classmethod
+    def wants(cls, question: str, mode: str = None) -> bool:
+        """Whether AGGREGATION_MODE sends this question to the database."""
+        mode = mode or AppConfig.AGGREGATION_MODE
+        if mode == "always":
+            return True
+        return mode == "auto" and cls.ANALYTICAL_PATTERN.search(question) is not None
+
+    def _prompt(self, question: str, profile_summary: Optional[str]) -> str:
+        attached = self.mongo_svc.attached or {self.mongo_svc.collection_name: self.mongo_svc}
+        fields = {name: svc.field_types for name, svc in attached.items()}
+        overview = f"Collection overview:\n{profile_summary}\n" if profile_summary else ""
+        return (
+            "Write a MongoDB aggregation pipeline that computes the answer to the question "
+            "over the whole collection. Reply with JSON only, shaped like\n"
+            '{"collection": "name", "pipeline": [...]}\n'
+            f"Allowed stages: {', '.join(sorted(PipelineValidator.ALLOWED_STAGES))}. "
+            "Write dates as {\"$date\": \"2024-01-31T00:00:00Z\"}. "
+            "Return a small result ($group, $count, $sort + $limit), never whole documents "
+            "when a summary answers the question.\n"
+            'If a pipeline cannot answer it, reply {"pipeline": null}.\n'
+            f"Collections and field types: {json.dumps(fields)}\n"
+            f"{overview}"
+            f"Question: {question}"
+        )
+
+    def plan(self, question: str, profile_summary: Optional[str] = None) -> Optional[Tuple[MongoService, List[Dict[str, Any]]]]:
+        """Returns (collection service, pipeline), or None if the model declined."""
+        reply = self.complete(self._prompt(question, profile_summary))
+        if not reply:
+            raise RuntimeError("Planning request not admitted or failed")  # Worth retrying: not cached
+        reply = re.sub(r"^```(?:json)?|```$", "", reply.strip()).strip()
+        # Extended JSON, so {"$date": ...} and {"$oid": ...} become real BSON values
+        raw = json_util.loads(reply)
+        if not isinstance(raw, dict) or not raw.get("pipeline"):
+            return None
+        attached = self.mongo_svc.attached
+        name = raw.get("collection") or self.mongo_svc.collection_name
+        svc = attached.get(name) if attached else self.mongo_svc
+        if svc is None:
+            raise ValueError(f"Unknown collection: {name}")
+        return svc, raw["pipeline"]
+
+    @timed("aggregation.run")
+    def run(self, question: str, profile_summary: Optional[str] = None,
+            context_hash: Optional[str] = None) -> Optional[str]:
+        """
+        Plans and runs the pipeline. Returns the result as prompt JSON
+        ({"collection", "pipeline", "result", "truncated"}), or None.
+        context_hash identifies the dataset (e.g. ConversationEngine.prefix_hash);
+        with it, a cached result or declined plan is reused without planning.
+        """
+        metrics = get_metrics()
+        if context_hash is not None:
+            cached = self.cache.get(context_hash, question)
+            if cached is not None:
+                metrics.inc("aggregation_total", result="cached")
+                return cached or None  # "": the model declined this question before
+
+        try:
+            planned = self.plan(question, profile_summary)
+            if planned is None:
+                metrics.inc("aggregation_total", result="declined")
+                if context_hash is not None:
+                    self.cache.put(context_hash, question, "")
+                return None
+            svc, pipeline = planned
+            # Validated against the allow-list inside run_pipeline()
+            docs, truncated = svc.run_pipeline(pipeline)
+        except Exception as e:
+            print(f"Aggregation Error: {e}")
+            metrics.inc("aggregation_total", result="error")
+            return None
+
+        metrics.inc("aggregation_total", result="ok")
+        encoder = BsonJsonEncoder()
+        result = json.dumps({
+            "collection": svc.collection_name,
+            "pipeline": encoder.to_jsonable(pipeline),
+            "result": [encoder.to_jsonable(doc) for doc in docs],
+            "truncated": truncated,
+        }, separators=(",", ":"), ensure_ascii=False)
+        if context_hash is not None:
+            # Same result text next time, so the answer cache (keyed by it) hits too
+            self.cache.put(context_hash, question, result)
+        return result
+
+# Singleton
+@st.cache_resource
+def get_aggregation_cache():
+    """In-memory only: results go stale as the collection changes, so they are kept briefly."""
+    cache = ResponseCache(max_entries=AppConfig.AGGREGATION_CACHE_MAX_ENTRIES,
+                          ttl_seconds=AppConfig.AGGREGATION_CACHE_TTL_SECONDS,
+                          similarity=None, persist=False)
+    get_metrics().register_gauge("aggregation_cache", cache.stats)
+    return cache
@@ -1,22 +1,76 @@
 import jwt
+import uuid
 from datetime import datetime, timedelta, timezone
 from src.config import AppConfig
+from src.utils.token_cache import get_claims_cache, get_deny_list
 
 class AuthHandler:
+    @staticmethod
+    def token_lifetime_minutes() -> int:
+        """Shorter when the token travels in the URL (history, Referer headers, logs)."""
+        if AppConfig.SESSION_TOKEN_IN_URL:
+            return AppConfig.SESSION_URL_TOKEN_EXPIRE_MINUTES
+        return AppConfig.ACCESS_TOKEN_EXPIRE_MINUTES
+
     @staticmethod
     def create_access_token(data: dict):
         to_encode = data.copy()
-        expire = datetime.now(timezone.utc) + timedelta(minutes=AppConfig.ACCESS_TOKEN_EXPIRE_MINUTES)
-        to_encode.update({"exp": expire})
+        now = datetime.now(timezone.utc)
+        expire = now + timedelta(minutes=AuthHandler.token_lifetime_minutes())
+        # jti identifies the token so it can be revoked before it expires
+        to_encode.update({"exp": expire, "iat": now, "jti": uuid.uuid4().hex})
         encoded_jwt = jwt.encode(to_encode, AppConfig.JWT_SECRET_KEY, algorithm=AppConfig.ALGORITHM)
         return encoded_jwt
 
     @staticmethod
     def decode_token(token):
-        try:
-            payload = jwt.decode(token, AppConfig.JWT_SECRET_KEY, algorithms=[AppConfig.ALGORITHM])
-            return payload
-        except jwt.ExpiredSignatureError:
+        """
+        Returns the token's claims, or None if it is invalid, expired or revoked.
+        Verified claims are cached in-process, so a repeat check costs no crypto.
+        """
+        if not token:
+            return None
+        claims_cache = get_claims_cache()
+        payload = claims_cache.get(token)
+        if payload is None:
+            try:
+                payload = jwt.decode(token, AppConfig.JWT_SECRET_KEY, algorithms=[AppConfig.ALGORITHM])
+            except jwt.ExpiredSignatureError:
+                return None
+            except jwt.InvalidTokenError:
+                return None
+            claims_cache.put(token, payload)
+
+        if payload.get("jti") and get_deny_list().is_revoked(payload["jti"]):
             return None
-        except jwt.InvalidTokenError:
-            return None
\ No newline at end of file
+        return payload
+
+    @staticmethod
+    def needs_refresh(payload: dict) -> bool:
+        """True once the token is within the refresh margin of its expiry."""
+        remaining = payload["exp"] - datetime.now(timezone.utc).timestamp()
+        return remaining < AppConfig.TOKEN_REFRESH_MARGIN_MINUTES * 60
+
+    @staticmethod
+    def refresh_token(payload: dict):
+        """
+        Issues a new token with the same subject/name and revokes the old one,
+        so a copy left in history or a shared link stops working (call before it expires).
+        """
+        token = AuthHandler.create_access_token({"sub": payload["sub"], "name": payload.get("name")})
+        AuthHandler._revoke_claims(payload)
+        return token
+
+    @staticmethod
+    def revoke_token(token):
+        """Denies the token until it expires (used on logout)."""
+        payload = AuthHandler.decode_token(token)
+        if payload is not None:
+            AuthHandler._revoke_claims(payload)
+
+    @staticmethod
+    def _revoke_claims(payload: dict):
+        if not payload.get("jti"):
+            return
+        expires_at = datetime.fromtimestamp(payload["exp"], tz=timezone.utc)
+        get_deny_list().revoke(payload["jti"], expires_at)
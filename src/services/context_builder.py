@@ -0,0 +1,85 @@
+from typing import List, Dict, Any, Tuple
+from src.config import AppConfig
+from src.utils.bson_json import BsonJsonEncoder
+
+class ContextBuilder:
+    """
+    Turns documents into the compact JSON block we paste into the prompt.
+    Stays within a byte budget, shortens long strings/arrays and drops binary data.
+    """
+
+    def __init__(self, max_bytes: int = AppConfig.CONTEXT_MAX_BYTES,
+                 max_string_chars: int = AppConfig.CONTEXT_MAX_STRING_CHARS,
+                 max_array_items: int = AppConfig.CONTEXT_MAX_ARRAY_ITEMS):
+        self.max_bytes = max_bytes
+        self.max_string_chars = max_string_chars
+        self.max_array_items = max_array_items
+        self.encoder = BsonJsonEncoder(max_string_chars=max_string_chars, max_array_items=max_array_items)
+
+    def server_stages(self) -> List[Dict[str, Any]]:
+        """
+        Aggregation stages that do the heavy trimming in MongoDB, so oversized
+        top-level values never cross the network: binary fields are dropped,
+        strings are cut to max_string_chars and arrays to max_array_items.
+        """
+        return [{"$replaceRoot": {"newRoot": self.trim_expression("$$ROOT")}}]
+
+    def change_stream_stages(self) -> List[Dict[str, Any]]:
+        """The same trimming for change events, applied to their fullDocument."""
+        return [{"$set": {"fullDocument": {"$cond": [
+            {"$eq": [{"$type": "$fullDocument"}, "object"]},
+            self.trim_expression("$fullDocument"),
+            "$$REMOVE",
+        ]}}}]
+
+    def trim_expression(self, document: str) -> Dict[str, Any]:
+        """Expression that trims the top-level values of `document` ("$$ROOT", "$fullDocument", ...)."""
+        field_type = {"$type": "$$f.v"}
+        return {"$arrayToObject": {"$map": {
+            "input": {"$filter": {
+                "input": {"$objectToArray": document},
+                "as": "f",
+                "cond": {"$ne": [field_type, "binData"]},
+            }},
+            "as": "f",
+            "in": {"k": "$$f.k", "v": {"$switch": {
+                "branches": [
+                    {"case": {"$eq": [field_type, "string"]},
+                     "then": {"$substrCP": ["$$f.v", 0, self.max_string_chars]}},
+                    {"case": {"$eq": [field_type, "array"]},
+                     "then": {"$slice": ["$$f.v", self.max_array_items]}},
+                ],
+                "default": "$$f.v",
+            }}},
+        }}}
+
+    def build(self, docs) -> Tuple[str, Dict[str, int]]:
+        """
+        Serializes docs as a compact JSON array until the byte budget is used.
+        docs may be a live cursor: it is read one document at a time and
+        abandoned as soon as the budget is reached.
+        Returns: (json_text, stats) with docs/fields included and the approximate size.
+        """
+        stats = {"docs_seen": 0, "docs": 0, "fields": 0, "fields_dropped": 0}
+        parts = []
+        used = 2  # The surrounding brackets
+
+        for doc in docs:
+            stats["docs_seen"] += 1
+            self.encoder.reset_counts()
+            # Compact separators: indentation whitespace is pure token overhead
+            encoded = self.encoder.dumps(doc)
+            size = len(encoded.encode("utf-8")) + (1 if parts else 0)
+            if used + size > self.max_bytes:
+                break  # Budget reached; the rest of the cursor is not read
+
+            parts.append(encoded)
+            used += size
+            stats["docs"] += 1
+            stats["fields"] += self.encoder.fields
+            stats["fields_dropped"] += self.encoder.fields_dropped
+
+        text = "[" + ",".join(parts) + "]"
+        stats["bytes"] = used
+        stats["approx_tokens"] = used // 4  # Rough rule of thumb for English/JSON text
+        return text, stats
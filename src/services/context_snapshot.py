@@ -0,0 +1,192 @@
+import copy
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+import bson
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
+from pymongo.errors import ConnectionFailure, OperationFailure, PyMongoError
+from src.config import AppConfig
+from src.services.context_builder import ContextBuilder
+from src.utils.bson_json import decode_raw_documents
+
+class ContextSnapshot:
+    """
+    The connect-time documents, kept by _id so changes can be patched in.
+    Tracks a change-stream resume token, or _id / updatedAt watermarks for polling.
+    A snapshot other sessions can see is never patched: refresh a copy() and
+    publish that instead.
+    """
+
+    def __init__(self, docs: List[Dict[str, Any]], limit: int, resume_token=None):
+        self.docs = OrderedDict((d["_id"], d) for d in docs)
+        self.limit = limit
+        self.resume_token = resume_token
+        self.version = 0  # Bumped whenever a change is applied
+
+        # --- Polling watermarks ---
+        self.last_id = self._max([d["_id"] for d in docs])
+        self.updated_field = next(
+            (f for f in AppConfig.REFRESH_UPDATED_FIELDS
+             if any(isinstance(d.get(f), datetime) for d in docs)),
+            None
+        )
+        self.updated_watermark = self._max([d.get(self.updated_field) for d in docs]) if self.updated_field else None
+
+    @staticmethod
+    def _max(values):
+        """Max of comparable values (None if empty or mixed types)."""
+        values = [v for v in values if v is not None]
+        try:
+            return max(values) if values else None
+        except TypeError:
+            return None
+
+    def copy(self) -> "ContextSnapshot":
+        """Same documents and watermarks in a new dict (documents are replaced on change, never mutated)."""
+        clone = copy.copy(self)
+        clone.docs = OrderedDict(self.docs)
+        return clone
+
+    @property
+    def mode(self) -> str:
+        return "change_stream" if self.resume_token is not None else "poll"
+
+    def upsert(self, doc: Dict[str, Any]) -> bool:
+        """Adds or replaces a document. New documents only fit while under the limit."""
+        if doc["_id"] not in self.docs and len(self.docs) >= self.limit:
+            return False
+        self.docs[doc["_id"]] = doc
+        if self.updated_field and isinstance(doc.get(self.updated_field), datetime):
+            self.updated_watermark = self._max([self.updated_watermark, doc[self.updated_field]])
+        self.version += 1
+        return True
+
+    def remove(self, doc_id) -> bool:
+        if self.docs.pop(doc_id, None) is None:
+            return False
+        self.version += 1
+        return True
+
+class SnapshotRefresher:
+    """
+    Brings a ContextSnapshot up to date. Uses the change stream when the deployment
+    supports one, otherwise polls by _id / updatedAt watermarks. Either way the
+    cost follows the number of changes (or the snapshot size), never the collection size.
+    Refreshed documents get the same server-side trimming and byte budget as the
+    connect-time fetch. on_change callbacks run after any change was applied
+    (to invalidate derived caches).
+    """
+
+    RAW_CODEC = CodecOptions(document_class=RawBSONDocument)
+
+    def __init__(self, collection, snapshot: ContextSnapshot,
+                 on_change: Optional[List[Callable[[int], None]]] = None,
+                 builder: Optional[ContextBuilder] = None,
+                 max_bytes: int = AppConfig.STREAM_MAX_BYTES):
+        self.collection = collection
+        self.snapshot = snapshot
+        self.on_change = on_change or []
+        self.builder = builder or ContextBuilder()
+        self.max_bytes = max_bytes
+
+    def refresh(self) -> int:
+        """Applies pending changes. Returns how many were applied (-1: snapshot must be refetched)."""
+        applied = None
+        if self.snapshot.mode == "change_stream":
+            applied = self._apply_change_stream()
+        if applied is None:
+            applied = self._poll()
+
+        if applied:
+            for callback in self.on_change:
+                callback(applied)
+        return applied
+
+    def _apply_change_stream(self) -> Optional[int]:
+        """Drains events since the resume token. None if the stream can't be used."""
+        applied = 0
+        events = 0
+        used = 0
+        try:
+            with self.collection.watch(
+                self.builder.change_stream_stages(),  # Trims fullDocument on the server
+                resume_after=self.snapshot.resume_token,
+                full_document="updateLookup",
+                max_await_time_ms=AppConfig.REFRESH_MAX_AWAIT_MS,
+            ) as stream:
+                token = self.snapshot.resume_token
+                while True:
+                    change = stream.try_next()
+                    if change is None:
+                        token = stream.resume_token
+                        break
+                    doc = change.get("fullDocument")
+                    used += len(bson.encode(doc)) if doc is not None else 0
+                    if events and used > self.max_bytes:
+                        break  # Over budget: this event and the rest wait for the next refresh
+                    op = change["operationType"]
+                    if op in ("insert", "update", "replace"):
+                        if doc is None:  # Deleted again before we looked it up
+                            applied += self.snapshot.remove(change["documentKey"]["_id"])
+                        elif op == "insert" or doc["_id"] in self.snapshot.docs:
+                            applied += self.snapshot.upsert(doc)
+                    elif op == "delete":
+                        applied += self.snapshot.remove(change["documentKey"]["_id"])
+                    elif op in ("drop", "rename", "dropDatabase", "invalidate"):
+                        return -1
+                    events += 1
+                    token = stream.resume_token  # Resume after the last event we applied
+                self.snapshot.resume_token = token
+        except (OperationFailure, ConnectionFailure) as e:
+            # Token fell off the oplog or streams unsupported: switch to polling
+            print(f"Change Stream Error: {e}")
+            self.snapshot.resume_token = None
+            return None
+        return applied
+
+    def _read(self, match: Dict[str, Any], sort: Dict[str, int], limit: int = 0) -> List[Dict[str, Any]]:
+        """Matching documents, trimmed server-side and cut at the byte budget (like the connect-time fetch)."""
+        stages = [{"$match": match}, {"$sort": sort}]
+        if limit:
+            stages.append({"$limit": limit})
+        raw = self.collection.with_options(codec_options=self.RAW_CODEC)
+        cursor = raw.aggregate(stages + self.builder.server_stages(),
+                               maxTimeMS=AppConfig.RETRIEVAL_MAX_TIME_MS, batchSize=AppConfig.STREAM_BATCH_SIZE)
+        try:
+            return list(decode_raw_documents(cursor, self.max_bytes))
+        finally:
+            cursor.close()
+
+    def _poll(self) -> int:
+        """Watermark polling: new _ids, newer updatedAt, and deletions among known _ids."""
+        snapshot = self.snapshot
+        applied = 0
+        time_limit = {"max_time_ms": AppConfig.RETRIEVAL_MAX_TIME_MS}
+        try:
+            # 1. Inserts (ObjectIds grow over time, so "newer" means "greater _id")
+            room = snapshot.limit - len(snapshot.docs)
+            if room > 0 and snapshot.last_id is not None:
+                for doc in self._read({"_id": {"$gt": snapshot.last_id}}, {"_id": 1}, room):
+                    applied += snapshot.upsert(doc)
+                    snapshot.last_id = doc["_id"]
+
+            known_ids = list(snapshot.docs.keys())
+            if not known_ids:
+                return applied
+
+            # 2. Updates (only if the collection has an updatedAt-style field)
+            if snapshot.updated_field and snapshot.updated_watermark is not None:
+                query = {"_id": {"$in": known_ids}, snapshot.updated_field: {"$gt": snapshot.updated_watermark}}
+                # Oldest first: if the budget cuts the read, the watermark never skips a change
+                for doc in self._read(query, {snapshot.updated_field: 1}):
+                    applied += snapshot.upsert(doc)
+
+            # 3. Deletes: which of our _ids are gone? (bounded by snapshot size)
+            alive = {d["_id"] for d in self.collection.find({"_id": {"$in": known_ids}}, {"_id": 1}, **time_limit)}
+            for doc_id in known_ids:
+                if doc_id not in alive:
+                    applied += snapshot.remove(doc_id)
+        except PyMongoError as e:
+            print(f"Snapshot Poll Error: {e}")
+        return applied
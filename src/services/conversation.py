@@ -0,0 +1,192 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from typing import Any, Dict, List, Optional, Tuple
+import streamlit as st
+from src.config import AppConfig
+from src.utils.metrics import get_metrics
+
+def system_instruction(context_data: str, profile_summary: str = None) -> str:
+    """The dataset part of the prompt: identical for every turn on the same data."""
+    overview = ""
+    if profile_summary:
+        # Collection-wide stats: lets the model answer counts/averages beyond the sample docs
+        overview = f"Collection overview:\n{profile_summary}\n\n"
+    return (
+        f"You are a database assistant. {overview}"
+        f"Here is the JSON data from the user's MongoDB:\n"
+        f"```json\n{context_data}\n```\n"
+        f"Answer the user's question based ONLY on this data. Generate the response like an assistant, sound friendly, and keep it concise"
+    )
+
+class PrefixCache:
+    """
+    Process-wide map from a dataset-prefix hash to a model bound to that prefix.
+    Uses Gemini context caching (CachedContent) when the API accepts the prefix,
+    so the dataset is uploaded once and billed at the cached rate; otherwise a
+    local model with the prefix as its system instruction (still built once).
+    """
+
+    def __init__(self, max_entries: int = AppConfig.PROMPT_CACHE_MAX_ENTRIES,
+                 ttl_seconds: float = AppConfig.PROMPT_CACHE_TTL_SECONDS):
+        self.lock = threading.Lock()
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.entries = OrderedDict()  # prefix_hash -> (model, cached_content or None, created_at)
+        self.hits = 0
+        self.misses = 0
+        self.provider_caches = 0
+
+    def _create(self, prefix: str, generation_config):
+        """Builds the model for a prefix. Returns (model, cached_content or None)."""
+        # Imported on first use: the SDK is slow to import and only chat turns need it
+        from google.generativeai import caching
+        from google.generativeai.generative_models import GenerativeModel
+
+        if AppConfig.PROMPT_CACHE_PROVIDER and len(prefix) // 4 >= AppConfig.PROMPT_CACHE_MIN_TOKENS:
+            try:
+                cached = caching.CachedContent.create(
+                    model=f"models/{AppConfig.MODEL_NAME}",
+                    system_instruction=prefix,
+                    ttl=timedelta(seconds=self.ttl_seconds),
+                )
+                return GenerativeModel.from_cached_content(cached, generation_config=generation_config), cached
+            except Exception as e:
+                # Model/tier without explicit caching: the local prefix still works
+                print(f"Context Cache Error: {e}")
+        model = GenerativeModel(AppConfig.MODEL_NAME, generation_config=generation_config, system_instruction=prefix)
+        return model, None
+
+    def get_model(self, prefix_hash: str, prefix: str, generation_config):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(prefix_hash)
+            # Provider caches expire server-side, so rebuild a little before the TTL
+            if entry is not None and now - entry[2] < self.ttl_seconds * 0.9:
+                self.entries.move_to_end(prefix_hash)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        # Created outside the lock: CachedContent.create is a network call
+        model, cached = self._create(prefix, generation_config)
+        evicted = []
+        with self.lock:
+            self.entries[prefix_hash] = (model, cached, now)
+            self.entries.move_to_end(prefix_hash)
+            if cached is not None:
+                self.provider_caches += 1
+            while len(self.entries) > self.max_entries:
+                evicted.append(self.entries.popitem(last=False)[1][1])
+
+        for old in evicted:
+            if old is not None:
+                try:
+                    old.delete()
+                except Exception as e:
+                    print(f"Context Cache Delete Error: {e}")
+        return model
+
+    def stats(self) -> dict:
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / total if total else 0.0,
+                "provider_caches": self.provider_caches,
+                "entries": len(self.entries),
+            }
+
+class ConversationEngine:
+    """
+    Splits a chat turn into a stable prefix (dataset + profile, sent once and
+    reused) and a small per-turn message: a bounded window of recent messages,
+    a digest of older questions, the question-specific documents and the question.
+    """
+
+    def __init__(self, dataset: str, profile_summary: str = None, prefix_cache: "PrefixCache" = None,
+                 max_messages: int = AppConfig.HISTORY_MAX_MESSAGES,
+                 max_message_chars: int = AppConfig.HISTORY_MAX_MESSAGE_CHARS,
+                 summary_chars: int = AppConfig.HISTORY_SUMMARY_CHARS):
+        self.dataset = dataset
+        self.prefix = system_instruction(dataset, profile_summary)
+        self.prefix_hash = hashlib.sha256(self.prefix.encode("utf-8")).hexdigest()
+        self.prefix_cache = prefix_cache
+        self.max_messages = max_messages
+        self.max_message_chars = max_message_chars
+        self.summary_chars = summary_chars
+
+    @staticmethod
+    def _clip(text: str, limit: int) -> str:
+        return text if len(text) <= limit else text[:limit] + "..."
+
+    def history_window(self, history: Optional[List[Dict[str, str]]]) -> Tuple[Optional[str], List[Dict[str, str]]]:
+        """
+        Returns (digest of older questions or None, recent messages).
+        The digest is built locally: summarizing with the model would spend quota.
+        """
+        history = history or []
+        recent = history[-self.max_messages:] if self.max_messages else []
+        older = history[:len(history) - len(recent)]
+
+        summary = None
+        questions = [self._clip(m["content"], 120) for m in older if m["role"] == "user"]
+        if questions:
+            kept = []
+            used = 0
+            for q in reversed(questions):  # Most recent older questions first
+                if used + len(q) > self.summary_chars:
+                    break
+                kept.append(q)
+                used += len(q)
+            skipped = len(questions) - len(kept)
+            summary = "Earlier in this conversation the user asked: " + "; ".join(f'"{q}"' for q in reversed(kept))
+            if skipped:
+                summary += f" (and {skipped} earlier question(s))"
+
+        window = [{"role": m["role"], "content": self._clip(m["content"], self.max_message_chars)} for m in recent]
+        return summary, window
+
+    def turn_message(self, question: str, retrieved: str = None, summary: str = None,
+                     label: str = None) -> str:
+        parts = []
+        if summary:
+            parts.append(summary)
+        if retrieved and retrieved != self.dataset:
+            parts.append(f"{label or 'Documents matching this question'}:\n```json\n{retrieved}\n```")
+        parts.append(f"User Question: {question}")
+        return "\n\n".join(parts)
+
+    def history_key(self, history) -> str:
+        """Text that identifies the history window (part of the response cache key)."""
+        summary, window = self.history_window(history)
+        return (summary or "") + "\n".join(f"{m['role']}:{m['content']}" for m in window)
+
+    def request(self, question: str, retrieved: str = None, history=None,
+                generation_config=None, model=None, label: str = None) -> Tuple[Any, List[Dict[str, Any]]]:
+        """
+        Returns (model, contents) for one turn. With an injected model (tests,
+        benchmarks) the prefix is sent inline as the first user message.
+        label says what retrieved is (default: documents matching the question).
+        """
+        summary, window = self.history_window(history)
+        contents = [
+            {"role": "model" if m["role"] == "assistant" else "user", "parts": [m["content"]]}
+            for m in window
+        ]
+        contents.append({"role": "user", "parts": [self.turn_message(question, retrieved, summary, label)]})
+
+        if model is not None:
+            return model, [{"role": "user", "parts": [self.prefix]}] + contents
+        prefix_cache = self.prefix_cache or get_prefix_cache()
+        return prefix_cache.get_model(self.prefix_hash, self.prefix, generation_config), contents
+
+# Singleton
+@st.cache_resource
+def get_prefix_cache():
+    cache = PrefixCache()
+    get_metrics().register_gauge("prompt_prefix_cache", cache.stats)
+    return cache
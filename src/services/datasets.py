@@ -0,0 +1,118 @@
+import json
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Tuple
+import streamlit as st
+from src.config import AppConfig
+from src.services.context_builder import ContextBuilder
+from src.services.context_snapshot import SnapshotRefresher
+from src.services.mongo_service import MongoService
+from src.utils.metrics import get_metrics, timed
+from src.utils.snapshot_store import SnapshotHandle, get_snapshot_store, snapshot_key
+
+# Singleton
+@st.cache_resource
+def get_fetch_pool():
+    """Bounded, process-wide pool for per-collection reads (pymongo releases the GIL on I/O)."""
+    return ThreadPoolExecutor(max_workers=AppConfig.MULTI_COLLECTION_WORKERS, thread_name_prefix="collection-fetch")
+
+def for_each_collection(mongo_svc: MongoService, fn: Callable[[MongoService], Any]) -> Dict[str, Any]:
+    """
+    Runs fn(service) for every attached collection, concurrently, so the total
+    time follows the slowest collection. Returns {collection name: result}.
+    """
+    attached = mongo_svc.attached or OrderedDict([(mongo_svc.collection_name, mongo_svc)])
+    if len(attached) == 1:
+        return OrderedDict((name, fn(svc)) for name, svc in attached.items())
+    task = get_metrics().mongo_listener.carry(fn)  # Pool threads count toward this rerun
+    futures = OrderedDict((name, get_fetch_pool().submit(task, svc)) for name, svc in attached.items())
+    return OrderedDict((name, future.result()) for name, future in futures.items())
+
+def collection_builder(count: int) -> ContextBuilder:
+    """Splits the context byte budget between the attached collections."""
+    return ContextBuilder(max_bytes=max(AppConfig.CONTEXT_MAX_BYTES // max(count, 1), AppConfig.MULTI_COLLECTION_MIN_BYTES))
+
+def load_dataset(mongo_svc: MongoService, snapshot=None, builder: Optional[ContextBuilder] = None):
+    """Fetches (unless given) and renders a snapshot. Returns: (snapshot, data, stats, profile_summary)"""
+    snapshot = snapshot or mongo_svc.fetch_snapshot(limit=AppConfig.DOC_FETCH_LIMIT)
+    data, context_stats = mongo_svc.render_snapshot(snapshot, builder)
+    try:
+        profile_summary = MongoService.summarize_profile(mongo_svc.get_profile())
+    except RuntimeError:
+        profile_summary = None  # Optional: chat still works from the sample docs
+    return snapshot, data, context_stats, profile_summary
+
+@timed("datasets.acquire")
+def acquire_datasets(mongo_svc: MongoService) -> Dict[str, SnapshotHandle]:
+    """Handles to the shared snapshot of every attached collection, fetched in parallel on a miss."""
+    store = get_snapshot_store()
+    builder = collection_builder(len(mongo_svc.attached))
+
+    def acquire(svc):
+        query = {"limit": AppConfig.DOC_FETCH_LIMIT, "max_bytes": builder.max_bytes}
+        key = snapshot_key(svc.uri, svc.db_name, svc.collection_name, query)
+        handle = store.acquire(key, lambda: load_dataset(svc, builder=builder))
+        svc.adopt_snapshot(handle.snapshot)  # Retrieval planning needs the field types on a hit too
+        return handle
+
+    return for_each_collection(mongo_svc, acquire)
+
+def refresh_datasets(mongo_svc: MongoService, handles: Dict[str, SnapshotHandle]) -> int:
+    """
+    Patches changes into every attached collection's shared snapshot.
+    Returns the number of changes applied (-1: a collection had to be reloaded).
+    """
+    store = get_snapshot_store()
+    builder = collection_builder(len(handles))
+
+    def refresh(svc):
+        handle = handles.get(svc.collection_name)
+        if handle is None:
+            return 0
+        with handle.lock: # One refresh at a time per shared snapshot
+            # Other sessions keep reading the published snapshot: changes go into a
+            # copy, which replaces it in one step through store.update()
+            snapshot = handle.snapshot.copy()
+            # Derived caches: the sample-based profile is kept until its TTL runs out
+            # (re-profiling per change would cost a $sample per refresh); cached
+            # answers are keyed by the context content, so they stop matching on their own.
+            refresher = SnapshotRefresher(svc.collection, snapshot, builder=builder)
+            changes = refresher.refresh()
+
+            if changes == -1:
+                # Collection was dropped/renamed: start over from a fresh snapshot and profile
+                svc.invalidate_profile()
+                store.update(handle, *load_dataset(svc, builder=builder))
+            elif changes:
+                # Re-renders the patched snapshot; the profile comes from the cache
+                snapshot, data, context_stats, profile_summary = load_dataset(svc, snapshot, builder)
+                store.update(handle, snapshot, data, context_stats, profile_summary or handle.profile_summary)
+            else:
+                # Nothing to render, but keep the advanced resume token / watermarks
+                store.update(handle, snapshot, handle.data, handle.stats, handle.profile_summary)
+        return changes
+
+    changes = list(for_each_collection(mongo_svc, refresh).values())
+    return -1 if -1 in changes else sum(changes)
+
+def combine_datasets(handles: Dict[str, SnapshotHandle]) -> Tuple[Optional[str], Optional[Dict[str, int]], Optional[str]]:
+    """
+    One context for the prompt. A single collection is passed through unchanged;
+    several become {"orders": [...], "customers": [...]} with a profile section each.
+    Returns: (data, stats, profile_summary)
+    """
+    if not handles:
+        return None, None, None
+    if len(handles) == 1:
+        handle = next(iter(handles.values()))
+        return handle.data, handle.stats, handle.profile_summary
+
+    data = "{" + ",".join(f"{json.dumps(name)}:{h.data}" for name, h in handles.items()) + "}"
+    stats = {}
+    for handle in handles.values():
+        for key, value in (handle.stats or {}).items():
+            stats[key] = stats.get(key, 0) + value
+    profile_summary = "\n\n".join(
+        f"Collection '{name}': {h.profile_summary}" for name, h in handles.items() if h.profile_summary
+    ) or None
+    return data, stats, profile_summary
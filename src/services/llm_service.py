@@ -1,65 +1,236 @@
 import time
-import google.generativeai as genai
-from google.generativeai.generative_models import GenerativeModel
-from google.generativeai import types
+import streamlit as st
 from src.config import AppConfig
-from src.utils.rate_limiter import get_rate_limiter # <--- New Import
+from src.services.conversation import ConversationEngine, system_instruction
+from src.services.response_cache import ResponseCache, get_response_cache
+from src.utils.admission import get_admission_queue
+from src.utils.metrics import get_metrics, timed
+
+# Singleton (per API key)
+@st.cache_resource
+def get_default_model(api_key: str):
+    """
+    Configures the SDK and builds the shared GenerativeModel once per process.
+    google.generativeai is imported here, on the first chat turn, instead of
+    when the app starts (it is the slowest import by far).
+    Returns: (model, generation_config)
+    """
+    import google.generativeai as genai
+    from google.generativeai import types
+    from google.generativeai.generative_models import GenerativeModel
+
+    genai.configure(api_key=api_key) # type: ignore
+    generation_config = types.GenerationConfig(
+        max_output_tokens=AppConfig.MAX_OUTPUT_TOKENS
+    )
+    return GenerativeModel(AppConfig.MODEL_NAME, generation_config=generation_config), generation_config
 
 class GeminiService:
-    def __init__(self, api_key: str):
+    """
+    One chat turn's view of Gemini. Cheap to build per message: the SDK setup
+    and the model are shared (get_default_model); only per-turn state lives here.
+    """
+
+    def __init__(self, api_key: str, model=None, admission=None, cache=None):
         if not api_key:
             raise ValueError("API Key is required.")
         
-        genai.configure(api_key=api_key) # type: ignore
+        # A stand-in model (anything with generate_content) can be injected for tests
+        self.injected_model = model
+        if model is None:
+            model, self.generation_config = get_default_model(api_key)
+        else:
+            self.generation_config = {"max_output_tokens": AppConfig.MAX_OUTPUT_TOKENS}
+        self.model = model
         
-        self.generation_config = types.GenerationConfig(
-            max_output_tokens=AppConfig.MAX_OUTPUT_TOKENS
-        )
+        # Global shared admission queue in front of the rate limiter
+        self.admission = admission or get_admission_queue()
+        self.limiter = self.admission.limiter
         
-        self.model = GenerativeModel(
-            AppConfig.MODEL_NAME, 
-            generation_config=self.generation_config
+        # Repeated questions on the same data are answered without using quota
+        if cache is None and AppConfig.RESPONSE_CACHE_ENABLED:
+            cache = get_response_cache()
+        self.cache = cache
+        self.last_cache_hit = False
+        self.last_usage = None  # usage_metadata of the last streamed answer (token counts)
+
+    def _cached_answer(self, context_data: str, user_question: str, profile_summary: str,
+                       conversation: ConversationEngine = None, history=None):
+        """Returns (context_hash, cached answer or None)."""
+        self.last_cache_hit = False
+        if self.cache is None:
+            return None, None
+        if conversation is not None:
+            # Follow-ups depend on the conversation so far, not just the data
+            context_hash = ResponseCache.context_hash(conversation.prefix_hash, context_data, conversation.history_key(history))
+        else:
+            context_hash = ResponseCache.context_hash(context_data, profile_summary)
+        answer = self.cache.get(context_hash, user_question)
+        self.last_cache_hit = answer is not None
+        get_metrics().inc("llm_response_cache_total", result="hit" if self.last_cache_hit else "miss")
+        return context_hash, answer
+
+    @staticmethod
+    def _admission_error(status: str):
+        """User-facing message when the queue didn't admit us (None if it did)."""
+        if status == "DAILY_LIMIT":
+            return "🚫 **System Daily Limit Reached.** The global quota for this app is full. Please try again tomorrow (UTC)."
+        if status in ("QUEUE_FULL", "TIMEOUT"):
+            return "⏳ **Traffic High.** Too many people are using the AI right now. Please try again in a minute."
+        return None
+
+    @staticmethod
+    def _generation_error(e: Exception) -> str:
+        # Handle standard API overload error
+        if "429" in str(e):
+            return "🚫 **API Limit Hit:** Rate limit exceeded. Please wait a moment."
+        return f"AI Generation Error: {str(e)}"
+
+    @staticmethod
+    def _build_prompt(context_data: str, user_question: str, profile_summary: str = None,
+                      context_label: str = None) -> str:
+        note = f"\n\nThe JSON data above is: {context_label}." if context_label else ""
+        return f"{system_instruction(context_data, profile_summary)}{note}\n\nUser Question: {user_question}"
+
+    def _request(self, context_data: str, user_question: str, profile_summary: str = None,
+                 conversation: ConversationEngine = None, history=None, context_label: str = None):
+        """Returns (model, contents) for one turn: single prompt, or cached prefix + turn."""
+        if conversation is None:
+            return self.model, self._build_prompt(context_data, user_question, profile_summary, context_label)
+        return conversation.request(
+            user_question, retrieved=context_data, history=history,
+            generation_config=self.generation_config, model=self.injected_model, label=context_label
         )
-        
-        # Get the global shared limiter
-        self.limiter = get_rate_limiter()
 
-    def generate_response(self, context_data: str, user_question: str) -> str:
+    @staticmethod
+    def _record_sizes(contents, answer: str, usage):
+        """Prompt/response bytes and (when the API reports them) token counts."""
+        metrics = get_metrics()
+        if isinstance(contents, str):
+            prompt_bytes = len(contents.encode("utf-8"))
+        else:
+            prompt_bytes = sum(len(p.encode("utf-8")) for c in contents for p in c["parts"] if isinstance(p, str))
+        metrics.observe("llm_prompt_bytes", prompt_bytes)
+        metrics.observe("llm_response_bytes", len(answer.encode("utf-8")))
+        if usage is not None:
+            metrics.observe("llm_prompt_tokens", getattr(usage, "prompt_token_count", 0) or 0)
+            metrics.observe("llm_cached_tokens", getattr(usage, "cached_content_token_count", 0) or 0)
+            metrics.observe("llm_response_tokens", getattr(usage, "candidates_token_count", 0) or 0)
+
+    def _release_slot(self):
+        """Gives back the slot check_limits() reserved and lets the next request in."""
+        self.limiter.cancel_request()
+        self.admission.notify_capacity()
+
+    @timed("llm.generate_response")
+    def generate_response(self, context_data: str, user_question: str, user_id=None, on_wait=None,
+                          profile_summary: str = None, conversation: ConversationEngine = None,
+                          history=None, context_label: str = None) -> str:
         """
         Constructs the prompt and gets the response.
+        on_wait(position, eta_seconds) is called while the request waits in the queue.
+        profile_summary (MongoService.summarize_profile) adds collection-wide stats.
+        With a conversation, the dataset is a reused prefix and context_data only
+        holds the question-specific documents; history is the prior chat.
+        context_label says what context_data is when it isn't matching documents
+        (e.g. an aggregation result).
         """
-        # --- 1. PRE-CHECK: Ask Rate Limiter for permission ---
-        status = self.limiter.check_limits()
-        
-        if status == "DAILY_LIMIT":
-            return "🚫 **System Daily Limit Reached.** The global quota for this app is full. Please try again tomorrow (UTC)."
-        
-        if status == "RPM_LIMIT":
-            # If busy, wait 5 seconds and try one last time
-            time.sleep(5) 
-            if self.limiter.check_limits() == "RPM_LIMIT":
-                 return "⏳ **Traffic High.** Too many people are using the AI right now. Please wait 10 seconds."
-
-        # --- 2. Construct Prompt ---
-        system_instruction = (
-            f"You are a database assistant. Here is the JSON data from the user's MongoDB:\n"
-            f"```json\n{context_data}\n```\n"
-            f"Answer the user's question based ONLY on this data. Generate the response like an assistant, sound friendly, and keep it concise"
-        )
-        
-        full_prompt = f"{system_instruction}\n\nUser Question: {user_question}"
+        # --- 0. CACHE: answered before? (doesn't count against RPM/RPD) ---
+        context_hash, cached = self._cached_answer(context_data, user_question, profile_summary, conversation, history)
+        if cached is not None:
+            return cached
         
+        # --- 1. PRE-CHECK: Wait in line for a rate limit slot ---
+        error = self._admission_error(self.admission.admit(user_id, on_wait=on_wait))
+        if error:
+            return error
+
         try:
+            # --- 2. Construct Prompt ---
+            model, contents = self._request(context_data, user_question, profile_summary, conversation,
+                                            history, context_label)
+            
             # --- 3. Call API ---
-            response = self.model.generate_content(full_prompt)
+            response = model.generate_content(contents)
             
             # --- 4. POST-ACTION: Record successful request ---
             self.limiter.record_request()
+            self._record_sizes(contents, response.text, getattr(response, "usage_metadata", None))
             
+            if self.cache is not None:
+                self.cache.put(context_hash, user_question, response.text)
             return response.text
             
         except Exception as e:
-            # Handle standard API overload error
-            if "429" in str(e):
-                 return "🚫 **API Limit Hit:** Rate limit exceeded. Please wait a moment."
-            return f"AI Generation Error: {str(e)}"
\ No newline at end of file
+            self._release_slot()
+            return self._generation_error(e)
+
+    @timed("llm.complete")
+    def complete(self, prompt: str, user_id=None):
+        """
+        Plain single-shot completion through the queue (no data prompt around it).
+        Returns None if the request wasn't admitted or failed.
+        """
+        if self._admission_error(self.admission.admit(user_id)):
+            return None
+        try:
+            response = self.model.generate_content(prompt)
+            self.limiter.record_request()
+            return response.text
+        except Exception:
+            self._release_slot()
+            return None
+
+    def stream_response(self, context_data: str, user_question: str, user_id=None, on_wait=None,
+                        profile_summary: str = None, conversation: ConversationEngine = None,
+                        history=None, context_label: str = None):
+        """
+        Same as generate_response() but yields the answer in chunks as the model
+        produces them. self.last_stream_completed tells the caller whether the
+        full answer came through (False for limit messages and errors).
+        """
+        self.last_stream_completed = False
+        self.last_usage = None
+
+        context_hash, cached = self._cached_answer(context_data, user_question, profile_summary, conversation, history)
+        if cached is not None:
+            self.last_stream_completed = True
+            yield cached
+            return
+
+        error = self._admission_error(self.admission.admit(user_id, on_wait=on_wait))
+        if error:
+            yield error
+            return
+
+        started = False  # Once chunks flow, the provider has counted the request
+        chunks = []
+        metrics = get_metrics()
+        request_started = time.perf_counter()
+        try:
+            model, contents = self._request(context_data, user_question, profile_summary, conversation,
+                                            history, context_label)
+            for chunk in model.generate_content(contents, stream=True):
+                self.last_usage = getattr(chunk, "usage_metadata", None) or self.last_usage
+                try:
+                    text = chunk.text
+                except ValueError:
+                    continue  # Chunk without text parts (e.g. safety metadata)
+                if not started:
+                    metrics.observe("stage_seconds", time.perf_counter() - request_started, stage="llm.first_token")
+                started = True
+                chunks.append(text)
+                yield text
+            self.last_stream_completed = True
+            metrics.observe("stage_seconds", time.perf_counter() - request_started, stage="llm.stream")
+            self._record_sizes(contents, "".join(chunks), self.last_usage)
+            if self.cache is not None:
+                self.cache.put(context_hash, user_question, "".join(chunks))
+        except Exception as e:
+            yield self._generation_error(e)
+        finally:
+            # Runs once the stream completes, fails, or is abandoned by the consumer
+            if started or self.last_stream_completed:
+                self.limiter.record_request()
+            else:
+                self._release_slot()
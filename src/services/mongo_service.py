@@ -1,48 +1,460 @@
-import pymongo
 from pymongo.errors import ConnectionFailure, OperationFailure
-import json
-from typing import List, Dict, Any, Optional
+import bson
+from collections import OrderedDict
+from bson.codec_options import CodecOptions
+from bson.decimal128 import Decimal128
+from bson.raw_bson import RawBSONDocument
+from datetime import datetime
+import time
+from typing import List, Dict, Any, Iterator, Optional
+from src.config import AppConfig
+from src.services.context_builder import ContextBuilder
+from src.services.context_snapshot import ContextSnapshot
+from src.utils.bson_json import BsonJsonEncoder, decode_raw_documents
+from src.utils.metrics import timed
+from src.utils.mongo_pool import get_client_registry, uri_fingerprint
+from src.utils.pipeline_validator import PipelineValidator
+from src.utils.profile_cache import get_profile_cache
 
 class MongoService:
+    CLIENT_OPTIONS = {"serverSelectionTimeoutMS": 5000}
+    # Documents arrive as undecoded bytes, so their size is known before decoding
+    RAW_CODEC = CodecOptions(document_class=RawBSONDocument)
+
     def __init__(self):
         self.client = None
         self.collection = None
+        self.uri = None
+        self.db_name = None
+        self.collection_name = None
+        self.attached = OrderedDict()  # Collection name -> MongoService; the first one is self
+        self.attached_names = []       # Every collection of the connection (children included)
+        self.last_healthy = 0.0  # time.monotonic() of the last successful round-trip
+        self.field_types = {}    # Top-level field -> "string" | "number" | "date" | "bool" | "other"
 
+    @timed("mongo.connect")
     def connect(self, uri: str, db_name: str, collection_name: str) -> bool:
-        """Establishes connection to the specific collection."""
+        """
+        Establishes connection to the collection(s): one name, a comma-separated
+        list, or "*" for every collection in the database. The first one becomes
+        self.collection; all of them are in self.attached, on the same pooled client.
+        """
         try:
-            self.client = pymongo.MongoClient(uri, serverSelectionTimeoutMS=5000)
-            # Trigger a quick command to verify connection
-            self.client.admin.command('ping')
+            # We hold the client: the registry won't close it while this service is alive
+            self.client = get_client_registry().get_client(uri, holder=self, **self.CLIENT_OPTIONS)
+            self.uri = uri
+            self.db_name = db_name
+            # Trigger a quick command to verify connection (skipped if recently healthy)
+            self.ensure_healthy()
             
             db = self.client[db_name]
-            self.collection = db[collection_name]
+            names = self.resolve_collection_names(db, collection_name)
+            self.collection_name = names[0]
+            self.collection = db[names[0]]
+            self.attached_names = names
+            # Reconnects keep the per-collection services (and the field types they learned)
+            self.attached = OrderedDict(
+                (name, self if name == names[0] else self._attach(name, self.attached.get(name)))
+                for name in names
+            )
             return True
         except Exception as e:
             raise ConnectionError(f"Failed to connect to MongoDB: {str(e)}")
 
+    @staticmethod
+    def resolve_collection_names(db, spec: str) -> List[str]:
+        """Parses "orders, customers" or "*" (listed from the database, system collections skipped)."""
+        names = list(dict.fromkeys(n.strip() for n in spec.split(",") if n.strip()))
+        if names == ["*"]:
+            names = sorted(n for n in db.list_collection_names() if not n.startswith("system."))
+        if not names:
+            raise ValueError("No collection to attach.")
+        if len(names) > AppConfig.MULTI_COLLECTION_MAX:
+            print(f"Attach Warning: using the first {AppConfig.MULTI_COLLECTION_MAX} of {len(names)} collections")
+        return names[:AppConfig.MULTI_COLLECTION_MAX]
+
+    def _attach(self, collection_name: str, svc: Optional["MongoService"] = None) -> "MongoService":
+        """A MongoService for another collection of the same database, sharing our client (no extra ping)."""
+        svc = svc or MongoService()
+        svc.client = self.client
+        svc.uri = self.uri
+        svc.db_name = self.db_name
+        svc.collection_name = collection_name
+        svc.collection = self.client[self.db_name][collection_name]
+        svc.attached = OrderedDict([(collection_name, svc)])
+        svc.attached_names = self.attached_names  # Pipelines on a child may still join its siblings
+        svc.last_healthy = self.last_healthy
+        return svc
+
+    def is_healthy(self) -> bool:
+        """True if the client is still open and completed a round-trip within the health check interval."""
+        age = time.monotonic() - self.last_healthy
+        return (self.client is not None and age < AppConfig.MONGO_HEALTH_CHECK_INTERVAL_SECONDS
+                and get_client_registry().is_open(self.client))
+
+    def ensure_healthy(self):
+        """
+        Pings the server unless the pooled client is already known to be healthy.
+        A client the registry has closed is replaced by reconnecting first.
+        """
+        if self.is_healthy():
+            return
+        if self.uri and not get_client_registry().is_open(self.client):
+            self.connect(self.uri, self.db_name, ",".join(self.attached_names) or self.collection_name)
+            return
+        self.client.admin.command('ping')
+        self.last_healthy = time.monotonic()
+
     def fetch_documents(self, limit: int = 50) -> str:
         """
-        Fetches documents and returns them as a JSON string.
+        Fetches documents and returns them as a compact JSON string.
         Handles ObjectId serialization automatically.
         """
+        text, _ = self.fetch_context(limit=limit)
+        return text
+
+    def fetch_context(self, limit: int = 50, builder: Optional[ContextBuilder] = None):
+        """
+        Fetches up to `limit` documents, trimmed server-side and packed into the
+        builder's byte budget. Also records the top-level field types it saw.
+        Returns: (json_text, stats) where stats says how many docs/fields made it in.
+        """
+        return self.query_context(limit=limit, builder=builder, learn_fields=True)
+
+    @timed("mongo.query_context")
+    def query_context(self, filter: Optional[Dict[str, Any]] = None, sort: Optional[List] = None,
+                      limit: int = 50, sample: bool = False, max_time_ms: Optional[int] = None,
+                      builder: Optional[ContextBuilder] = None, learn_fields: bool = False):
+        """
+        Runs a targeted read ($match, then $sample or $sort + $limit) and packs the
+        result into the builder's byte budget.
+        Returns: (json_text, stats)
+        """
+        builder = builder or ContextBuilder()
+        cursor = self._aggregate(filter, sort, limit, sample, max_time_ms, builder)
+        try:
+            # Stream straight from the cursor: the builder stops reading once its budget is full
+            docs = self._decoded(cursor)
+            docs = self._learning(docs) if learn_fields else docs
+            return builder.build(docs)
+        except Exception as e:
+            raise RuntimeError(f"Error fetching data: {str(e)}")
+        finally:
+            cursor.close()
+
+    @timed("mongo.query_documents")
+    def query_documents(self, filter: Optional[Dict[str, Any]] = None, sort: Optional[List] = None,
+                        limit: int = 50, sample: bool = False, max_time_ms: Optional[int] = None,
+                        builder: Optional[ContextBuilder] = None, learn_fields: bool = False) -> List[Dict[str, Any]]:
+        """Same read as query_context(), returning the (server-trimmed) raw documents."""
+        cursor = self._aggregate(filter, sort, limit, sample, max_time_ms, builder)
+        try:
+            docs = list(self._decoded(cursor))
+        except Exception as e:
+            raise RuntimeError(f"Error fetching data: {str(e)}")
+        finally:
+            cursor.close()
+        if learn_fields:
+            self._learn_field_types(docs)
+        return docs
+
+    def _aggregate(self, filter, sort, limit, sample, max_time_ms, builder):
+        """Opens the cursor shared by query_context() and query_documents()."""
         if self.collection is None:
             raise ConnectionError("Collection not initialized. Call connect() first.")
 
+        stages = []
+        if filter:
+            stages.append({"$match": filter})
+        if sample:
+            stages.append({"$sample": {"size": limit}})
+        else:
+            if sort:
+                stages.append({"$sort": dict(sort)})
+            stages.append({"$limit": limit})
+
+        builder = builder or ContextBuilder()
         try:
-            cursor = self.collection.find().limit(limit)
-            docs = list(cursor)
-            
-            # Serialize non-JSON serializable fields (like ObjectId)
-            cleaned_docs = self._serialize_docs(docs)
-            return json.dumps(cleaned_docs, indent=2)
+            kwargs = {"maxTimeMS": max_time_ms} if max_time_ms else {}
+            raw = self.collection.with_options(codec_options=self.RAW_CODEC)
+            cursor = raw.aggregate(stages + builder.server_stages(),
+                                   batchSize=AppConfig.STREAM_BATCH_SIZE, **kwargs)
+            self.last_healthy = time.monotonic()
+            return cursor
         except Exception as e:
             raise RuntimeError(f"Error fetching data: {str(e)}")
 
-    def _serialize_docs(self, docs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-        """Helper to convert MongoDB types to strings."""
+    @timed("mongo.run_pipeline")
+    def run_pipeline(self, pipeline: List[Dict[str, Any]],
+                     max_results: int = AppConfig.AGGREGATION_MAX_RESULTS,
+                     max_bytes: int = AppConfig.AGGREGATION_MAX_RESULT_BYTES,
+                     max_time_ms: int = AppConfig.AGGREGATION_MAX_TIME_MS):
+        """
+        Runs a model-written pipeline over the whole collection, after checking it
+        against the read-only allow-list (ValueError if it fails). Disk spills are
+        off and a $limit is appended, so the server does the heavy work and only
+        a small result comes back.
+        Returns: (docs, truncated)
+        """
+        if self.collection is None:
+            raise ConnectionError("Collection not initialized. Call connect() first.")
+        PipelineValidator(self.attached_names or [self.collection_name]).validate(pipeline)
+
+        raw = self.collection.with_options(codec_options=self.RAW_CODEC)
+        try:
+            # One extra document tells us the result was cut
+            cursor = raw.aggregate(pipeline + [{"$limit": max_results + 1}], maxTimeMS=max_time_ms,
+                                   allowDiskUse=False, batchSize=max_results + 1)
+        except Exception as e:
+            raise RuntimeError(f"Error running pipeline: {str(e)}")
+        docs, used, truncated = [], 0, False
+        try:
+            for doc in cursor:
+                raw = doc.raw if isinstance(doc, RawBSONDocument) else bson.encode(doc)
+                used += len(raw)
+                if len(docs) == max_results or used > max_bytes:
+                    truncated = True
+                    break
+                docs.append(bson.decode(raw) if isinstance(doc, RawBSONDocument) else doc)
+            self.last_healthy = time.monotonic()
+        except Exception as e:
+            raise RuntimeError(f"Error running pipeline: {str(e)}")
+        finally:
+            cursor.close()
+        return docs, truncated
+
+    def stream_documents(self, filter: Optional[Dict[str, Any]] = None,
+                         projection: Optional[List[str]] = None, exclude: Optional[List[str]] = None,
+                         sort: Optional[List] = None, limit: int = 0,
+                         batch_size: int = AppConfig.STREAM_BATCH_SIZE,
+                         max_bytes: int = AppConfig.STREAM_MAX_BYTES,
+                         max_time_ms: int = AppConfig.STREAM_MAX_TIME_MS) -> Iterator[Dict[str, Any]]:
+        """
+        Yields documents one batch at a time instead of loading the result set.
+        projection lists the fields to keep, exclude the fields to leave out (not both).
+        The cursor is closed as soon as max_bytes of BSON has been read.
+        """
+        if self.collection is None:
+            raise ConnectionError("Collection not initialized. Call connect() first.")
+        if projection and exclude:
+            raise ValueError("Use either projection or exclude, not both.")
+
+        fields = None
+        if projection:
+            fields = {name: 1 for name in projection}
+        elif exclude:
+            fields = {name: 0 for name in exclude}
+        # Errors above raise here at the call site, not on the first next()
+        return self._stream_documents(filter or {}, fields, sort, limit, batch_size, max_bytes, max_time_ms)
+
+    def _stream_documents(self, filter: Dict[str, Any], fields: Optional[Dict[str, int]], sort: Optional[List],
+                          limit: int, batch_size: int, max_bytes: int, max_time_ms: int) -> Iterator[Dict[str, Any]]:
+        """The generator behind stream_documents(); the cursor is opened on the first next()."""
+        raw = self.collection.with_options(codec_options=self.RAW_CODEC)
+        cursor = raw.find(filter, fields, limit=limit, batch_size=batch_size, max_time_ms=max_time_ms)
+        if sort:
+            cursor = cursor.sort(sort)
+        try:
+            yield from self._decoded(cursor, max_bytes)
+            self.last_healthy = time.monotonic()
+        except Exception as e:
+            raise RuntimeError(f"Error fetching data: {str(e)}")
+        finally:
+            cursor.close()
+
+    @staticmethod
+    def _decoded(cursor, max_bytes: int = AppConfig.STREAM_MAX_BYTES) -> Iterator[Dict[str, Any]]:
+        """Decodes raw documents one at a time, stopping once max_bytes have been read."""
+        return decode_raw_documents(cursor, max_bytes)
+
+    def render_documents(self, docs: List[Dict[str, Any]], builder: Optional[ContextBuilder] = None):
+        """Packs documents into prompt JSON. Returns: (json_text, stats)"""
+        builder = builder or ContextBuilder()
+        # The builder's encoder converts BSON types without touching the originals
+        return builder.build(docs)
+
+    @timed("mongo.fetch_snapshot")
+    def fetch_snapshot(self, limit: int = 50) -> ContextSnapshot:
+        """
+        Fetches the connect-time documents as a ContextSnapshot that can later be
+        refreshed incrementally (change stream where available, else polling).
+        """
+        if self.collection is None:
+            raise ConnectionError("Collection not initialized. Call connect() first.")
+
+        # Open the change stream *before* reading, so no change falls in between
+        resume_token = None
+        try:
+            with self.collection.watch(max_await_time_ms=1) as stream:
+                resume_token = stream.resume_token
+        except (OperationFailure, ConnectionFailure):
+            pass  # Standalone server or no permission: poll instead
+
+        docs = self.query_documents(limit=limit, learn_fields=True)
+        return ContextSnapshot(docs, limit, resume_token=resume_token)
+
+    def adopt_snapshot(self, snapshot: ContextSnapshot):
+        """Learns field types from a snapshot another session fetched (shared store hit)."""
+        self._learn_field_types(snapshot.docs.values())
+
+    def render_snapshot(self, snapshot: ContextSnapshot, builder: Optional[ContextBuilder] = None):
+        """Returns: (json_text, stats) for the snapshot's current documents."""
+        return self.render_documents(list(snapshot.docs.values()), builder)
+
+    def _learning(self, docs):
+        """Passes documents through while recording their field types."""
+        for doc in docs:
+            self._learn_field_types((doc,))
+            yield doc
+
+    def _learn_field_types(self, docs: List[Dict[str, Any]]):
+        """Remembers a coarse type per top-level field (used to plan targeted queries)."""
         for doc in docs:
-            if '_id' in doc:
-                doc['_id'] = str(doc['_id'])
-            # Add handlers for Dates or Binary data here if needed
-        return docs
\ No newline at end of file
+            for key, value in doc.items():
+                if value is None or key in self.field_types:
+                    continue
+                if isinstance(value, bool):
+                    self.field_types[key] = "bool"
+                elif isinstance(value, (int, float, Decimal128)):
+                    self.field_types[key] = "number"
+                elif isinstance(value, str):
+                    self.field_types[key] = "string"
+                elif isinstance(value, datetime):
+                    self.field_types[key] = "date"
+                else:
+                    self.field_types[key] = "other"
+
+    # BSON $type names grouped into the coarse types used by field_types
+    PROFILE_TYPE_GROUPS = {
+        "string": "string", "int": "number", "long": "number", "double": "number",
+        "decimal": "number", "date": "date", "bool": "bool",
+    }
+
+    @timed("mongo.profile_collection")
+    def profile_collection(self, sample_size: int = AppConfig.PROFILE_SAMPLE_SIZE) -> Dict[str, Any]:
+        """
+        Computes field types, null rates, cardinality, numeric min/max/mean and top
+        string values from one $sample + $facet aggregation (no collection scan).
+        """
+        if self.collection is None:
+            raise ConnectionError("Collection not initialized. Call connect() first.")
+
+        value_type = {"$type": "$kv.v"}
+        is_number = {"$in": [value_type, ["int", "long", "double", "decimal"]]}
+        is_scalar = {"$in": [value_type, ["string", "int", "long", "double", "decimal", "bool", "date", "objectId"]]}
+        max_chars = AppConfig.PROFILE_MAX_VALUE_CHARS
+        # Strings enter the distinct set as a bounded prefix, so free text can't blow up the group
+        distinct_value = {"$cond": [
+            {"$eq": [value_type, "string"]}, {"$substrCP": ["$kv.v", 0, max_chars]},
+            {"$cond": [is_scalar, "$kv.v", "$$REMOVE"]},
+        ]}
+        unwind_fields = [
+            {"$project": {"kv": {"$objectToArray": "$$ROOT"}}},
+            {"$unwind": "$kv"},
+        ]
+        pipeline = [
+            {"$sample": {"size": sample_size}},
+            {"$facet": {
+                "total": [{"$count": "n"}],
+                "fields": unwind_fields + [
+                    {"$group": {
+                        "_id": "$kv.k",
+                        "present": {"$sum": 1},
+                        "nulls": {"$sum": {"$cond": [{"$eq": [value_type, "null"]}, 1, 0]}},
+                        "types": {"$addToSet": value_type},
+                        # Only small scalar values go into the distinct set
+                        "distinct": {"$addToSet": distinct_value},
+                        "min": {"$min": {"$cond": [is_number, "$kv.v", "$$REMOVE"]}},
+                        "max": {"$max": {"$cond": [is_number, "$kv.v", "$$REMOVE"]}},
+                        "mean": {"$avg": {"$cond": [is_number, "$kv.v", "$$REMOVE"]}},
+                    }},
+                    {"$project": {
+                        "present": 1, "nulls": 1, "types": 1, "min": 1, "max": 1, "mean": 1,
+                        "cardinality": {"$size": "$distinct"},
+                    }},
+                ],
+                "top_values": unwind_fields + [
+                    # Short strings only: long free text is never a "top value"
+                    {"$match": {"$expr": {"$and": [
+                        {"$eq": [value_type, "string"]},
+                        {"$lte": [{"$strLenCP": {"$cond": [{"$eq": [value_type, "string"]}, "$kv.v", ""]}}, max_chars]},
+                    ]}}},
+                    {"$group": {"_id": {"k": "$kv.k", "v": "$kv.v"}, "count": {"$sum": 1}}},
+                    {"$sort": {"count": -1}},
+                    {"$group": {"_id": "$_id.k", "values": {"$push": {"v": "$_id.v", "c": "$count"}}}},
+                    {"$project": {"values": {"$slice": ["$values", AppConfig.PROFILE_TOP_VALUES]}}},
+                ],
+            }},
+        ]
+
+        try:
+            result = next(self.collection.aggregate(pipeline, maxTimeMS=AppConfig.PROFILE_MAX_TIME_MS), {})
+            estimated = self.collection.estimated_document_count()
+            self.last_healthy = time.monotonic()
+        except Exception as e:
+            raise RuntimeError(f"Error profiling collection: {str(e)}")
+
+        sampled = result["total"][0]["n"] if result.get("total") else 0
+        top_values = {t["_id"]: t["values"] for t in result.get("top_values", [])}
+        fields = {}
+        for f in sorted(result.get("fields", []), key=lambda f: -f["present"]):
+            stats = {
+                "types": sorted(f["types"]),
+                "null_rate": 1 - (f["present"] - f["nulls"]) / sampled if sampled else 0,
+                "cardinality": f["cardinality"],
+            }
+            if f.get("mean") is not None:
+                stats.update(min=f["min"], max=f["max"], mean=float(str(f["mean"])))
+            if f["_id"] in top_values and f["cardinality"] <= AppConfig.PROFILE_LOW_CARDINALITY:
+                stats["top"] = [(t["v"], t["c"]) for t in top_values[f["_id"]]]
+            fields[f["_id"]] = stats
+
+        return {"estimated_count": estimated, "sampled": sampled, "fields": fields}
+
+    def _profile_key(self):
+        return (uri_fingerprint(self.uri), self.db_name, self.collection_name)
+
+    def get_profile(self) -> Dict[str, Any]:
+        """Returns the collection profile, from the shared cache when it is fresh."""
+        cache = get_profile_cache()
+        profile = cache.get(self._profile_key())
+        if profile is None:
+            profile = self.profile_collection()
+            cache.put(self._profile_key(), profile)
+
+        # Fill in field types the snapshot didn't show us (used for retrieval planning)
+        for name, stats in profile["fields"].items():
+            groups = [self.PROFILE_TYPE_GROUPS.get(t) for t in stats["types"] if t != "null"]
+            if name not in self.field_types and groups:
+                self.field_types[name] = groups[0] or "other"
+        return profile
+
+    def invalidate_profile(self):
+        """Drops the cached profile after the collection changed."""
+        get_profile_cache().invalidate(self._profile_key())
+
+    @staticmethod
+    def summarize_profile(profile: Dict[str, Any], max_fields: int = 40) -> str:
+        """Compact, prompt-friendly text version of a collection profile."""
+        lines = [
+            f"~{profile['estimated_count']:,} documents in total "
+            f"(field stats below are from a random sample of {profile['sampled']:,})."
+        ]
+        for name, f in list(profile["fields"].items())[:max_fields]:
+            parts = ["/".join(f["types"])]
+            if f["null_rate"] >= 0.01:
+                parts.append(f"{f['null_rate']:.0%} null/missing")
+            if "mean" in f:
+                parts.append(f"min {f['min']}, max {f['max']}, mean {f['mean']:.4g}")
+            if "top" in f:
+                top = ", ".join(f"{str(v)[:40]} ({c})" for v, c in f["top"])
+                parts.append(f"{f['cardinality']} distinct: {top}")
+            elif f["cardinality"]:
+                parts.append(f"~{f['cardinality']} distinct in sample")
+            lines.append(f"- {name}: " + "; ".join(parts))
+        return "\n".join(lines)
+
+    def _serialize_docs(self, docs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Converts MongoDB types (ObjectId, dates, Decimal128, binary, ...) to JSON values."""
+        encoder = BsonJsonEncoder(max_string_chars=None, max_array_items=None)
+        return [encoder.to_jsonable(doc) for doc in docs]
@@ -0,0 +1,183 @@
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone, timedelta
+from typing import Optional
+import streamlit as st
+from src.config import AppConfig
+from src.services.user_service import UserService
+from src.utils.metrics import get_metrics
+
+class ResponseCache:
+    """
+    Cache of model answers keyed by (context hash, normalized question).
+    Tier 1 is an exact match, tier 2 an optional near-duplicate match among
+    questions asked over the same context: similar word sets that differ only
+    in filler words ("please", "the", "show me"). Entries live in a
+    size-bounded in-memory LRU and in the master DB, so hits survive restarts
+    and are shared across replicas.
+    """
+
+    def __init__(self, max_entries: int = AppConfig.RESPONSE_CACHE_MAX_ENTRIES,
+                 ttl_seconds: float = AppConfig.RESPONSE_CACHE_TTL_SECONDS,
+                 similarity: Optional[float] = AppConfig.RESPONSE_CACHE_SIMILARITY,
+                 persist: bool = True):
+        self.lock = threading.Lock()
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity = similarity  # None disables the near-duplicate tier
+        self.persist = persist
+        self.entries = OrderedDict()  # key -> (answer, context_hash, words, created_at)
+        self.hits_exact = 0
+        self.hits_near = 0
+        self.misses = 0
+
+        if self.persist:
+            try:
+                col = self._collection()
+                col.create_index("expires_at", expireAfterSeconds=0)
+                col.create_index("context_hash")
+            except Exception as e:
+                print(f"Response Cache Index Error: {e}")
+
+    @staticmethod
+    def _collection():
+        return UserService().db["response_cache"]
+
+    @staticmethod
+    def context_hash(*parts: Optional[str]) -> str:
+        """Hash of everything the answer depends on besides the question."""
+        h = hashlib.sha256()
+        for part in parts:
+            h.update((part or "").encode("utf-8"))
+            h.update(b"\0")
+        return h.hexdigest()
+
+    @staticmethod
+    def normalize(question: str) -> str:
+        return " ".join(re.findall(r"[a-z0-9]+", question.lower()))
+
+    # The only words two questions may differ in and still share an answer.
+    # Negations, entities and every other content word change the answer.
+    FILLER_WORDS = {
+        "a", "an", "the", "please", "pls", "me", "us", "can", "could", "would", "you",
+        "show", "tell", "give", "list", "i", "want", "to", "know", "is", "are",
+        "what", "s", "whats", "do", "does", "hey", "hi", "thanks", "thank",
+    }
+
+    def _key(self, context_hash: str, normalized: str) -> str:
+        return hashlib.sha256(f"{context_hash}\n{normalized}".encode("utf-8")).hexdigest()
+
+    def _is_near(self, words: set, other: set) -> bool:
+        """Word-set Jaccard similarity, where only filler words may differ (punctuation is already gone)."""
+        if not words or not other:
+            return False
+        if not (words ^ other) <= self.FILLER_WORDS:
+            return False  # "not", "paris" vs "berlin", a number, ...: a different question
+        return len(words & other) / len(words | other) >= self.similarity
+
+    def _remember(self, key, answer, context_hash, words, created_at):
+        """Adds an entry to the memory tier. Caller must hold the lock."""
+        self.entries[key] = (answer, context_hash, words, created_at)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def get(self, context_hash: str, question: str) -> Optional[str]:
+        """Returns a cached answer for this context + question, or None."""
+        normalized = self.normalize(question)
+        words = set(normalized.split())
+        key = self._key(context_hash, normalized)
+        now = time.time()
+
+        # 1. Exact match in memory, then near-duplicates in memory
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and now - entry[3] <= self.ttl_seconds:
+                self.entries.move_to_end(key)
+                self.hits_exact += 1
+                return entry[0]
+            if self.similarity is not None:
+                for answer, ctx, other, created_at in reversed(self.entries.values()):
+                    if ctx == context_hash and now - created_at <= self.ttl_seconds and self._is_near(words, other):
+                        self.hits_near += 1
+                        return answer
+
+        # 2. Shared tier in the master DB (answers from other replicas / before a restart)
+        if self.persist:
+            try:
+                query = {"context_hash": context_hash, "expires_at": {"$gt": datetime.now(timezone.utc)}}
+                if self.similarity is None:
+                    query["_id"] = key
+                # Scan only the (short) questions; the answer is fetched for the winner
+                col = self._collection()
+                candidates = col.find(query, {"question": 1}).sort("created_at", -1).limit(200)
+                match = None
+                for doc in candidates:
+                    other = set(doc["question"].split())
+                    if doc["_id"] == key:
+                        match = (doc["_id"], other, True)
+                        break
+                    if match is None and self.similarity is not None and self._is_near(words, other):
+                        match = (doc["_id"], other, False)
+
+                hit = col.find_one({"_id": match[0]}, {"answer": 1}) if match else None
+                if hit is not None:
+                    with self.lock:
+                        self._remember(hit["_id"], hit["answer"], context_hash, match[1], now)
+                        if match[2]:
+                            self.hits_exact += 1
+                        else:
+                            self.hits_near += 1
+                    return hit["answer"]
+            except Exception as e:
+                print(f"Response Cache Read Error: {e}")
+
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def put(self, context_hash: str, question: str, answer: str):
+        """Stores an answer in memory and (best effort) in the master DB."""
+        normalized = self.normalize(question)
+        key = self._key(context_hash, normalized)
+        with self.lock:
+            self._remember(key, answer, context_hash, set(normalized.split()), time.time())
+
+        if self.persist:
+            now = datetime.now(timezone.utc)
+            try:
+                self._collection().replace_one(
+                    {"_id": key},
+                    {
+                        "context_hash": context_hash,
+                        "question": normalized,
+                        "answer": answer,
+                        "created_at": now,
+                        "expires_at": now + timedelta(seconds=self.ttl_seconds),
+                    },
+                    upsert=True
+                )
+            except Exception as e:
+                print(f"Response Cache Write Error: {e}")
+
+    def stats(self) -> dict:
+        with self.lock:
+            hits = self.hits_exact + self.hits_near
+            total = hits + self.misses
+            return {
+                "hits_exact": self.hits_exact,
+                "hits_near": self.hits_near,
+                "misses": self.misses,
+                "hit_ratio": hits / total if total else 0.0,
+                "entries": len(self.entries),
+            }
+
+# Singleton
+@st.cache_resource
+def get_response_cache():
+    cache = ResponseCache()
+    get_metrics().register_gauge("response_cache", cache.stats)
+    return cache
@@ -0,0 +1,215 @@
+import json
+import re
+from typing import Dict, List, Optional
+from src.config import AppConfig
+from src.services.mongo_service import MongoService
+from src.utils.metrics import timed
+
+class RetrievalPlan:
+    """What to read for one question: a $match filter, then either $sample or $sort + $limit."""
+
+    def __init__(self, filter: Optional[Dict] = None, sort: Optional[List] = None,
+                 limit: int = AppConfig.RETRIEVAL_TOP_K, sample: bool = False):
+        self.filter = filter or {}
+        self.sort = sort or []   # [(field, 1 | -1), ...]
+        self.limit = max(1, min(limit, AppConfig.RETRIEVAL_TOP_K))
+        self.sample = sample
+
+    def __repr__(self):
+        return f"RetrievalPlan(filter={self.filter}, sort={self.sort}, limit={self.limit}, sample={self.sample})"
+
+class QueryStrategy:
+    """Turns a question into a RetrievalPlan. Subclasses implement plan()."""
+
+    def plan(self, question: str, field_types: Dict[str, str]) -> Optional[RetrievalPlan]:
+        """Returns a plan, or None to say 'no targeted read, use the snapshot'."""
+        raise NotImplementedError
+
+class KeywordQueryStrategy(QueryStrategy):
+    """
+    Local, model-free translation: sort hints ("highest price", "top 5 ... rating"),
+    sampling hints ("random", "examples") and keyword matching on string fields.
+    """
+
+    SORT_HINTS = {
+        "highest": -1, "most": -1, "max": -1, "maximum": -1, "largest": -1, "biggest": -1,
+        "top": -1, "best": -1, "latest": -1, "newest": -1, "recent": -1, "expensive": -1,
+        "lowest": 1, "least": 1, "min": 1, "minimum": 1, "smallest": 1, "cheapest": 1,
+        "bottom": 1, "worst": 1, "oldest": 1, "earliest": 1,
+    }
+    DATE_HINTS = {"latest", "newest", "recent", "oldest", "earliest"}
+    SAMPLE_HINTS = {"random", "sample", "example", "examples", "some"}
+    STOPWORDS = {
+        "the", "and", "for", "are", "was", "were", "what", "which", "who", "whom", "whose",
+        "how", "many", "much", "does", "did", "have", "has", "with", "from", "that", "this",
+        "there", "their", "they", "about", "any", "all", "show", "list", "tell", "give",
+        "find", "get", "can", "you", "please", "into", "than", "then", "per", "each",
+        "data", "document", "documents", "record", "records", "collection", "item", "items",
+    }
+    MAX_KEYWORDS = 4
+    MAX_KEYWORD_FIELDS = 8
+
+    @staticmethod
+    def _tokens(text: str) -> List[str]:
+        return re.findall(r"[a-z0-9]+", text.lower())
+
+    @staticmethod
+    def _field_tokens(field: str) -> set:
+        # "unitPrice" / "unit_price" -> {"unit", "price", "unitprice"}
+        spaced = re.sub(r"([a-z0-9])([A-Z])", r"\1 \2", field)
+        parts = set(re.findall(r"[a-z0-9]+", spaced.lower()))
+        parts.add(field.lower().replace("_", ""))
+        return parts
+
+    def plan(self, question, field_types):
+        words = self._tokens(question)
+        word_set = set(words)
+        limit = AppConfig.RETRIEVAL_TOP_K
+        top_n = re.search(r"\b(?:top|first|last|bottom)\s+(\d+)", question.lower())
+        if top_n:
+            limit = int(top_n.group(1))
+
+        mentioned = [f for f in field_types if self._field_tokens(f) & word_set]
+
+        # 1. Sort intent: "highest rating", "cheapest product", "latest orders"
+        # "top"/"bottom" only say how many; "top 3 cheapest" sorts ascending
+        hints = [w for w in words if w in self.SORT_HINTS]
+        specific = [w for w in hints if w not in ("top", "bottom")]
+        direction = self.SORT_HINTS[(specific or hints)[0]] if hints else None
+        if direction is not None:
+            sortable = [f for f in mentioned if field_types[f] in ("number", "date")]
+            if not sortable and word_set & self.DATE_HINTS:
+                sortable = [f for f, t in field_types.items() if t == "date"][:1]
+            if not sortable and len([t for t in field_types.values() if t == "number"]) == 1:
+                sortable = [f for f, t in field_types.items() if t == "number"]
+            if sortable:
+                return RetrievalPlan(sort=[(sortable[0], direction)], limit=limit)
+
+        # 2. Sampling intent: "show me some random examples"
+        if word_set & self.SAMPLE_HINTS:
+            return RetrievalPlan(limit=limit, sample=True)
+
+        # 3. Keyword match on string fields: "orders from Berlin"
+        field_words = set().union(*(self._field_tokens(f) for f in field_types)) if field_types else set()
+        keywords = [
+            w for w in dict.fromkeys(words)
+            if len(w) >= 3 and w not in self.STOPWORDS and w not in self.SORT_HINTS and w not in field_words
+        ][:self.MAX_KEYWORDS]
+        string_fields = [f for f, t in field_types.items() if t == "string" and f != "_id"][:self.MAX_KEYWORD_FIELDS]
+        if keywords and string_fields:
+            clauses = [
+                {f: {"$regex": re.escape(kw), "$options": "i"}}
+                for kw in keywords for f in string_fields
+            ]
+            return RetrievalPlan(filter={"$or": clauses}, limit=limit)
+
+        return None
+
+class LLMQueryStrategy(QueryStrategy):
+    """
+    Asks the model for a plan as JSON. Anything that doesn't parse or uses an
+    operator outside the read-only allow-list falls back to the keyword strategy.
+    """
+
+    ALLOWED_OPERATORS = {
+        "$eq", "$ne", "$gt", "$gte", "$lt", "$lte", "$in", "$nin",
+        "$and", "$or", "$nor", "$not", "$exists", "$regex", "$options",
+    }
+
+    def __init__(self, complete, fallback: Optional[QueryStrategy] = None):
+        self.complete = complete  # complete(prompt) -> str | None
+        self.fallback = fallback or KeywordQueryStrategy()
+
+    def _is_safe(self, value) -> bool:
+        if isinstance(value, dict):
+            return all(
+                (not k.startswith("$") or k in self.ALLOWED_OPERATORS) and self._is_safe(v)
+                for k, v in value.items()
+            )
+        if isinstance(value, list):
+            return all(self._is_safe(v) for v in value)
+        return True
+
+    def plan(self, question, field_types):
+        prompt = (
+            "Translate the question into a MongoDB read plan. Reply with JSON only, shaped like\n"
+            '{"filter": {...}, "sort": {"field": 1 or -1}, "limit": number, "sample": true/false}\n'
+            f"Fields and types: {json.dumps(field_types)}\n"
+            f"Question: {question}"
+        )
+        try:
+            reply = self.complete(prompt) or ""
+            reply = re.sub(r"^```(?:json)?|```$", "", reply.strip()).strip()
+            raw = json.loads(reply)
+            filter_ = raw.get("filter") or {}
+            if not isinstance(filter_, dict) or not self._is_safe(filter_):
+                raise ValueError("Unsafe filter")
+            sort = [(f, -1 if d == -1 else 1) for f, d in (raw.get("sort") or {}).items()]
+            return RetrievalPlan(
+                filter=filter_, sort=sort,
+                limit=int(raw.get("limit") or AppConfig.RETRIEVAL_TOP_K),
+                sample=bool(raw.get("sample")),
+            )
+        except Exception:
+            return self.fallback.plan(question, field_types)
+
+class Retriever:
+    """
+    Runs the strategy's plan against the user's collection for each question.
+    With several attached collections, the one the question names (or whose
+    fields it mentions) is queried, and the result is labelled with its name.
+    """
+
+    def __init__(self, mongo_svc: MongoService, strategy: Optional[QueryStrategy] = None):
+        self.mongo_svc = mongo_svc
+        self.strategy = strategy or KeywordQueryStrategy()
+
+    @staticmethod
+    def _singular(words) -> set:
+        # "order"/"orders" both name the orders collection
+        return set(words) | {w[:-1] for w in words if w.endswith("s")}
+
+    def target(self, question: str) -> MongoService:
+        """The attached collection the question is about (the first one on a tie)."""
+        attached = self.mongo_svc.attached
+        if len(attached) <= 1:
+            return self.mongo_svc
+
+        words = self._singular(KeywordQueryStrategy._tokens(question))
+
+        def score(svc):
+            name_words = self._singular(KeywordQueryStrategy._field_tokens(svc.collection_name))
+            fields = sum(1 for f in svc.field_types if f != "_id" and KeywordQueryStrategy._field_tokens(f) & words)
+            return 2 * len(name_words & words) + fields
+        return max(attached.values(), key=score)
+
+    @timed("retrieval.retrieve")
+    def retrieve(self, question: str, fallback: str):
+        """
+        Returns (context_json, plan) with only the documents relevant to the question.
+        Falls back to the connect-time snapshot if there is no plan, no match or an error.
+        """
+        svc = self.target(question)
+        if len(self.mongo_svc.attached) > 1:
+            # The collection's own name picks the collection; it is not a keyword to search for
+            name_words = self._singular(KeywordQueryStrategy._field_tokens(svc.collection_name))
+            question = " ".join(w for w in re.findall(r"\S+", question)
+                                if not self._singular(KeywordQueryStrategy._tokens(w)) & name_words)
+        plan = self.strategy.plan(question, svc.field_types)
+        if plan is None:
+            return fallback, None
+
+        try:
+            text, stats = svc.query_context(
+                filter=plan.filter, sort=plan.sort, limit=plan.limit, sample=plan.sample,
+                max_time_ms=AppConfig.RETRIEVAL_MAX_TIME_MS,
+            )
+        except Exception as e:
+            print(f"Retrieval Error: {e}")
+            return fallback, None
+
+        if stats["docs"] == 0:
+            return fallback, None
+        if len(self.mongo_svc.attached) > 1:
+            text = f"{{{json.dumps(svc.collection_name)}:{text}}}"
+        return text, plan
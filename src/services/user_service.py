@@ -1,22 +1,39 @@
-import bcrypt
-import pymongo
 import re
+import streamlit as st
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
 from datetime import datetime, timezone, timedelta
 from cryptography.fernet import Fernet
 from src.config import AppConfig
+from src.utils.mongo_pool import get_client_registry
+from src.utils.metrics import get_metrics, timed
+from src.utils.password_hasher import get_login_throttle, get_password_hasher
+
+# Singleton
+@st.cache_resource
+def get_cipher():
+    """Fernet for saved connection strings, built once per process."""
+    # Ensure encryption key is bytes
+    key = AppConfig.ENCRYPTION_KEY
+    if isinstance(key, str):
+        key = key.encode()
+    return Fernet(key)
+
+# Singleton
+@st.cache_resource
+def ensure_master_indexes():
+    """Indexes the master DB's writes rely on, created once per process instead of per write."""
+    UserService().ensure_chat_archive_indexes()
 
 class UserService:
-    def __init__(self):
+    def __init__(self, cache=None):
         AppConfig.validate_secrets()
-        self.client = pymongo.MongoClient(AppConfig.MASTER_MONGO_URI)
+        self.cache = cache  # Optional per-session UserCache (see src/utils/user_cache.py)
+        # Shared, pooled client and cipher (cheap to call on every rerun)
+        self.client = get_client_registry().get_client(AppConfig.MASTER_MONGO_URI, holder=self)
         self.db = self.client["mongochat_master"]
         self.users_col = self.db["users"]
-        
-        # Ensure encryption key is bytes
-        key = AppConfig.ENCRYPTION_KEY
-        if isinstance(key, str):
-            key = key.encode()
-        self.cipher = Fernet(key)
+        self.cipher = get_cipher()
 
     def create_user(self, email, username, password):
         """Register a new user."""
@@ -28,8 +45,8 @@ class UserService:
         if self.users_col.find_one({"email": email}):
             raise ValueError("User with this email already exists.")
             
-        # 2. Hash Password
-        hashed_pw = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
+        # 2. Hash Password (on the bounded bcrypt pool)
+        hashed_pw = get_password_hasher().hash(password)
         
         user_doc = {
             "email": email,
@@ -47,16 +64,43 @@ class UserService:
         self.users_col.insert_one(user_doc)
         return True
 
-    def verify_user(self, email, password):
-        """Login check."""
+    @timed("user.verify_user")
+    def verify_user(self, email, password, ip_address=None):
+        """
+        Login check. Emails/IPs with too many recent failures are refused
+        before any bcrypt work; hashes made with an outdated cost are upgraded.
+        """
+        throttle = get_login_throttle()
+        keys = [(f"email:{email.lower()}", AppConfig.LOGIN_MAX_FAILURES_PER_EMAIL)]
+        if ip_address:
+            keys.append((f"ip:{ip_address}", AppConfig.LOGIN_MAX_FAILURES_PER_IP))
+        wait = max(throttle.retry_after(key, limit) for key, limit in keys)
+        if wait > 0:
+            raise ValueError(f"Too many failed login attempts. Try again in {int(wait // 60) + 1} min.")
+
         user = self.users_col.find_one({"email": email})
-        if not user:
+        hasher = get_password_hasher()
+        if not user or not hasher.verify(password, user["password_hash"]):
+            for key, _ in keys:
+                throttle.record_failure(key)
             return None
-        
-        if bcrypt.checkpw(password.encode('utf-8'), user["password_hash"]):
-            return user
-        return None
 
+        throttle.reset(keys[0][0])
+        if self.cache is not None:
+            self.cache.put(email, user)  # First reruns after login need no extra read
+        if hasher.needs_rehash(user["password_hash"]):
+            try:
+                new_hash = hasher.hash(password)
+                self.users_col.update_one(
+                    {"_id": user["_id"], "password_hash": user["password_hash"]},
+                    {"$set": {"password_hash": new_hash}}
+                )
+                user["password_hash"] = new_hash
+            except Exception as e:
+                print(f"Password Rehash Error: {e}")
+        return user
+
+    @timed("user.save_user_config")
     def save_user_config(self, email, mongo_uri, db_name, col_name):
         """Encrypts and saves the user's connection details."""
         if not mongo_uri:
@@ -64,60 +108,162 @@ class UserService:
             
         encrypted_uri = self.cipher.encrypt(mongo_uri.encode())
         
-        self.users_col.update_one(
-            {"email": email},
-            {"$set": {
-                "saved_mongo_uri": encrypted_uri,
-                "saved_db_name": db_name,
-                "saved_collection": col_name
-            }}
-        )
+        fields = {
+            "saved_mongo_uri": encrypted_uri,
+            "saved_db_name": db_name,
+            "saved_collection": col_name
+        }
+        self.users_col.update_one({"email": email}, {"$set": fields})
+        
+        if self.cache is not None:
+            self.cache.update(email, fields)
+            self.cache.put_config(email, encrypted_uri, {"mongo_uri": mongo_uri, "db_name": db_name, "collection": col_name})
+
+    def get_user(self, email):
+        """The user's document without the password hash (from the session cache when fresh)."""
+        if self.cache is not None:
+            user = self.cache.get(email)
+            get_metrics().inc("user_cache_total", result="hit" if user is not None else "miss")
+            if user is not None:
+                return user
+        
+        user = self.users_col.find_one({"email": email}, {"password_hash": 0})
+        if user and self.cache is not None:
+            self.cache.put(email, user)
+        return user
 
     def get_user_config(self, email):
-        """Retrieves and decrypts user config."""
-        user = self.users_col.find_one({"email": email})
+        """Retrieves and decrypts user config (decrypted once per session when cached)."""
+        user = self.get_user(email)
         if not user or not user.get("saved_mongo_uri"):
             return None
+        
+        encrypted_uri = user["saved_mongo_uri"]
+        if self.cache is not None:
+            config = self.cache.get_config(email, encrypted_uri)
+            if config is not None:
+                return config
             
         try:
-            decrypted_uri = self.cipher.decrypt(user["saved_mongo_uri"]).decode()
-            return {
+            decrypted_uri = self.cipher.decrypt(encrypted_uri).decode()
+            config = {
                 "mongo_uri": decrypted_uri,
                 "db_name": user.get("saved_db_name"),
                 "collection": user.get("saved_collection")
             }
         except Exception:
             return None
+        
+        if self.cache is not None:
+            self.cache.put_config(email, encrypted_uri, config)
+        return config
 
+    @staticmethod
+    def _window_reset(now):
+        """
+        Update stage that starts a new 24h window if the current one has passed.
+        Both fields are computed from the stored values, so it is safe to run
+        alongside other sessions' writes.
+        """
+        last_reset = {"$ifNull": ["$last_reset_time", now]}
+        expired = {"$lt": [last_reset, now - timedelta(hours=24)]}
+        return {"$set": {
+            "last_reset_time": {"$cond": [expired, now, last_reset]},
+            "message_count": {"$cond": [expired, 0, {"$ifNull": ["$message_count", 0]}]},
+        }}
+
+    @staticmethod
+    def _hours_left(last_reset, now):
+        if last_reset.tzinfo is None:
+            last_reset = last_reset.replace(tzinfo=timezone.utc)
+        return max(0, 24 - ((now - last_reset).total_seconds() / 3600))
+
+    @timed("user.get_usage_stats")
     def get_usage_stats(self, email):
         """
         Checks usage limits. 
         If > 24 hours since last reset, resets count to 0.
         Returns: (current_count, max_limit, hours_until_reset)
         """
-        user = self.users_col.find_one({"email": email})
+        user = self.get_user(email)
         if not user:
             return 0, AppConfig.MAX_FREE_MESSAGES, 0
 
-        last_reset = user.get("last_reset_time", datetime.now(timezone.utc))
-        if last_reset.tzinfo is None:
-            last_reset = last_reset.replace(tzinfo=timezone.utc)
-            
         now = datetime.now(timezone.utc)
-        time_diff = now - last_reset
-        
-        # Reset if > 24 hours
-        if time_diff > timedelta(hours=24):
-            self.users_col.update_one(
+        last_reset = user.get("last_reset_time")
+        if last_reset is None or self._hours_left(last_reset, now) == 0:
+            # Same conditional reset as consume_usage(): a message another session
+            # counted after our read isn't wiped out by a blind $set
+            user = self.users_col.find_one_and_update(
                 {"email": email},
-                {"$set": {"message_count": 0, "last_reset_time": now}}
+                [self._window_reset(now)],
+                projection={"_id": 0, "message_count": 1, "last_reset_time": 1},
+                return_document=ReturnDocument.AFTER,
             )
-            return 0, AppConfig.MAX_FREE_MESSAGES, 24
-        
-        hours_left = 24 - (time_diff.total_seconds() / 3600)
-        current_count = user.get("message_count", 0)
-        
-        return current_count, AppConfig.MAX_FREE_MESSAGES, max(0, hours_left)
+            if not user:
+                return 0, AppConfig.MAX_FREE_MESSAGES, 0
+            if self.cache is not None:
+                self.cache.update(email, user)
+
+        hours_left = self._hours_left(user["last_reset_time"], now)
+        return user.get("message_count", 0), AppConfig.MAX_FREE_MESSAGES, hours_left
+
+    @timed("user.consume_usage")
+    def consume_usage(self, email):
+        """
+        Atomically resets the 24h window if it has passed and, if the user is
+        under the limit, counts one message. Single round-trip.
+        Returns: (allowed, current_count, max_limit, hours_until_reset)
+        """
+        limit = AppConfig.MAX_FREE_MESSAGES
+        now = datetime.now(timezone.utc)
+        now = now.replace(microsecond=now.microsecond // 1000 * 1000)  # BSON dates keep milliseconds
+
+        # Aggregation-pipeline update: every stage runs server-side in one write,
+        # so concurrent sessions can't interleave between the check and the $inc.
+        pipeline = [
+            self._window_reset(now),
+            {"$set": {"message_count": {
+                "$cond": [{"$lt": ["$message_count", limit]}, {"$add": ["$message_count", 1]}, "$message_count"]
+            }}},
+        ]
+
+        # The document before the write tells us whether the message was counted:
+        # replay the same window check on it instead of storing a flag
+        before = self.users_col.find_one_and_update(
+            {"email": email},
+            pipeline,
+            projection={"_id": 0, "message_count": 1, "last_reset_time": 1},
+            return_document=ReturnDocument.BEFORE,
+        )
+        if not before:
+            return False, 0, limit, 0
+
+        last_reset = before.get("last_reset_time") or now
+        if last_reset.tzinfo is None:
+            last_reset = last_reset.replace(tzinfo=timezone.utc)
+        if last_reset < now - timedelta(hours=24):
+            last_reset, count = now, 0
+        else:
+            count = before.get("message_count") or 0
+        allowed = count < limit
+        if allowed:
+            count += 1
+
+        if self.cache is not None:
+            self.cache.update(email, {"message_count": count, "last_reset_time": last_reset})
+
+        return allowed, count, limit, self._hours_left(last_reset, now)
+
+    @timed("user.refund_usage")
+    def refund_usage(self, email):
+        """Gives back a message counted by consume_usage() when the request failed."""
+        self.users_col.update_one(
+            {"email": email, "message_count": {"$gt": 0}},
+            {"$inc": {"message_count": -1}}
+        )
+        if self.cache is not None:
+            self.cache.invalidate()
 
     def increment_usage(self, email):
         """Increments the message counter by 1."""
@@ -125,6 +271,8 @@ class UserService:
             {"email": email},
             {"$inc": {"message_count": 1}}
         )
+        if self.cache is not None:
+            self.cache.invalidate()
 
     def get_global_daily_usage(self):
         """
@@ -143,13 +291,115 @@ class UserService:
             
         return doc["count"]
 
-    def increment_global_usage(self):
-        """Increments the global counter for today."""
-        today_str = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    def increment_global_usage(self, amount=1, date_str=None):
+        """Increments the global counter for today (or for date_str)."""
+        today_str = date_str or datetime.now(timezone.utc).strftime("%Y-%m-%d")
         stats_col = self.db["system_stats"]
         
         stats_col.update_one(
             {"date": today_str},
-            {"$inc": {"count": 1}},
+            {"$inc": {"count": amount}},
             upsert=True
-        )
\ No newline at end of file
+        )
+
+    def lease_global_quota(self, date_str, requested, max_daily=None):
+        """
+        Reserves up to `requested` slots of the global daily budget for this process.
+        'leased' only ever grows to max_daily, so all processes together can't overshoot it.
+        Returns the number of slots actually granted (0 when the budget is gone).
+        """
+        if max_daily is None:
+            max_daily = AppConfig.MAX_RPD
+        stats_col = self.db["system_stats"]
+        # Docs written before leasing existed only have 'count'
+        leased = {"$ifNull": ["$leased", {"$ifNull": ["$count", 0]}]}
+        
+        before = stats_col.find_one_and_update(
+            {"date": date_str},
+            [{"$set": {
+                "leased": {"$min": [max_daily, {"$add": [leased, requested]}]},
+                "count": {"$ifNull": ["$count", 0]},
+            }}],
+            upsert=True,
+            return_document=ReturnDocument.BEFORE
+        )
+        already = 0 if before is None else before.get("leased", before.get("count", 0))
+        return max(0, min(max_daily, already + requested) - already)
+
+    def release_global_quota(self, date_str, amount):
+        """Returns unused leased slots to the global daily budget."""
+        if amount <= 0:
+            return
+        self.db["system_stats"].update_one(
+            {"date": date_str, "leased": {"$gte": amount}},
+            {"$inc": {"leased": -amount}}
+        )
+
+    def revoke_token(self, jti, expires_at):
+        """Adds a token id to the deny-list until the token would have expired anyway."""
+        self.db["revoked_tokens"].update_one(
+            {"_id": jti},
+            {"$set": {"expires_at": expires_at}},
+            upsert=True
+        )
+
+    def get_revoked_tokens(self):
+        """Ids of revoked tokens that have not expired yet (a small set)."""
+        now = datetime.now(timezone.utc)
+        return {doc["_id"] for doc in self.db["revoked_tokens"].find({"expires_at": {"$gt": now}}, {"_id": 1})}
+
+    def archive_chat_messages(self, email, messages):
+        """Moves chat messages out of the session into the master DB (one insert)."""
+        if not messages:
+            return
+        now = datetime.now(timezone.utc)
+        self.db["chat_archive"].insert_many([
+            {"email": email, "role": m["role"], "content": m["content"], "archived_at": now}
+            for m in messages
+        ])
+
+    def ensure_revoked_token_indexes(self):
+        """TTL index so deny-list entries disappear once their token has expired."""
+        self.db["revoked_tokens"].create_index("expires_at", expireAfterSeconds=0)
+
+    def ensure_chat_archive_indexes(self):
+        """TTL index so archived chat messages expire from the master DB."""
+        self.db["chat_archive"].create_index("archived_at", expireAfterSeconds=AppConfig.CHAT_ARCHIVE_TTL_DAYS * 86_400)
+
+    def ensure_rate_limit_indexes(self):
+        """TTL index so per-minute rate limit buckets clean themselves up."""
+        self.db["rate_limit_buckets"].create_index("expires_at", expireAfterSeconds=0)
+
+    def reserve_rpm_slot(self, minute_bucket, max_rpm):
+        """
+        Takes one slot in the shared per-minute bucket. Single atomic round-trip.
+        Returns False if the bucket is already full.
+        """
+        buckets_col = self.db["rate_limit_buckets"]
+        expires_at = datetime.fromtimestamp((minute_bucket + 2) * 60, tz=timezone.utc)
+        
+        # A full bucket doesn't match the filter, so the upsert collides on _id.
+        # Two replicas creating the same bucket can also collide once; retry that.
+        for _ in range(2):
+            try:
+                buckets_col.update_one(
+                    {"_id": f"rpm:{minute_bucket}", "count": {"$lt": max_rpm}},
+                    {"$inc": {"count": 1}, "$setOnInsert": {"expires_at": expires_at}},
+                    upsert=True
+                )
+                return True
+            except DuplicateKeyError:
+                continue
+        return False
+
+    def get_rpm_slots_used(self, minute_bucket):
+        """Slots already taken in the shared per-minute bucket."""
+        doc = self.db["rate_limit_buckets"].find_one({"_id": f"rpm:{minute_bucket}"}, {"count": 1})
+        return doc["count"] if doc else 0
+
+    def release_rpm_slot(self, minute_bucket):
+        """Gives back a slot taken by reserve_rpm_slot()."""
+        self.db["rate_limit_buckets"].update_one(
+            {"_id": f"rpm:{minute_bucket}", "count": {"$gt": 0}},
+            {"$inc": {"count": -1}}
+        )
@@ -0,0 +1,113 @@
+import itertools
+import threading
+import time
+import streamlit as st
+from collections import deque
+from src.config import AppConfig
+from src.utils.metrics import timed
+from src.utils.rate_limiter import RateLimiterBackend, get_rate_limiter
+
+class Clock:
+    """Real time source. Tests swap in a fake with the same two methods."""
+
+    def monotonic(self) -> float:
+        return time.monotonic()
+
+    def wait(self, condition: threading.Condition, timeout: float):
+        """Waits on a held condition for up to `timeout` seconds (or until notified)."""
+        condition.wait(timeout)
+
+class AdmissionQueue:
+    """
+    Bounded FIFO in front of the LLM call.
+    Only the request at the head talks to the limiter; it waits exactly as long as
+    the limiter says an RPM slot needs to free up, then the next one moves up.
+    """
+
+    def __init__(self, limiter: RateLimiterBackend,
+                 max_queue: int = AppConfig.ADMISSION_MAX_QUEUE,
+                 max_per_user: int = AppConfig.ADMISSION_MAX_PER_USER,
+                 max_wait: float = AppConfig.ADMISSION_MAX_WAIT_SECONDS,
+                 clock: Clock = None):
+        self.limiter = limiter
+        self.max_queue = max_queue
+        self.max_per_user = max_per_user
+        self.max_wait = max_wait
+        self.clock = clock or Clock()
+        self.cond = threading.Condition()
+        self.queue = deque()  # (ticket, user_id), oldest first
+        self.tickets = itertools.count()
+
+    def _eta(self, position: int) -> float:
+        """Estimated seconds until `position` (1 = head) gets a slot."""
+        if position == 1:
+            return self.limiter.retry_after()
+        # The limiter knows how its slots free up (sliding window vs per-minute buckets)
+        return self.limiter.eta(position)
+
+    @timed("admission.admit")
+    def admit(self, user_id=None, on_wait=None) -> str:
+        """
+        Blocks until the limiter grants a slot.
+        on_wait(position, eta_seconds) is called whenever the caller has to wait.
+        Returns: "OK", "DAILY_LIMIT", "QUEUE_FULL" (backpressure) or "TIMEOUT"
+        """
+        with self.cond:
+            if len(self.queue) >= self.max_queue:
+                return "QUEUE_FULL"
+            if user_id is not None and sum(1 for _, u in self.queue if u == user_id) >= self.max_per_user:
+                return "QUEUE_FULL"
+            entry = (next(self.tickets), user_id)
+            self.queue.append(entry)
+
+        deadline = self.clock.monotonic() + self.max_wait
+        try:
+            while True:
+                # 1. Wait for our turn at the head of the queue. Only the position is read
+                # under the lock: on_wait renders UI and retry_after() may hit Mongo, and
+                # every waiting session shares this lock
+                while True:
+                    with self.cond:
+                        if self.queue[0] is entry:
+                            break
+                        position = self.queue.index(entry) + 1
+                    if deadline - self.clock.monotonic() <= 0:
+                        return "TIMEOUT"
+                    if on_wait:
+                        on_wait(position, self._eta(position))
+                    with self.cond:
+                        if self.queue[0] is not entry: # Moved up meanwhile: don't sleep through it
+                            self.clock.wait(self.cond, max(deadline - self.clock.monotonic(), 0))
+
+                # 2. Head of the queue: ask the limiter (outside our lock, it may do I/O)
+                status = self.limiter.check_limits()
+                if status != "RPM_LIMIT":
+                    return status
+
+                # 3. No RPM capacity: sleep until the oldest slot leaves the window
+                delay = self.limiter.retry_after()
+                remaining = deadline - self.clock.monotonic()
+                if remaining <= 0 or delay > remaining:
+                    return "TIMEOUT"
+                if on_wait:
+                    on_wait(1, delay)
+                with self.cond:
+                    self.clock.wait(self.cond, max(delay, 0.05))
+        finally:
+            with self.cond:
+                self.queue.remove(entry)
+                self.cond.notify_all()
+
+    def notify_capacity(self):
+        """Wakes the head early, e.g. after a reserved slot was cancelled."""
+        with self.cond:
+            self.cond.notify_all()
+
+    def depth(self) -> int:
+        with self.cond:
+            return len(self.queue)
+
+# Singleton
+@st.cache_resource
+def get_admission_queue():
+    return AdmissionQueue(get_rate_limiter())
@@ -0,0 +1,221 @@
+import base64
+import bson
+import datetime
+import decimal
+import json
+import math
+import re
+import uuid
+from typing import Any, Dict, Iterable, Iterator, Optional
+from bson import Binary, Code, DBRef, Decimal128, Int64, MaxKey, MinKey, ObjectId, Regex, Timestamp
+from bson.raw_bson import RawBSONDocument
+from bson.son import SON
+from src.config import AppConfig
+
+class BsonJsonEncoder:
+    """
+    One-pass BSON -> JSON converter built on type-dispatch tables.
+
+    mode="prompt"  : plain, readable values for the LLM (ObjectId -> hex string,
+                     dates -> ISO 8601, binary dropped/summarized).
+    mode="relaxed" : shapes compatible with bson.json_util RELAXED output
+                     ({"$oid": ...}, {"$date": ...}, {"$binary": ...}, ...).
+
+    Long strings and arrays are capped so one huge value can't blow the budget.
+    """
+
+    def __init__(self, mode: str = "prompt",
+                 max_string_chars: Optional[int] = AppConfig.CONTEXT_MAX_STRING_CHARS,
+                 max_array_items: Optional[int] = AppConfig.CONTEXT_MAX_ARRAY_ITEMS):
+        if mode not in ("prompt", "relaxed"):
+            raise ValueError(f"Unknown serializer mode: {mode}")
+        self.mode = mode
+        self.max_string_chars = max_string_chars
+        self.max_array_items = max_array_items
+        self.fields = 0          # Scalar fields emitted (since the last reset)
+        self.fields_dropped = 0  # Binary fields left out in prompt mode
+        self.table = dict(self._PROMPT if mode == "prompt" else self._RELAXED)
+
+    # --- Scalar handlers (shared) ---
+    def _str(self, v):
+        if self.max_string_chars is not None and len(v) > self.max_string_chars:
+            return v[:self.max_string_chars] + "..."
+        return v
+
+    def _float(self, v):
+        if math.isfinite(v):
+            return v
+        if self.mode == "relaxed":
+            return {"$numberDouble": "NaN" if v != v else ("Infinity" if v > 0 else "-Infinity")}
+        return str(v)
+
+    @staticmethod
+    def _regex_flags(v) -> str:
+        if isinstance(v.flags, str):
+            return v.flags
+        letters = ((re.IGNORECASE, "i"), (re.LOCALE, "l"), (re.MULTILINE, "m"),
+                   (re.DOTALL, "s"), (re.UNICODE, "u"), (re.VERBOSE, "x"))
+        return "".join(c for flag, c in letters if v.flags & flag)
+
+    # --- Prompt mode ---
+    @staticmethod
+    def _p_datetime(v):
+        return v.isoformat()
+
+    @staticmethod
+    def _p_decimal128(v):
+        return str(v.to_decimal())
+
+    @staticmethod
+    def _p_binary(v):
+        if isinstance(v, Binary) and v.subtype in (3, 4):
+            return str(v.as_uuid(v.subtype))
+        return None  # Dropped by the container
+
+    @staticmethod
+    def _p_regex(v):
+        return f"/{v.pattern}/{BsonJsonEncoder._regex_flags(v)}"
+
+    @staticmethod
+    def _p_timestamp(v):
+        return v.as_datetime().isoformat()
+
+    @staticmethod
+    def _p_dbref(v):
+        return f"{v.collection}:{v.id}"
+
+    _PROMPT = {
+        ObjectId: str,
+        Int64: int,
+        datetime.datetime: _p_datetime.__func__,
+        datetime.date: _p_datetime.__func__,
+        Decimal128: _p_decimal128.__func__,
+        decimal.Decimal: str,
+        uuid.UUID: str,
+        Binary: _p_binary.__func__,
+        bytes: _p_binary.__func__,
+        Regex: _p_regex.__func__,
+        re.Pattern: _p_regex.__func__,
+        Timestamp: _p_timestamp.__func__,
+        DBRef: _p_dbref.__func__,
+        Code: str,
+        MinKey: lambda v: "MinKey",
+        MaxKey: lambda v: "MaxKey",
+    }
+
+    # --- Relaxed extended JSON (json_util compatible) ---
+    @staticmethod
+    def _r_datetime(v):
+        if v.tzinfo is None:
+            v = v.replace(tzinfo=datetime.timezone.utc)
+        epoch = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+        if v >= epoch:
+            # Same text as json_util: milliseconds only when non-zero, offset kept
+            millis = v.microsecond // 1000
+            fraction = f".{millis:03d}" if millis else ""
+            zone = "Z" if v.utcoffset() == datetime.timedelta(0) else v.strftime("%z")
+            return {"$date": f"{v.strftime('%Y-%m-%dT%H:%M:%S')}{fraction}{zone}"}
+        millis = (v - epoch) // datetime.timedelta(milliseconds=1)
+        return {"$date": {"$numberLong": str(millis)}}
+
+    @staticmethod
+    def _r_binary(v):
+        subtype = v.subtype if isinstance(v, Binary) else 0
+        return {"$binary": {"base64": base64.b64encode(bytes(v)).decode(), "subType": f"{subtype:02x}"}}
+
+    @staticmethod
+    def _r_regex(v):
+        return {"$regularExpression": {"pattern": v.pattern, "options": BsonJsonEncoder._regex_flags(v)}}
+
+    _RELAXED = {
+        ObjectId: lambda v: {"$oid": str(v)},
+        Int64: int,
+        datetime.datetime: _r_datetime.__func__,
+        Decimal128: lambda v: {"$numberDecimal": str(v)},
+        decimal.Decimal: lambda v: {"$numberDecimal": str(v)},
+        uuid.UUID: lambda v: {"$uuid": str(v)},
+        Binary: _r_binary.__func__,
+        bytes: _r_binary.__func__,
+        Regex: _r_regex.__func__,
+        re.Pattern: _r_regex.__func__,
+        Timestamp: lambda v: {"$timestamp": {"t": v.time, "i": v.inc}},
+        DBRef: lambda v: {"$ref": v.collection, "$id": v.id},
+        Code: lambda v: {"$code": str(v)},
+        MinKey: lambda v: {"$minKey": 1},
+        MaxKey: lambda v: {"$maxKey": 1},
+    }
+
+    def _lookup(self, tp):
+        """Finds a handler through the MRO (subclasses like Int64) and caches it."""
+        for base in tp.__mro__:
+            if base in self.table:
+                handler = self.table[base]
+                break
+        else:
+            handler = str  # Unknown type: readable fallback instead of crashing json.dumps
+        self.table[tp] = handler
+        return handler
+
+    def to_jsonable(self, value: Any) -> Any:
+        """Converts a document (or any BSON value) into plain JSON types in one walk."""
+        tp = type(value)
+        # Fast path for the common JSON-native scalars
+        if tp is str:
+            self.fields += 1
+            return self._str(value)
+        if tp is int or tp is bool or value is None:
+            self.fields += 1
+            return value
+        if tp is float:
+            self.fields += 1
+            return self._float(value)
+
+        if tp is dict or tp is SON or isinstance(value, dict):
+            out = {}
+            for k, v in value.items():
+                converted = self.to_jsonable(v)
+                if converted is None and v is not None:
+                    self.fields_dropped += 1  # Handler chose to drop it (e.g. binary)
+                    self.fields -= 1
+                    continue
+                out[k] = converted
+            return out
+        if tp is list or tp is tuple:
+            if self.max_array_items is not None and len(value) > self.max_array_items:
+                items = [self.to_jsonable(v) for v in value[:self.max_array_items]]
+                items.append(f"... (+{len(value) - self.max_array_items} more)")
+                return items
+            return [self.to_jsonable(v) for v in value]
+
+        handler = self.table.get(tp) or self._lookup(tp)
+        self.fields += 1
+        return handler(value)
+
+    def reset_counts(self):
+        self.fields = 0
+        self.fields_dropped = 0
+
+    def dumps(self, doc: Any) -> str:
+        """Compact JSON for one document."""
+        return json.dumps(self.to_jsonable(doc), separators=(",", ":"), ensure_ascii=False)
+
+    def iter_dumps(self, docs: Iterable[Dict[str, Any]]) -> Iterator[str]:
+        """Streams documents straight from a cursor, one JSON string at a time."""
+        for doc in docs:
+            yield self.dumps(doc)
+
+def decode_raw_documents(cursor, max_bytes: Optional[int] = AppConfig.STREAM_MAX_BYTES) -> Iterator[Dict[str, Any]]:
+    """Decodes raw documents one at a time, stopping once max_bytes have been read."""
+    used = 0
+    for doc in cursor:
+        if isinstance(doc, RawBSONDocument):
+            raw = doc.raw
+            used += len(raw)
+            if max_bytes and used > max_bytes:
+                break
+            yield bson.decode(raw)
+        else:
+            used += len(bson.encode(doc))
+            if max_bytes and used > max_bytes:
+                break
+            yield doc
@@ -0,0 +1,100 @@
+import threading
+import time
+from collections import OrderedDict
+import streamlit as st
+from src.config import AppConfig
+from src.services.mongo_service import MongoService
+from src.utils.metrics import get_metrics
+from src.utils.mongo_pool import get_client_registry, uri_fingerprint
+
+class MongoConnectionCache:
+    """
+    Bounded server-side cache of tenant MongoService connections.
+    Keyed by (user, URI fingerprint, db, collection) with LRU + idle-TTL eviction.
+    Eviction only forgets the entry: sessions may still be using that service,
+    and the registry closes the client once nothing holds it any more.
+    """
+
+    def __init__(self, max_entries: int = AppConfig.MONGO_CONN_CACHE_MAX_ENTRIES,
+                 idle_ttl_seconds: float = AppConfig.MONGO_CONN_CACHE_IDLE_TTL_SECONDS):
+        self.lock = threading.Lock()
+        self.max_entries = max_entries
+        self.idle_ttl_seconds = idle_ttl_seconds
+        self.entries = OrderedDict()  # key -> (MongoService, last_used)
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_connect(self, user_email: str, uri: str, db_name: str, collection_name: str) -> MongoService:
+        """Returns a connected MongoService, reusing a cached one when possible."""
+        key = (user_email, uri_fingerprint(uri), db_name, collection_name)
+
+        with self.lock:
+            self._evict_expired()
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                self.entries[key] = (entry[0], time.monotonic())
+            else:
+                self.misses += 1
+
+        if entry is not None:
+            mongo_svc = entry[0]
+            # Re-acquire through the registry (keeps the pooled client alive);
+            # the ping is skipped while the client is known to be healthy.
+            mongo_svc.connect(uri, db_name, collection_name)
+            return mongo_svc
+
+        # Miss: connect outside the lock so other sessions are not blocked on I/O
+        mongo_svc = MongoService()
+        mongo_svc.connect(uri, db_name, collection_name)
+
+        with self.lock:
+            self.entries[key] = (mongo_svc, time.monotonic())
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+        return mongo_svc
+
+    def invalidate(self, user_email: str, uri: str, db_name: str, collection_name: str):
+        """Drops one cached connection (e.g. after the user changes credentials)."""
+        key = (user_email, uri_fingerprint(uri), db_name, collection_name)
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            stale_uris = self._unused_uris([(key, entry)]) if entry is not None else []
+        self._discard_clients(stale_uris)
+
+    def _evict_expired(self):
+        """Removes entries idle past the TTL. Caller must hold the lock."""
+        cutoff = time.monotonic() - self.idle_ttl_seconds
+        for k in [k for k, e in self.entries.items() if e[1] < cutoff]:
+            del self.entries[k]
+
+    def _unused_uris(self, evicted):
+        """URIs of evicted entries no remaining entry points at. Caller must hold the lock."""
+        live = {key[1] for key in self.entries}
+        uris = []
+        for key, (mongo_svc, _) in evicted:
+            if key[1] not in live and mongo_svc.uri:
+                live.add(key[1])  # Only discard each client once
+                uris.append(mongo_svc.uri)
+        return uris
+
+    @staticmethod
+    def _discard_clients(uris):
+        """Closes pooled clients no session holds, outside the lock (close() joins monitor threads)."""
+        registry = get_client_registry()
+        for uri in uris:
+            registry.discard(uri, **MongoService.CLIENT_OPTIONS)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self.entries)}
+
+# Singleton
+@st.cache_resource
+def get_connection_cache():
+    cache = MongoConnectionCache()
+    get_metrics().register_gauge("mongo_connection_cache", cache.stats)
+    return cache
@@ -0,0 +1,262 @@
+import bisect
+import functools
+import json
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict
+import streamlit as st
+from pymongo import monitoring
+
+# Bucket upper bounds per histogram family (anything not listed is a latency in seconds)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+SIZE_BUCKETS = (256, 1024, 4096, 16_384, 65_536, 262_144, 1_048_576, 4_194_304)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+BUCKETS = {
+    "mongo_ops_per_rerun": COUNT_BUCKETS,
+    "llm_prompt_bytes": SIZE_BUCKETS,
+    "llm_response_bytes": SIZE_BUCKETS,
+    "llm_prompt_tokens": SIZE_BUCKETS,
+    "llm_cached_tokens": SIZE_BUCKETS,
+    "llm_response_tokens": SIZE_BUCKETS,
+}
+
+class Histogram:
+    """Fixed-bucket histogram (Prometheus style). observe() is a bisect and an add."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.lock = threading.Lock()
+        self.bounds = list(buckets)
+        self.counts = [0] * (len(self.bounds) + 1)  # Last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        i = bisect.bisect_left(self.bounds, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+    def snapshot(self):
+        with self.lock:
+            return list(self.counts), self.sum, self.count
+
+    def quantile(self, q: float, counts=None, count=None) -> float:
+        """Estimates a quantile by interpolating inside the bucket it falls in."""
+        if counts is None:
+            counts, _, count = self.snapshot()
+        if not count:
+            return 0.0
+        rank = q * count
+        seen = 0
+        for i, c in enumerate(counts):
+            if seen + c >= rank and c:
+                if i == len(self.bounds):
+                    return self.bounds[-1]  # In +Inf: the best we can say
+                lower = self.bounds[i - 1] if i else 0.0
+                return lower + (self.bounds[i] - lower) * (rank - seen) / c
+            seen += c
+        return self.bounds[-1]
+
+class RerunOps:
+    """MongoDB round-trips of one rerun, shared with the pool threads working for it."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.value = 0
+
+    def add(self, n: int = 1):
+        with self.lock:
+            self.value += n
+
+class MongoCommandCounter(monitoring.CommandListener):
+    """
+    Counts MongoDB round-trips per script rerun and records the latency of
+    every command by name. The listener runs on the thread that issued the
+    command: the session's script thread, or a pool thread the rerun handed
+    work to through carry().
+    """
+
+    def __init__(self, registry: "MetricsRegistry"):
+        self.registry = registry
+        self.local = threading.local()  # .ops: RerunOps of the rerun this thread works for
+
+    def current(self):
+        return getattr(self.local, "ops", None)
+
+    def carry(self, fn: Callable) -> Callable:
+        """Wraps fn so its commands count toward the calling thread's rerun, wherever it runs."""
+        ops = self.current()
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            previous = self.current()
+            self.local.ops = ops
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.local.ops = previous
+        return wrapper
+
+    def started(self, event):
+        ops = self.current()
+        if ops is not None:
+            ops.add()
+
+    def succeeded(self, event):
+        self.registry.observe("mongo_command_seconds", event.duration_micros / 1e6, command=event.command_name)
+
+    def failed(self, event):
+        self.registry.observe("mongo_command_seconds", event.duration_micros / 1e6, command=event.command_name)
+        self.registry.inc("mongo_command_failures_total", command=event.command_name)
+
+class MetricsRegistry:
+    """
+    In-process metrics: histograms, counters and gauges (callbacks returning
+    a dict of numbers, e.g. a cache's stats()). Cheap enough to leave on.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}  # (name, labels) -> Histogram
+        self.counters = {}    # (name, labels) -> number
+        self.gauges = {}      # name -> callable returning {key: number}
+        self.mongo_listener = MongoCommandCounter(self)
+        self.rerun = threading.local()
+
+    @staticmethod
+    def _key(name: str, labels: dict):
+        return name, tuple(sorted(labels.items()))
+
+    def observe(self, name: str, value: float, **labels):
+        key = self._key(name, labels)
+        hist = self.histograms.get(key)
+        if hist is None:
+            with self.lock:
+                hist = self.histograms.setdefault(key, Histogram(BUCKETS.get(name, LATENCY_BUCKETS)))
+        hist.observe(value)
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        key = self._key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def register_gauge(self, name: str, fn: Callable[[], Dict[str, float]]):
+        with self.lock:
+            self.gauges[name] = fn
+
+    @contextmanager
+    def timer(self, stage: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe("stage_seconds", time.perf_counter() - started, stage=stage)
+
+    # --- Per-rerun accounting ---
+    def begin_rerun(self):
+        self.rerun.started = time.perf_counter()
+        self.mongo_listener.local.ops = RerunOps()
+
+    def end_rerun(self):
+        started = getattr(self.rerun, "started", None)
+        if started is None:
+            return
+        self.observe("stage_seconds", time.perf_counter() - started, stage="rerun")
+        self.observe("mongo_ops_per_rerun", self.mongo_listener.local.ops.value)
+        self.rerun.started = None
+        self.mongo_listener.local.ops = None
+
+    # --- Export ---
+    def _gauge_values(self):
+        with self.lock:
+            gauges = list(self.gauges.items())
+        values = {}
+        for name, fn in gauges:
+            try:
+                values[name] = {k: v for k, v in fn().items() if isinstance(v, (int, float))}
+            except Exception as e:
+                print(f"Metrics Gauge Error: {e}")
+        return values
+
+    @staticmethod
+    def _labels(labels, extra=None) -> str:
+        pairs = list(labels) + ([extra] if extra else [])
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+    def to_prometheus(self) -> str:
+        """Prometheus text exposition format."""
+        lines = []
+        with self.lock:
+            histograms = sorted(self.histograms.items())
+            counters = sorted(self.counters.items())
+
+        typed = set()
+        for (name, labels), hist in histograms:
+            if name not in typed:
+                lines.append(f"# TYPE {name} histogram")
+                typed.add(name)
+            counts, total, count = hist.snapshot()
+            cumulative = 0
+            for bound, c in zip(hist.bounds + ["+Inf"], counts):
+                cumulative += c
+                lines.append(f"{name}_bucket{self._labels(labels, ('le', bound))} {cumulative}")
+            lines.append(f"{name}_sum{self._labels(labels)} {total}")
+            lines.append(f"{name}_count{self._labels(labels)} {count}")
+
+        for (name, labels), value in counters:
+            if name not in typed:
+                lines.append(f"# TYPE {name} counter")
+                typed.add(name)
+            lines.append(f"{name}{self._labels(labels)} {value}")
+
+        for name, values in sorted(self._gauge_values().items()):
+            lines.append(f"# TYPE {name} gauge")
+            for key, value in sorted(values.items()):
+                lines.append(f"{name}{self._labels([('key', key)])} {value}")
+        return "\n".join(lines) + "\n"
+
+    def to_dict(self) -> dict:
+        """Summary with count/mean/p50/p95/p99 per histogram, plus counters and gauges."""
+        with self.lock:
+            histograms = sorted(self.histograms.items())
+            counters = sorted(self.counters.items())
+
+        out = {"histograms": {}, "counters": {}, "gauges": self._gauge_values()}
+        for (name, labels), hist in histograms:
+            counts, total, count = hist.snapshot()
+            out["histograms"].setdefault(name, []).append({
+                "labels": dict(labels),
+                "count": count,
+                "mean": total / count if count else 0.0,
+                "p50": hist.quantile(0.50, counts, count),
+                "p95": hist.quantile(0.95, counts, count),
+                "p99": hist.quantile(0.99, counts, count),
+            })
+        for (name, labels), value in counters:
+            out["counters"].setdefault(name, []).append({"labels": dict(labels), "value": value})
+        return out
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), indent=2)
+
+def timed(stage: str):
+    """Decorator: records the call's duration under stage_seconds{stage=...}."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                get_metrics().observe("stage_seconds", time.perf_counter() - started, stage=stage)
+        return wrapper
+    return decorator
+
+# Singleton
+@st.cache_resource
+def get_metrics():
+    return MetricsRegistry()
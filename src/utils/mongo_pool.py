@@ -0,0 +1,160 @@
+import atexit
+import hashlib
+import hmac
+import threading
+import time
+import weakref
+import pymongo
+import streamlit as st
+from src.config import AppConfig
+from src.utils.metrics import get_metrics
+
+def uri_fingerprint(uri: str) -> str:
+    """
+    Keyed hash of a connection string.
+    Lets us index connections by URI without keeping the raw secret in cache keys.
+    """
+    key = AppConfig.ENCRYPTION_KEY.encode()
+    return hmac.new(key, uri.encode(), hashlib.sha256).hexdigest()
+
+class MongoClientRegistry:
+    """
+    Process-wide registry of long-lived, pooled MongoClients.
+    Clients are keyed by (URI, options) so every service talking to the same
+    cluster shares one connection pool instead of opening its own.
+    Services that keep using a client register as its holders; a client is
+    only closed once no live holder is left (services are tracked weakly, so
+    a session that simply goes away stops holding its client).
+    """
+
+    def __init__(self, idle_ttl_seconds: float = AppConfig.MONGO_CLIENT_IDLE_TTL_SECONDS):
+        self.lock = threading.Lock()
+        self.idle_ttl_seconds = idle_ttl_seconds
+        self.clients = {}     # key -> MongoClient
+        self.last_used = {}   # key -> time.monotonic() of last hand-out (or last seen held)
+        self.holders = {}     # key -> WeakSet of objects still using the client
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Swappable constructor (the benchmarks plug in an in-memory stand-in)
+        self.client_factory = pymongo.MongoClient
+
+    @staticmethod
+    def _make_key(uri: str, options: dict):
+        return (uri, tuple(sorted(options.items())))
+
+    @staticmethod
+    def _default_options() -> dict:
+        return {
+            "maxPoolSize": AppConfig.MONGO_MAX_POOL_SIZE,
+            "minPoolSize": AppConfig.MONGO_MIN_POOL_SIZE,
+            "maxIdleTimeMS": AppConfig.MONGO_MAX_IDLE_TIME_MS,
+        }
+
+    def _hold(self, key, holder):
+        """Caller must hold the lock."""
+        if holder is not None:
+            self.holders.setdefault(key, weakref.WeakSet()).add(holder)
+
+    def _is_held(self, key) -> bool:
+        """Caller must hold the lock."""
+        return len(self.holders.get(key, ())) > 0
+
+    def get_client(self, uri: str, holder=None, **options) -> pymongo.MongoClient:
+        """
+        Returns the shared client for this URI/options, creating it on first use.
+        holder: the object that keeps using the client (e.g. a MongoService);
+        the client stays open for as long as it is alive.
+        """
+        merged = {**self._default_options(), **options}
+        key = self._make_key(uri, merged)
+        now = time.monotonic()
+
+        with self.lock:
+            client = self.clients.get(key)
+            if client is not None:
+                self.hits += 1
+                self.last_used[key] = now
+                self._hold(key, holder)
+                return client
+
+            # Creating the client does not do network I/O (connections are lazy),
+            # so building it under the lock is cheap and avoids duplicate pools.
+            self.misses += 1
+            # The listener counts round-trips per rerun (not part of the key)
+            client = self.client_factory(uri, event_listeners=[get_metrics().mongo_listener], **merged)
+            self.clients[key] = client
+            self.last_used[key] = now
+            self._hold(key, holder)
+
+        self.evict_idle()
+        return client
+
+    def is_open(self, client) -> bool:
+        """False once the registry has closed (or never handed out) this client."""
+        with self.lock:
+            return any(c is client for c in self.clients.values())
+
+    def _forget(self, key):
+        """Caller must hold the lock."""
+        self.last_used.pop(key, None)
+        self.holders.pop(key, None)
+        return self.clients.pop(key, None)
+
+    def discard(self, uri: str, **options):
+        """
+        Closes and forgets the client for this URI/options, unless something
+        still holds it (it is then left to evict_idle() once released).
+        """
+        merged = {**self._default_options(), **options}
+        key = self._make_key(uri, merged)
+        with self.lock:
+            client = None if self._is_held(key) else self._forget(key)
+        if client is not None:
+            client.close()
+
+    def evict_idle(self):
+        """Closes clients nothing holds that have not been handed out for longer than the idle TTL."""
+        now = time.monotonic()
+        cutoff = now - self.idle_ttl_seconds
+        with self.lock:
+            stale = []
+            for k, t in self.last_used.items():
+                if self._is_held(k):
+                    self.last_used[k] = now  # Idle time starts when the last holder lets go
+                elif t < cutoff:
+                    stale.append(k)
+            closing = [self._forget(k) for k in stale]
+            self.evictions += len(stale)
+
+        # Close outside the lock: close() joins monitor threads.
+        for client in closing:
+            client.close()
+
+    def close_all(self):
+        """Closes every pooled client. Registered to run at interpreter exit."""
+        with self.lock:
+            closing = list(self.clients.values())
+            self.clients.clear()
+            self.last_used.clear()
+            self.holders.clear()
+        for client in closing:
+            client.close()
+
+    def stats(self) -> dict:
+        """Returns pool counters: hits, misses, evictions and open clients."""
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "open_clients": len(self.clients),
+            }
+
+# Singleton
+@st.cache_resource
+def get_client_registry():
+    registry = MongoClientRegistry()
+    atexit.register(registry.close_all)
+    get_metrics().register_gauge("mongo_client_registry", registry.stats)
+    return registry
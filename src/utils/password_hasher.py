@@ -0,0 +1,123 @@
+import atexit
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+import bcrypt
+import streamlit as st
+from src.config import AppConfig
+
+class PasswordHasher:
+    """
+    Runs bcrypt on a small, bounded worker pool instead of the script thread.
+    bcrypt releases the GIL while hashing, so threads give real parallelism;
+    the pool size caps how many cores a login storm can occupy, and at most
+    max_pending jobs may wait before new ones are turned away.
+    """
+
+    def __init__(self, rounds: int = None,
+                 max_workers: int = AppConfig.PASSWORD_HASH_WORKERS,
+                 max_pending: int = AppConfig.PASSWORD_HASH_MAX_PENDING,
+                 wait_timeout: float = AppConfig.PASSWORD_HASH_WAIT_SECONDS):
+        # Resolved here, not as a default: reading the Setting loads .env
+        self.rounds = rounds if rounds is not None else AppConfig.BCRYPT_ROUNDS
+        self.wait_timeout = wait_timeout
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="bcrypt")
+        self.slots = threading.BoundedSemaphore(max_workers + max_pending)
+        atexit.register(self.shutdown)
+
+    def _run(self, fn, *args):
+        """Runs fn on the pool and waits for it. Raises RuntimeError when the pool is saturated."""
+        if not self.slots.acquire(timeout=self.wait_timeout):
+            raise RuntimeError("Login service is busy. Please try again in a moment.")
+        try:
+            future = self.executor.submit(fn, *args)
+        except Exception:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda _: self.slots.release())
+        return future.result()
+
+    def hash(self, password: str) -> bytes:
+        return self._run(self._hash, password.encode("utf-8"), self.rounds)
+
+    def verify(self, password: str, hashed: bytes) -> bool:
+        return self._run(bcrypt.checkpw, password.encode("utf-8"), hashed)
+
+    @staticmethod
+    def _hash(password: bytes, rounds: int) -> bytes:
+        return bcrypt.hashpw(password, bcrypt.gensalt(rounds=rounds))
+
+    @staticmethod
+    def cost_of(hashed: bytes) -> int:
+        """Reads the cost factor from a '$2b$12$...' hash (0 if unparseable)."""
+        try:
+            return int(hashed.split(b"$")[2])
+        except (IndexError, ValueError):
+            return 0
+
+    def needs_rehash(self, hashed: bytes) -> bool:
+        """True when a stored hash was made with a different cost than configured."""
+        return self.cost_of(hashed) != self.rounds
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+class LoginThrottle:
+    """
+    Sliding-window count of failed logins per key ("email:..." / "ip:...").
+    Keys over their limit are refused before any bcrypt work is done.
+    The number of tracked keys is bounded so a flood of random emails can't grow it forever.
+    """
+
+    def __init__(self, window_seconds: float = None,
+                 max_keys: int = AppConfig.LOGIN_THROTTLE_MAX_KEYS):
+        self.lock = threading.Lock()
+        self.window_seconds = window_seconds if window_seconds is not None else AppConfig.LOGIN_FAILURE_WINDOW_SECONDS
+        self.max_keys = max_keys
+        self.failures = OrderedDict()  # key -> deque of failure timestamps
+
+    def _recent(self, key, now):
+        """Failure timestamps for key inside the window. Caller must hold the lock."""
+        stamps = self.failures.get(key)
+        if stamps is None:
+            return None
+        while stamps and now - stamps[0] > self.window_seconds:
+            stamps.popleft()
+        if not stamps:
+            del self.failures[key]
+            return None
+        return stamps
+
+    def retry_after(self, key: str, max_failures: int) -> float:
+        """Seconds until key may try again (0 if it's not throttled)."""
+        now = time.monotonic()
+        with self.lock:
+            stamps = self._recent(key, now)
+            if stamps is None or len(stamps) < max_failures:
+                return 0.0
+            return self.window_seconds - (now - stamps[-max_failures])
+
+    def record_failure(self, key: str):
+        now = time.monotonic()
+        with self.lock:
+            stamps = self._recent(key, now)
+            if stamps is None:
+                stamps = self.failures[key] = deque()
+            stamps.append(now)
+            self.failures.move_to_end(key)
+            while len(self.failures) > self.max_keys:
+                self.failures.popitem(last=False)
+
+    def reset(self, key: str):
+        with self.lock:
+            self.failures.pop(key, None)
+
+# Singletons
+@st.cache_resource
+def get_password_hasher():
+    return PasswordHasher()
+
+@st.cache_resource
+def get_login_throttle():
+    return LoginThrottle()
@@ -0,0 +1,81 @@
+from typing import Any, Dict, Iterable, List
+from src.config import AppConfig
+
+class PipelineValidator:
+    """
+    Checks a model-written aggregation pipeline before it reaches the server:
+    read-only stages only, no server-side JavaScript, joins only within the
+    attached collections, and a bounded number of stages and nesting depth.
+    Raises ValueError on anything else.
+    """
+
+    ALLOWED_STAGES = {
+        "$match", "$project", "$addFields", "$set", "$unset", "$group", "$sort",
+        "$limit", "$skip", "$count", "$unwind", "$bucket", "$bucketAuto",
+        "$sortByCount", "$facet", "$sample", "$replaceRoot", "$replaceWith",
+        "$setWindowFields", "$lookup", "$unionWith",
+    }
+    # Rejected anywhere in a stage spec: writes and server-side JavaScript
+    FORBIDDEN_OPERATORS = {"$out", "$merge", "$where", "$function", "$accumulator"}
+
+    def __init__(self, collections: Iterable[str] = (),
+                 max_stages: int = AppConfig.AGGREGATION_MAX_STAGES,
+                 max_depth: int = AppConfig.AGGREGATION_MAX_DEPTH):
+        self.collections = set(collections)  # What $lookup / $unionWith may read
+        self.max_stages = max_stages
+        self.max_depth = max_depth
+        self.stages = 0
+
+    def validate(self, pipeline: Any) -> List[Dict[str, Any]]:
+        """Returns the pipeline unchanged if it is safe to run."""
+        self.stages = 0
+        if not pipeline:
+            raise ValueError("The pipeline has no stages.")
+        self._pipeline(pipeline, depth=0)
+        return pipeline
+
+    def _pipeline(self, pipeline, depth: int):
+        if not isinstance(pipeline, list):
+            raise ValueError("A pipeline must be a list of stages.")
+        for stage in pipeline:
+            self._stage(stage, depth)
+
+    def _stage(self, stage, depth: int):
+        if not isinstance(stage, dict) or len(stage) != 1:
+            raise ValueError("Each stage must be an object with exactly one operator.")
+        (name, spec), = stage.items()
+        if name not in self.ALLOWED_STAGES:
+            raise ValueError(f"Stage {name} is not allowed.")
+        self.stages += 1
+        if self.stages > self.max_stages:
+            raise ValueError(f"The pipeline has more than {self.max_stages} stages.")
+
+        if name == "$facet":
+            if not isinstance(spec, dict):
+                raise ValueError("$facet takes an object of sub-pipelines.")
+            for sub in spec.values():
+                self._pipeline(sub, depth + 1)
+            return
+        if name in ("$lookup", "$unionWith"):
+            if isinstance(spec, str):
+                spec = {"coll": spec}  # {"$unionWith": "other"}
+            if not isinstance(spec, dict):
+                raise ValueError(f"{name} takes an object.")
+            source = spec.get("from" if name == "$lookup" else "coll")
+            if not isinstance(source, str) or source not in self.collections:
+                raise ValueError(f"{name} can only read the attached collections.")
+            self._pipeline(spec.get("pipeline", []), depth + 1)
+            spec = {k: v for k, v in spec.items() if k != "pipeline"}
+        self._value(spec, depth + 1)
+
+    def _value(self, value, depth: int):
+        if depth > self.max_depth:
+            raise ValueError("The pipeline is nested too deeply.")
+        if isinstance(value, dict):
+            for k, v in value.items():
+                if k in self.FORBIDDEN_OPERATORS:
+                    raise ValueError(f"Operator {k} is not allowed.")
+                self._value(v, depth + 1)
+        elif isinstance(value, list):
+            for v in value:
+                self._value(v, depth + 1)
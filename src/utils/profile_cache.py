@@ -0,0 +1,45 @@
+import threading
+import time
+from collections import OrderedDict
+import streamlit as st
+from src.config import AppConfig
+
+class CollectionProfileCache:
+    """
+    Process-wide cache of collection profiles, keyed by (URI fingerprint, db, collection).
+    Entries expire after a TTL; the oldest are dropped once max_entries is reached.
+    """
+
+    def __init__(self, ttl_seconds: float = AppConfig.PROFILE_CACHE_TTL_SECONDS,
+                 max_entries: int = AppConfig.PROFILE_CACHE_MAX_ENTRIES):
+        self.lock = threading.Lock()
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # key -> (profile, created_at)
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if time.monotonic() - entry[1] > self.ttl_seconds:
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, profile):
+        with self.lock:
+            self.entries[key] = (profile, time.monotonic())
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+# Singleton
+@st.cache_resource
+def get_profile_cache():
+    return CollectionProfileCache()
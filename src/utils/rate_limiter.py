@@ -1,63 +1,335 @@
+import atexit
 import time
 import threading
 import streamlit as st
-from datetime import datetime
+from abc import ABC, abstractmethod
+from collections import deque
+from datetime import datetime, timezone
 from src.config import AppConfig
 from src.services.user_service import UserService
+from src.utils.metrics import timed
 
-class RateLimiter:
-    def __init__(self):
+class DailyQuotaLease:
+    """
+    Locally held slice of the global RPD budget.
+    Slots are leased from system_stats in small batches, so taking one is a
+    memory operation; leasing and syncing usage back happen outside the lock.
+    """
+
+    def __init__(self, lease_size: int = AppConfig.RPD_LEASE_SIZE,
+                 sync_interval: float = AppConfig.RPD_SYNC_INTERVAL_SECONDS):
         self.lock = threading.Lock()
-        self.rpm_requests = []  # Memory (Fast)
-        # We don't store daily_count here anymore; we ask DB.
+        self.lease_size = lease_size
+        self.day = None
+        self.leased = 0          # Slots granted to us for self.day
+        self.used = 0            # Slots taken by admitted requests (in flight + recorded)
+        self.exhausted_at = None # When the global budget last had nothing left for us
+        self.unsynced = {}       # date -> recorded requests not yet written to system_stats
+        self.lease_lock = threading.Lock()  # Only one thread refills the lease at a time
 
-    def _cleanup_old_requests(self):
-        """Remove requests older than 60 seconds."""
-        now = time.time()
-        self.rpm_requests = [t for t in self.rpm_requests if now - t < 60]
+        # --- Background sync ---
+        self.sync_interval = sync_interval
+        self.wakeup = threading.Event()
+        self.syncer = threading.Thread(target=self._sync_loop, name="rpd-lease-sync", daemon=True)
+        self.syncer.start()
+        atexit.register(self.shutdown)
 
-    def check_limits(self):
+    def _roll_day(self):
+        """Starts a fresh lease when the UTC date changes. Caller must hold the lock."""
+        today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+        if today != self.day:
+            self.day = today
+            self.leased = 0
+            self.used = 0
+            self.exhausted_at = None
+
+    def _try_take(self, now):
+        """Takes a slot from the local lease. Caller must hold the lock."""
+        self._roll_day()
+        if self.used >= self.leased:
+            # Budget known to be gone: don't hit the DB again until the next sync interval
+            if self.exhausted_at is not None and now - self.exhausted_at < self.sync_interval:
+                return False
+            return None  # Lease needs a refill
+
+        self.used += 1
+        if self.leased - self.used <= 1:
+            self.wakeup.set()  # Prefetch the next lease before we run dry
+        return True
+
+    def take(self) -> bool:
+        """Reserves one daily slot. Returns False when the global budget is used up."""
+        with self.lock:
+            taken = self._try_take(time.time())
+        if taken is not None:
+            return taken
+
+        # Slow path: our lease is used up. Ask the DB for more, without the lock held.
+        if not self._refill():
+            return False
+        with self.lock:
+            return bool(self._try_take(time.time()))
+
+    def give_back(self):
+        """Returns a slot taken by take() whose request never went out."""
+        with self.lock:
+            if self.used > 0:
+                self.used -= 1
+
+    def record(self):
+        """Marks a taken slot as spent; it is written to system_stats in the background."""
+        with self.lock:
+            self.unsynced[self.day] = self.unsynced.get(self.day, 0) + 1
+        self.wakeup.set()
+
+    def _refill(self, ahead: bool = False) -> bool:
         """
-        Checks both RPM (Memory) and RPD (Database).
-        Returns: "OK", "RPM_LIMIT", or "DAILY_LIMIT"
+        Leases more RPD slots from system_stats. Returns True if a slot is free.
+        With ahead=True (background prefetch) it leases even if slots remain.
         """
-        with self.lock:
-            self._cleanup_old_requests()
-            
-            # 1. Check RPM (Memory)
-            if len(self.rpm_requests) >= AppConfig.MAX_RPM:
-                return "RPM_LIMIT"
+        with self.lease_lock:
+            with self.lock:
+                self._roll_day()
+                if self.used < self.leased and not ahead:
+                    return True  # Another thread refilled while we waited
+                day = self.day
 
-            # 2. Check RPD (Database)
-            # We create a service instance just for this check
             try:
-                user_svc = UserService()
-                current_daily = user_svc.get_global_daily_usage()
-                
-                if current_daily >= AppConfig.MAX_RPD:
-                    return "DAILY_LIMIT"
-                    
+                granted = UserService().lease_global_quota(day, self.lease_size)
             except Exception as e:
                 # If DB fails, fail safe (allow request or block? Block is safer)
                 print(f"Rate Limit DB Error: {e}")
-                return "DAILY_LIMIT" # Block to be safe
+                return False
+
+            with self.lock:
+                if day != self.day:
+                    return False
+                self.leased += granted
+                self.exhausted_at = time.time() if granted == 0 else None
+                return self.used < self.leased
 
-            return "OK"
+    def _flush_usage(self):
+        """Writes recorded requests to system_stats."""
+        with self.lock:
+            pending, self.unsynced = self.unsynced, {}
+
+        for day, count in pending.items():
+            try:
+                UserService().increment_global_usage(count, date_str=day)
+            except Exception as e:
+                print(f"Rate Limit Sync Error: {e}")
+                with self.lock:
+                    self.unsynced[day] = self.unsynced.get(day, 0) + count
+
+    def _sync_loop(self):
+        """Background thread: flushes usage and keeps a lease ready."""
+        while True:
+            self.wakeup.wait(self.sync_interval)
+            self.wakeup.clear()
+            self._flush_usage()
 
+            # Prefetch only once there is demand today, so idle processes don't hoard slots
+            with self.lock:
+                self._roll_day()
+                running_low = self.used > 0 and self.exhausted_at is None and self.leased - self.used <= 1
+            if running_low:
+                self._refill(ahead=True)
+
+    def shutdown(self):
+        """Flushes pending usage and hands unused leased slots back to the global budget."""
+        self._flush_usage()
+        with self.lock:
+            day, unused = self.day, self.leased - self.used
+            self.leased = self.used
+        if day and unused > 0:
+            try:
+                UserService().release_global_quota(day, unused)
+            except Exception:
+                pass
+
+class RateLimiterBackend(ABC):
+    """
+    Interface every limiter backend implements.
+    Every "OK" from check_limits() must be followed by record_request() or cancel_request().
+    """
+
+    @abstractmethod
+    def check_limits(self) -> str:
+        """Reserves a slot if allowed. Returns: "OK", "RPM_LIMIT", or "DAILY_LIMIT"."""
+
+    @abstractmethod
     def record_request(self):
         """Call this ONLY after a successful API call."""
+
+    @abstractmethod
+    def cancel_request(self):
+        """Releases the slot reserved by check_limits() when the API call failed."""
+
+    def retry_after(self) -> float:
+        """Seconds until an RPM slot is expected to free up (0 if one is free now)."""
+        return 1.0
+
+    def eta(self, position: int) -> float:
+        """
+        Seconds until the request `position` places from the front (1 = next)
+        is expected to get a slot. Default: slots free up evenly after the first.
+        """
+        return self.retry_after() + (position - 1) * (60 / AppConfig.MAX_RPM)
+
+class InMemoryRateLimiter(RateLimiterBackend):
+    """
+    Sliding-window RPM limiter kept in process memory.
+    Only correct for a single process: every replica gets its own MAX_RPM.
+    """
+
+    def __init__(self, daily_quota: DailyQuotaLease = None):
+        self.lock = threading.Lock()
+        self.rpm_requests = deque()  # Admission timestamps, oldest first (Memory)
+        self.daily_quota = daily_quota or DailyQuotaLease()
+        self.reserved = threading.local()  # Timestamp the current thread reserved
+
+    def _cleanup_old_requests(self, now):
+        """Remove requests older than 60 seconds. Caller must hold the lock."""
+        while self.rpm_requests and now - self.rpm_requests[0] >= 60:
+            self.rpm_requests.popleft()
+
+    @timed("limiter.check_limits")
+    def check_limits(self):
+        now = time.time()
+        with self.lock:
+            self._cleanup_old_requests(now)
+
+            # 1. Check RPM (Memory)
+            if len(self.rpm_requests) >= AppConfig.MAX_RPM:
+                return "RPM_LIMIT"
+            self.rpm_requests.append(now)  # Reserve the slot before we drop the lock
+
+        # 2. Check RPD (Local lease, may refill from the DB outside our lock)
+        if not self.daily_quota.take():
+            self._drop_reservation(now)
+            return "DAILY_LIMIT"
+        self.reserved.stamp = now
+        return "OK"
+
+    def retry_after(self):
+        now = time.time()
+        with self.lock:
+            self._cleanup_old_requests(now)
+            if len(self.rpm_requests) < AppConfig.MAX_RPM:
+                return 0.0
+            # The oldest request leaves the window first
+            return max(0.0, 60 - (now - self.rpm_requests[0]))
+
+    def eta(self, position):
+        now = time.time()
+        with self.lock:
+            self._cleanup_old_requests(now)
+            stamps = list(self.rpm_requests)
+        waiting = position - (AppConfig.MAX_RPM - len(stamps))  # Free slots go first
+        if waiting <= 0:
+            return 0.0
+        # Slot i of the window frees 60s after its timestamp, then again every minute
+        rounds, i = divmod(waiting - 1, AppConfig.MAX_RPM)
+        stamp = stamps[i] if i < len(stamps) else now
+        return max(0.0, stamp + 60 * (rounds + 1) - now)
+
+    def _drop_reservation(self, stamp):
         with self.lock:
-            # 1. Record for RPM
-            self.rpm_requests.append(time.time())
-            
-            # 2. Record for RPD
             try:
-                user_svc = UserService()
-                user_svc.increment_global_usage()
+                self.rpm_requests.remove(stamp)
+            except ValueError:
+                pass  # Already aged out of the window
+
+    def record_request(self):
+        # The RPM timestamp and RPD slot were reserved by check_limits()
+        self.reserved.stamp = None
+        self.daily_quota.record()
+
+    def cancel_request(self):
+        # Only our own timestamp: the newest one may belong to another caller
+        stamp = getattr(self.reserved, "stamp", None)
+        if stamp is not None:
+            self.reserved.stamp = None
+            self._drop_reservation(stamp)
+        self.daily_quota.give_back()
+
+class MongoRateLimiter(RateLimiterBackend):
+    """
+    RPM limiter shared by every replica through per-minute buckets in the master DB.
+    Each check is one atomic upsert; buckets expire through a TTL index.
+    """
+
+    def __init__(self, daily_quota: DailyQuotaLease = None):
+        self.daily_quota = daily_quota or DailyQuotaLease()
+        self.reserved = threading.local()  # Bucket the current thread reserved in
+        try:
+            UserService().ensure_rate_limit_indexes()
+        except Exception as e:
+            print(f"Rate Limit Index Error: {e}")
+
+    @timed("limiter.check_limits")
+    def check_limits(self):
+        # 1. Check RPD first: usually a memory-only operation
+        if not self.daily_quota.take():
+            return "DAILY_LIMIT"
+
+        # 2. Check RPM (shared bucket, single round-trip)
+        bucket = int(time.time() // 60)
+        try:
+            reserved = UserService().reserve_rpm_slot(bucket, AppConfig.MAX_RPM)
+        except Exception as e:
+            print(f"Rate Limit DB Error: {e}")
+            reserved = False
+
+        if not reserved:
+            self.daily_quota.give_back()
+            return "RPM_LIMIT"
+
+        self.reserved.bucket = bucket
+        return "OK"
+
+    def record_request(self):
+        self.reserved.bucket = None  # Used: a later cancel_request() must not give it back
+        self.daily_quota.record()
+
+    def retry_after(self):
+        return self.eta(1)
+
+    def eta(self, position):
+        now = time.time()
+        try:
+            used = UserService().get_rpm_slots_used(int(now // 60))
+        except Exception as e:
+            print(f"Rate Limit DB Error: {e}")
+            used = AppConfig.MAX_RPM  # Unknown: assume full and wait for the next bucket
+        waiting = position - (AppConfig.MAX_RPM - used)  # Room left in this minute goes first
+        if waiting <= 0:
+            return 0.0
+        # Fixed per-minute buckets: MAX_RPM slots come back each time a new minute starts
+        return 60 - (now % 60) + 60 * ((waiting - 1) // AppConfig.MAX_RPM)
+
+    def cancel_request(self):
+        bucket = getattr(self.reserved, "bucket", None)
+        if bucket is not None:
+            self.reserved.bucket = None
+            try:
+                UserService().release_rpm_slot(bucket)
             except Exception:
                 pass
+        self.daily_quota.give_back()
+
+# Backwards-compatible name for the default backend
+RateLimiter = InMemoryRateLimiter
+
+BACKENDS = {
+    "memory": InMemoryRateLimiter,
+    "mongo": MongoRateLimiter,
+}
 
 # Singleton
 @st.cache_resource
-def get_rate_limiter():
-    return RateLimiter()
\ No newline at end of file
+def get_rate_limiter() -> RateLimiterBackend:
+    backend = BACKENDS.get(AppConfig.RATE_LIMIT_BACKEND)
+    if backend is None:
+        raise ValueError(f"Configuration Error: unknown RATE_LIMIT_BACKEND '{AppConfig.RATE_LIMIT_BACKEND}'.")
+    return backend()
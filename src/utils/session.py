@@ -1,14 +1,17 @@
 import streamlit as st
 from src.config import AppConfig
+from src.utils.user_cache import UserCache
 
 def init_session_state():
     """Initializes all session state variables if they don't exist."""
     defaults = {
         "message_count": 0,
-        "chat_history": [],
-        "mongo_data": None,
+        "chat_history": [], # Last CHAT_HISTORY_MAX_MESSAGES messages (see trim_chat_history)
+        "archived_messages": 0, # Older messages moved to the master DB
+        "mongo_handles": {}, # Collection name -> SnapshotHandle (shared dataset JSON, snapshot, stats, profile)
         "db_connected": False,
-        "mongo_service": None # We can store the instance if we want persistence
+        "mongo_service": None, # We can store the instance if we want persistence
+        "user_cache": UserCache() # Logged-in user's document + decrypted config
     }
     
     for key, value in defaults.items():
@@ -20,4 +23,24 @@ def check_usage_limit() -> bool:
     return st.session_state.message_count >= AppConfig.MAX_FREE_MESSAGES
 
 def increment_message_count():
-    st.session_state.message_count += 1
\ No newline at end of file
+    st.session_state.message_count += 1
+
+def trim_chat_history(archive=None):
+    """
+    Caps the session's chat history. Once it grows past CHAT_HISTORY_MAX_MESSAGES,
+    the oldest CHAT_HISTORY_SPILL_BATCH-sized chunk is handed to archive(messages)
+    (e.g. the master DB) and dropped from memory.
+    """
+    history = st.session_state.chat_history
+    if len(history) <= AppConfig.CHAT_HISTORY_MAX_MESSAGES:
+        return
+    overflow = len(history) - AppConfig.CHAT_HISTORY_MAX_MESSAGES
+    overflow += (-overflow) % AppConfig.CHAT_HISTORY_SPILL_BATCH  # Round up to whole batches
+    spilled = history[:overflow]
+    if archive:
+        try:
+            archive(spilled)
+        except Exception as e:
+            print(f"Chat Archive Error: {e}")
+    del history[:overflow]
+    st.session_state.archived_messages += len(spilled)
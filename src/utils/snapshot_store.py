@@ -0,0 +1,202 @@
+import hashlib
+import json
+import threading
+import time
+import weakref
+from collections import OrderedDict
+import bson
+import streamlit as st
+from src.config import AppConfig
+from src.utils.metrics import get_metrics
+from src.utils.mongo_pool import uri_fingerprint
+
+def snapshot_key(uri: str, db_name: str, collection_name: str, query: dict) -> str:
+    """Content address of a dataset snapshot: same source + same query -> same key."""
+    source = [uri_fingerprint(uri), db_name, collection_name, query]
+    return hashlib.sha256(json.dumps(source, sort_keys=True, default=str).encode()).hexdigest()
+
+class SnapshotEntry:
+    """One shared dataset: the ContextSnapshot, its prompt JSON, stats and profile summary."""
+
+    def __init__(self, key, snapshot, data, stats, profile_summary):
+        self.key = key
+        self.refs = 0
+        self.last_used = time.monotonic()
+        self.loaded_at = time.monotonic()
+        self.lock = threading.Lock()  # Serializes refreshes of the shared snapshot
+        self.set(snapshot, data, stats, profile_summary)
+
+    def set(self, snapshot, data, stats, profile_summary):
+        """Publishes a new version in one assignment; the snapshot must not be patched afterwards."""
+        # Approximate: BSON size of the documents plus the rendered JSON
+        docs = snapshot.docs.values() if snapshot is not None else ()
+        size = len(data.encode("utf-8")) + sum(len(bson.encode(d)) for d in docs)
+        self.state = (snapshot, data, stats, profile_summary, size)
+
+    @property
+    def snapshot(self):
+        return self.state[0]
+
+    @property
+    def data(self):
+        return self.state[1]
+
+    @property
+    def stats(self):
+        return self.state[2]
+
+    @property
+    def profile_summary(self):
+        return self.state[3]
+
+    @property
+    def size(self):
+        return self.state[4]
+
+class SnapshotHandle:
+    """
+    What a session keeps instead of its own copy of the dataset.
+    The reference is released by release(), or when the session is garbage collected.
+    """
+
+    def __init__(self, store, entry: SnapshotEntry):
+        self.entry = entry
+        self._finalizer = weakref.finalize(self, store.release, entry)
+
+    @property
+    def key(self):
+        return self.entry.key
+
+    @property
+    def data(self):
+        return self.entry.data
+
+    @property
+    def snapshot(self):
+        return self.entry.snapshot
+
+    @property
+    def stats(self):
+        return self.entry.stats
+
+    @property
+    def profile_summary(self):
+        return self.entry.profile_summary
+
+    @property
+    def lock(self):
+        return self.entry.lock
+
+    def release(self):
+        self._finalizer()  # Runs at most once
+
+class SnapshotStore:
+    """
+    Process-wide, deduplicated store of dataset snapshots.
+    Sessions on the same source and query share one entry through refcounted handles.
+    Unreferenced entries stay cached (LRU) until the byte budget or max age evicts them;
+    referenced entries are never evicted.
+    """
+
+    def __init__(self, max_bytes: int = AppConfig.SNAPSHOT_STORE_MAX_BYTES,
+                 max_age_seconds: float = AppConfig.SNAPSHOT_STORE_MAX_AGE_SECONDS):
+        self.lock = threading.Lock()
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.entries = OrderedDict()  # key -> SnapshotEntry, least recently used first
+        self.loading = {}             # key -> Event, while one session fetches it
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def acquire(self, key: str, load) -> SnapshotHandle:
+        """
+        Returns a handle to the entry for key. On a miss, load() is called once
+        (concurrent sessions wait for it) and must return
+        (snapshot, data, stats, profile_summary).
+        """
+        while True:
+            with self.lock:
+                entry = self.entries.get(key)
+                if entry is not None and entry.refs == 0 and time.monotonic() - entry.loaded_at > self.max_age_seconds:
+                    self._remove(entry)  # Nobody holds it: reload rather than serve old data
+                    entry = None
+                if entry is not None:
+                    self.hits += 1
+                    return self._handle(entry)
+                loading = self.loading.get(key)
+                if loading is None:
+                    self.misses += 1
+                    loading = self.loading[key] = threading.Event()
+                    break
+            loading.wait()  # Another session is fetching the same snapshot
+
+        try:
+            entry = SnapshotEntry(key, *load())
+        finally:
+            with self.lock:
+                self.loading.pop(key).set()
+
+        with self.lock:
+            self.entries[key] = entry
+            self.bytes += entry.size
+            handle = self._handle(entry)
+            self._evict()
+            return handle
+
+    def _handle(self, entry: SnapshotEntry) -> SnapshotHandle:
+        """Caller must hold the lock."""
+        entry.refs += 1
+        entry.last_used = time.monotonic()
+        self.entries.move_to_end(entry.key)
+        return SnapshotHandle(self, entry)
+
+    def release(self, entry: SnapshotEntry):
+        with self.lock:
+            entry.refs -= 1
+            self._evict()
+
+    def update(self, handle: SnapshotHandle, snapshot, data, stats, profile_summary):
+        """Stores a refreshed snapshot; every session holding the entry sees it."""
+        entry = handle.entry
+        with self.lock:
+            old_size = entry.size
+            entry.set(snapshot, data, stats, profile_summary)
+            if self.entries.get(entry.key) is entry:
+                self.bytes += entry.size - old_size
+            self._evict()
+
+    def _remove(self, entry: SnapshotEntry):
+        """Caller must hold the lock."""
+        del self.entries[entry.key]
+        self.bytes -= entry.size
+
+    def _evict(self):
+        """Drops least recently used, unreferenced entries while over budget. Caller must hold the lock."""
+        if self.bytes <= self.max_bytes:
+            return
+        for entry in [e for e in self.entries.values() if e.refs <= 0]:
+            self._remove(entry)
+            self.evictions += 1
+            if self.bytes <= self.max_bytes:
+                break
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "referenced": sum(1 for e in self.entries.values() if e.refs > 0),
+                "handles": sum(max(e.refs, 0) for e in self.entries.values()),
+                "bytes": self.bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+# Singleton
+@st.cache_resource
+def get_snapshot_store():
+    store = SnapshotStore()
+    get_metrics().register_gauge("snapshot_store", store.stats)
+    return store
@@ -0,0 +1,88 @@
+import threading
+import time
+from collections import OrderedDict
+import streamlit as st
+from src.config import AppConfig
+from src.services.user_service import UserService
+
+class TokenClaimsCache:
+    """
+    Process-wide cache of decoded JWT claims, keyed by the raw token.
+    Entries drop out when the token expires; the oldest go once max_entries is reached.
+    """
+
+    def __init__(self, max_entries: int = AppConfig.TOKEN_CLAIMS_CACHE_MAX_ENTRIES):
+        self.lock = threading.Lock()
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # token -> claims
+
+    def get(self, token: str):
+        with self.lock:
+            claims = self.entries.get(token)
+            if claims is None:
+                return None
+            if claims["exp"] <= time.time():
+                del self.entries[token]
+                return None
+            self.entries.move_to_end(token)
+            return claims
+
+    def put(self, token: str, claims: dict):
+        with self.lock:
+            self.entries[token] = claims
+            self.entries.move_to_end(token)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+class TokenDenyList:
+    """
+    Ids (jti) of revoked tokens. The set is small (only tokens that are
+    revoked and not yet expired), so it is re-read whole from the master DB
+    at most every refresh interval instead of on every check.
+    """
+
+    def __init__(self, refresh_seconds: float = AppConfig.TOKEN_DENYLIST_REFRESH_SECONDS):
+        self.lock = threading.Lock()
+        self.refresh_seconds = refresh_seconds
+        self.revoked = set()
+        self.pending = set()  # Revoked here but not yet seen in a reload
+        self.loaded_at = None
+
+        try:
+            UserService().ensure_revoked_token_indexes()
+        except Exception as e:
+            print(f"Token Deny-List Index Error: {e}")
+
+    def _reload(self):
+        try:
+            revoked = UserService().get_revoked_tokens()
+        except Exception as e:
+            print(f"Token Deny-List Error: {e}")
+            with self.lock:
+                self.loaded_at = time.monotonic()  # Keep the last known set; retry next interval
+            return
+        with self.lock:
+            self.pending -= revoked
+            self.revoked = revoked | self.pending
+            self.loaded_at = time.monotonic()
+
+    def is_revoked(self, jti: str) -> bool:
+        if self.loaded_at is None or time.monotonic() - self.loaded_at > self.refresh_seconds:
+            self._reload()
+        with self.lock:
+            return jti in self.revoked
+
+    def revoke(self, jti: str, expires_at):
+        with self.lock:
+            self.revoked.add(jti)
+            self.pending.add(jti)
+        UserService().revoke_token(jti, expires_at)
+
+# Singletons
+@st.cache_resource
+def get_claims_cache():
+    return TokenClaimsCache()
+
+@st.cache_resource
+def get_deny_list():
+    return TokenDenyList()
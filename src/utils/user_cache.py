@@ -0,0 +1,47 @@
+import time
+from typing import Any, Dict, Optional
+from src.config import AppConfig
+
+class UserCache:
+    """
+    Per-session copy of the logged-in user's document (lives in st.session_state).
+    UserService reads through it and writes through it, so a rerun normally
+    costs no master-DB read. The decrypted connection config is kept for as
+    long as the encrypted value it came from is unchanged.
+    """
+
+    def __init__(self, ttl_seconds: float = AppConfig.USER_CACHE_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self.email = None
+        self.user = None        # User document without the password hash
+        self.loaded_at = 0.0
+        self.config = None      # (email, encrypted_uri, decrypted config dict)
+
+    def get(self, email: str) -> Optional[Dict[str, Any]]:
+        if self.user is None or self.email != email:
+            return None
+        if time.monotonic() - self.loaded_at > self.ttl_seconds:
+            return None  # Other tabs/sessions may have changed it meanwhile
+        return self.user
+
+    def put(self, email: str, user: Dict[str, Any]):
+        self.email = email
+        self.user = {k: v for k, v in user.items() if k != "password_hash"}
+        self.loaded_at = time.monotonic()
+
+    def update(self, email: str, fields: Dict[str, Any]):
+        """Applies a write we just made to the cached document (if we hold it)."""
+        if self.user is not None and self.email == email:
+            self.user.update(fields)
+
+    def invalidate(self):
+        """Forces the next read to go to the master DB."""
+        self.user = None
+
+    def get_config(self, email: str, encrypted_uri) -> Optional[Dict[str, Any]]:
+        if self.config and self.config[0] == email and self.config[1] == encrypted_uri:
+            return dict(self.config[2])
+        return None
+
+    def put_config(self, email: str, encrypted_uri, config: Dict[str, Any]):
+        self.config = (email, encrypted_uri, dict(config))
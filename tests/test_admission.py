@@ -0,0 +1,123 @@
+import threading
+import time
+from src.config import AppConfig
+from src.utils.admission import AdmissionQueue
+from src.utils.rate_limiter import RateLimiterBackend
+
+class FakeClock:
+    """Frozen time (deadlines only pass if a test moves `now`); sleeps are recorded, not slept."""
+
+    def __init__(self):
+        self.now = 0.0
+        self.waits = []
+
+    def monotonic(self):
+        return self.now
+
+    def wait(self, condition, timeout):
+        self.waits.append(timeout)
+        condition.wait(0.01)  # Real time only so other threads get to run
+
+class FakeLimiter(RateLimiterBackend):
+    """Grants slots in admission order; check_limits() can be held shut with a gate."""
+
+    def __init__(self, verdicts=(), retry_after=0.0):
+        self.verdicts = list(verdicts)  # Returned first, then "OK"
+        self.wait_seconds = retry_after
+        self.gate = threading.Event()
+        self.gate.set()
+        self.admitted = []
+
+    def check_limits(self):
+        self.gate.wait()
+        verdict = self.verdicts.pop(0) if self.verdicts else "OK"
+        if verdict == "OK":
+            self.admitted.append(threading.current_thread().name)
+        return verdict
+
+    def record_request(self):
+        pass
+
+    def cancel_request(self):
+        pass
+
+    def retry_after(self):
+        return self.wait_seconds
+
+def wait_for_depth(queue, depth):
+    for _ in range(500):
+        if queue.depth() == depth:
+            return
+        time.sleep(0.002)
+    raise AssertionError(f"queue never reached depth {depth}")
+
+def start_admit(queue, name, results, user_id=None, on_wait=None):
+    thread = threading.Thread(name=name, target=lambda: results.update({name: queue.admit(user_id, on_wait=on_wait)}))
+    thread.start()
+    return thread
+
+def test_requests_are_admitted_in_arrival_order():
+    limiter = FakeLimiter()
+    limiter.gate.clear()  # The head sits in check_limits() until we open it
+    queue = AdmissionQueue(limiter, max_queue=10, max_per_user=1, clock=FakeClock())
+    results, threads = {}, []
+    for depth, name in enumerate(["a", "b", "c", "d"], start=1):
+        threads.append(start_admit(queue, name, results, user_id=name))
+        wait_for_depth(queue, depth)
+    limiter.gate.set()
+    for thread in threads:
+        thread.join(timeout=5)
+    assert limiter.admitted == ["a", "b", "c", "d"]
+    assert results == {"a": "OK", "b": "OK", "c": "OK", "d": "OK"}
+
+def test_queue_full_and_per_user_cap():
+    limiter = FakeLimiter()
+    limiter.gate.clear()
+    queue = AdmissionQueue(limiter, max_queue=2, max_per_user=1, clock=FakeClock())
+    results = {}
+    first = start_admit(queue, "first", results, user_id="alice")
+    wait_for_depth(queue, 1)
+    assert queue.admit("alice") == "QUEUE_FULL"  # alice already holds her one place
+    second = start_admit(queue, "second", results, user_id="bob")
+    wait_for_depth(queue, 2)
+    assert queue.admit("carol") == "QUEUE_FULL"  # max_queue reached
+    limiter.gate.set()
+    first.join(timeout=5)
+    second.join(timeout=5)
+    assert results == {"first": "OK", "second": "OK"}
+    assert queue.depth() == 0
+
+def test_eta_uses_retry_after_for_the_head(monkeypatch):
+    monkeypatch.setattr(AppConfig, "MAX_RPM", 5)
+    limiter = FakeLimiter(retry_after=7.0)
+    limiter.gate.clear()
+    queue = AdmissionQueue(limiter, max_queue=10, max_per_user=1, clock=FakeClock())
+    seen, results = [], {}
+    head = start_admit(queue, "head", results, user_id="head")
+    wait_for_depth(queue, 1)
+    second = start_admit(queue, "second", results, user_id="second", on_wait=lambda pos, eta: seen.append((pos, eta)))
+    wait_for_depth(queue, 2)
+    limiter.gate.set()
+    head.join(timeout=5)
+    second.join(timeout=5)
+    # Second in line: the head's wait plus one evenly spaced slot (the default estimate)
+    assert seen[0] == (2, 7.0 + 60 / 5)
+    assert results == {"head": "OK", "second": "OK"}
+
+def test_head_times_out_when_the_slot_frees_after_the_deadline():
+    limiter = FakeLimiter(verdicts=["RPM_LIMIT"], retry_after=30.0)
+    clock = FakeClock()
+    queue = AdmissionQueue(limiter, max_queue=10, max_wait=10, clock=clock)
+    waited = []
+    assert queue.admit("alice", on_wait=lambda pos, eta: waited.append((pos, eta))) == "TIMEOUT"
+    assert waited == [] and clock.waits == []  # Gave up at once instead of sleeping past the deadline
+    assert queue.depth() == 0
+
+def test_head_sleeps_for_retry_after_then_retries():
+    limiter = FakeLimiter(verdicts=["RPM_LIMIT"], retry_after=4.0)
+    clock = FakeClock()
+    queue = AdmissionQueue(limiter, max_queue=10, max_wait=10, clock=clock)
+    waited = []
+    assert queue.admit("alice", on_wait=lambda pos, eta: waited.append((pos, eta))) == "OK"
+    assert waited == [(1, 4.0)]
+    assert clock.waits == [4.0]
@@ -0,0 +1,40 @@
+import gc
+import time
+import pymongo
+from src.utils.mongo_pool import MongoClientRegistry
+
+class Holder:
+    """Stands in for a MongoService that keeps using its client."""
+
+def make_registry():
+    registry = MongoClientRegistry(idle_ttl_seconds=0.05)
+    # No server needed: connect=False defers all I/O
+    registry.client_factory = lambda uri, event_listeners=None, **options: pymongo.MongoClient(uri, connect=False, **options)
+    return registry
+
+def test_held_client_survives_idle_eviction():
+    registry = make_registry()
+    holder = Holder()
+    client = registry.get_client("mongodb://tenant-a:1", holder=holder)
+    time.sleep(0.1)
+    registry.get_client("mongodb://tenant-b:1")  # A miss runs evict_idle()
+    assert client in registry.clients.values()
+    assert registry.stats()["evictions"] == 0
+
+def test_discard_leaves_held_client_open():
+    registry = make_registry()
+    holder = Holder()
+    client = registry.get_client("mongodb://tenant-a:1", holder=holder)
+    registry.discard("mongodb://tenant-a:1")
+    assert client in registry.clients.values()
+
+def test_client_closed_once_its_holders_are_gone():
+    registry = make_registry()
+    holder = Holder()
+    client = registry.get_client("mongodb://tenant-a:1", holder=holder)
+    del holder
+    gc.collect()
+    time.sleep(0.1)
+    registry.get_client("mongodb://tenant-b:1")
+    assert client not in registry.clients.values()
+    assert registry.stats()["evictions"] == 1
@@ -0,0 +1,102 @@
+import multiprocessing
+import os
+import time
+import pytest
+from src.config import AppConfig
+from src.utils import rate_limiter
+from src.utils.rate_limiter import MongoRateLimiter
+
+class FakeQuota:
+    def take(self):
+        return True
+
+    def give_back(self):
+        pass
+
+    def record(self):
+        pass
+
+class FakeUserService:
+    """The per-minute buckets of the master DB, in memory."""
+    buckets = {}
+
+    def ensure_rate_limit_indexes(self):
+        pass
+
+    def reserve_rpm_slot(self, minute_bucket, max_rpm):
+        if self.buckets.get(minute_bucket, 0) >= max_rpm:
+            return False
+        self.buckets[minute_bucket] = self.buckets.get(minute_bucket, 0) + 1
+        return True
+
+    def release_rpm_slot(self, minute_bucket):
+        self.buckets[minute_bucket] -= 1
+
+    def get_rpm_slots_used(self, minute_bucket):
+        return self.buckets.get(minute_bucket, 0)
+
+@pytest.fixture
+def limiter(monkeypatch):
+    FakeUserService.buckets = {}
+    monkeypatch.setattr(rate_limiter, "UserService", FakeUserService)
+    monkeypatch.setattr(AppConfig, "MAX_RPM", 2)
+    return MongoRateLimiter(daily_quota=FakeQuota())
+
+def test_cancel_after_record_keeps_the_used_slot(limiter):
+    assert limiter.check_limits() == "OK"
+    limiter.record_request()
+    limiter.cancel_request()
+    assert sum(FakeUserService.buckets.values()) == 1
+
+def test_retry_after_is_zero_while_the_bucket_has_room(limiter):
+    assert limiter.retry_after() == 0.0
+    assert limiter.check_limits() == "OK"
+    assert limiter.check_limits() == "OK"
+    assert limiter.check_limits() == "RPM_LIMIT"
+    assert 0 < limiter.retry_after() <= 60
+
+def test_eta_counts_whole_minutes_per_bucket(limiter, monkeypatch):
+    monkeypatch.setattr(rate_limiter.time, "time", lambda: 600.0 + 45)  # 15s left in the minute
+    assert limiter.eta(2) == 0.0  # Both slots of this minute are still free
+    assert limiter.eta(3) == 15.0
+    assert limiter.eta(5) == 15.0 + 60
+
+# --- Global cap across processes (needs a real mongod) ---
+MONGO_TEST_URI = os.getenv("MONGO_TEST_URI", "mongodb://localhost:27017")
+
+def mongod_available() -> bool:
+    import pymongo
+    try:
+        pymongo.MongoClient(MONGO_TEST_URI, serverSelectionTimeoutMS=500).admin.command("ping")
+        return True
+    except Exception:
+        return False
+
+@pytest.mark.skipif(not mongod_available(), reason="no mongod at MONGO_TEST_URI")
+def test_processes_share_one_rpm_cap(monkeypatch):
+    import pymongo
+    from benchmarks.micro import _limiter_process
+
+    processes, calls, max_rpm = 4, 10, 7
+    monkeypatch.setenv("MASTER_MONGO_URI", MONGO_TEST_URI)  # Inherited by the children
+
+    # Start in a fresh minute so every process reserves in the same bucket
+    if 60 - time.time() % 60 < 15:
+        time.sleep(60 - time.time() % 60)
+    bucket = int(time.time() // 60)
+    buckets_col = pymongo.MongoClient(MONGO_TEST_URI)["mongochat_master"]["rate_limit_buckets"]
+    buckets_col.delete_one({"_id": f"rpm:{bucket}"})
+
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    start_at = time.time() + 5  # Room for the children to import and connect
+    procs = [ctx.Process(target=_limiter_process, args=(MONGO_TEST_URI, max_rpm, calls, start_at, results))
+             for _ in range(processes)]
+    for p in procs:
+        p.start()
+    admitted = [results.get(timeout=60) for _ in procs]
+    for p in procs:
+        p.join()
+
+    assert sum(admitted) == max_rpm  # Never over the cap, and the cap is actually reached
+    assert buckets_col.find_one({"_id": f"rpm:{bucket}"})["count"] == max_rpm
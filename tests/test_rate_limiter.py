@@ -0,0 +1,30 @@
+from src.config import AppConfig
+from src.utils import rate_limiter
+from src.utils.rate_limiter import InMemoryRateLimiter
+
+class FakeQuota:
+    def take(self):
+        return True
+
+    def give_back(self):
+        pass
+
+    def record(self):
+        pass
+
+def make_limiter(monkeypatch, max_rpm=2):
+    monkeypatch.setattr(AppConfig, "MAX_RPM", max_rpm)
+    return InMemoryRateLimiter(daily_quota=FakeQuota())
+
+def test_eta_follows_the_sliding_window(monkeypatch):
+    limiter = make_limiter(monkeypatch)
+    now = [1000.0]
+    monkeypatch.setattr(rate_limiter.time, "time", lambda: now[0])
+    assert limiter.eta(2) == 0.0
+    assert limiter.check_limits() == "OK"  # Frees at 1060
+    now[0] = 1030.0
+    assert limiter.check_limits() == "OK"  # Frees at 1090
+    now[0] = 1040.0
+    assert limiter.retry_after() == limiter.eta(1) == 20.0
+    assert limiter.eta(2) == 50.0
+    assert limiter.eta(3) == 80.0  # The first slot again, one minute later
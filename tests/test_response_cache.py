@@ -0,0 +1,35 @@
+from src.config import AppConfig
+from src.services.response_cache import ResponseCache
+
+CONTEXT = ResponseCache.context_hash("dataset")
+
+def make_cache(similarity=0.5):
+    return ResponseCache(similarity=similarity, persist=False)
+
+def test_exact_only_by_default():
+    assert AppConfig.RESPONSE_CACHE_SIMILARITY is None
+    cache = make_cache(similarity=AppConfig.RESPONSE_CACHE_SIMILARITY)
+    cache.put(CONTEXT, "How many orders were shipped?", "42")
+    assert cache.get(CONTEXT, "how many orders were shipped") == "42"
+    assert cache.get(CONTEXT, "Please, how many orders were shipped?") is None
+
+def test_near_match_when_only_filler_words_differ():
+    cache = make_cache()
+    cache.put(CONTEXT, "How many orders were shipped last month?", "42")
+    assert cache.get(CONTEXT, "Can you tell me how many orders were shipped last month, please?") == "42"
+    assert cache.stats()["hits_near"] == 1
+
+def test_no_near_match_when_a_negation_differs():
+    cache = make_cache()
+    cache.put(CONTEXT, "Which orders were shipped to customers in the northern region last month", "shipped")
+    assert cache.get(CONTEXT, "Which orders were not shipped to customers in the northern region last month") is None
+
+def test_no_near_match_when_an_entity_differs():
+    cache = make_cache()
+    cache.put(CONTEXT, "How many customers live in the city of berlin", "berlin")
+    assert cache.get(CONTEXT, "How many customers live in the city of paris") is None
+
+def test_no_near_match_across_contexts():
+    cache = make_cache()
+    cache.put(CONTEXT, "How many orders were shipped?", "42")
+    assert cache.get(ResponseCache.context_hash("other dataset"), "How many orders were shipped?") is None